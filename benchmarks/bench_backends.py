@@ -0,0 +1,89 @@
+"""
+Compare throughput of POSIX, SYS V and shared memory ring queues. Producer
+and consumer run in separate processes and exchange small raw messages.
+
+    python benchmarks/bench_backends.py [--count N] [--size BYTES]
+"""
+
+import argparse
+import multiprocessing
+import time
+
+from ipcqueue import posixmq, shmring, sysvmq
+from ipcqueue.serializers import RawSerializer
+
+SYSV_KEY = 0x49504351
+
+
+def open_posixmq():
+    return posixmq.Queue(
+        '/bench_posixmq', maxsize=10, maxmsgsize=1024,
+        serializer=RawSerializer)
+
+
+def open_sysvmq():
+    return sysvmq.Queue(SYSV_KEY, serializer=RawSerializer)
+
+
+def open_shmring():
+    return shmring.Queue(
+        '/bench_shmring', maxsize=1024, maxmsgsize=1024,
+        serializer=RawSerializer)
+
+
+def remove_posixmq(q):
+    q.close()
+    q.unlink()
+
+
+def remove_sysvmq(q):
+    q.close()
+
+
+def remove_shmring(q):
+    q.close()
+    q.unlink()
+
+
+BACKENDS = [
+    ('posixmq', open_posixmq, remove_posixmq),
+    ('sysvmq', open_sysvmq, remove_sysvmq),
+    ('shmring', open_shmring, remove_shmring),
+]
+
+
+def produce(open_queue, count, size):
+    q = open_queue()
+    payload = b'x' * size
+    for i in range(count):
+        q.put(payload)
+
+
+def run(open_queue, remove_queue, count, size):
+    q = open_queue()
+    producer = multiprocessing.Process(
+        target=produce, args=(open_queue, count, size))
+    start = time.time()
+    producer.start()
+    for i in range(count):
+        q.get()
+    elapsed = time.time() - start
+    producer.join()
+    remove_queue(q)
+    return elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=200000)
+    parser.add_argument('--size', type=int, default=32)
+    args = parser.parse_args()
+
+    for name, open_queue, remove_queue in BACKENDS:
+        elapsed = run(open_queue, remove_queue, args.count, args.size)
+        print('{:<10} {:>12.0f} msgs/s  {:>8.3f} s'.format(
+            name, args.count / elapsed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,70 @@
+"""
+Measure import time of the package modules by ``python -X importtime``
+in fresh interpreters, cost of modules imported by the interpreter itself
+isn't counted. With *--max-us* it exits with status 1 if the median of
+any statement exceeds the limit, so it can guard startup cost.
+
+    python benchmarks/bench_import.py [--repeat N] [--max-us US]
+"""
+
+import argparse
+import subprocess
+import sys
+
+STATEMENTS = [
+    'import ipcqueue',
+    'import ipcqueue.posixmq',
+    'import ipcqueue.sysvmq',
+    'import ipcqueue.shmring',
+]
+
+
+def import_time(statement):
+    """
+    Return cumulative import time of top-level imports of *statement*
+    in microseconds.
+    """
+    output = subprocess.check_output(
+        [sys.executable, '-X', 'importtime', '-c', statement],
+        stderr=subprocess.STDOUT, universal_newlines=True)
+    total = 0
+    for line in output.splitlines():
+        if not line.startswith('import time:'):
+            continue
+        fields = line.split('|')
+        # Nested imports are indented, their time is already included
+        if fields[2].startswith('  '):
+            continue
+        try:
+            total += int(fields[1])
+        except ValueError:
+            # Header line
+            continue
+    return total
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=20)
+    parser.add_argument('--max-us', type=int)
+    args = parser.parse_args()
+
+    # Imports of the interpreter itself, e.g. site
+    baseline = sorted(import_time('pass') for i in range(args.repeat))
+    baseline = baseline[len(baseline) // 2]
+
+    exceeded = False
+    for statement in STATEMENTS:
+        times = sorted(
+            import_time(statement) - baseline for i in range(args.repeat))
+        median = times[len(times) // 2]
+        print('{:<28} median {:>8} us  min {:>8} us'.format(
+            statement, median, times[0]))
+        if args.max_us is not None and median > args.max_us:
+            exceeded = True
+    if exceeded:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Measure throughput of one queue object shared by threads of a single
+process. Every thread count runs the same number of producer and consumer
+threads exchanging small raw messages.
+
+    python benchmarks/bench_threads.py [--count N] [--size BYTES]
+        [--threads 1,2,4,8]
+"""
+
+import argparse
+import threading
+import time
+
+from ipcqueue import posixmq, shmring, sysvmq
+from ipcqueue.serializers import RawSerializer
+
+SYSV_KEY = 0x49504352
+
+
+def open_posixmq():
+    return posixmq.Queue(
+        '/bench_threads_posixmq', maxsize=10, maxmsgsize=1024,
+        serializer=RawSerializer)
+
+
+def open_sysvmq():
+    return sysvmq.Queue(SYSV_KEY, serializer=RawSerializer)
+
+
+def open_shmring():
+    return shmring.Queue(
+        '/bench_threads_shmring', maxsize=1024, maxmsgsize=1024,
+        serializer=RawSerializer)
+
+
+def remove_posixmq(q):
+    q.close()
+    q.unlink()
+
+
+def remove_sysvmq(q):
+    q.close()
+
+
+def remove_shmring(q):
+    q.close()
+    q.unlink()
+
+
+BACKENDS = [
+    ('posixmq', open_posixmq, remove_posixmq),
+    ('sysvmq', open_sysvmq, remove_sysvmq),
+    ('shmring', open_shmring, remove_shmring),
+]
+
+
+def produce(q, count, size):
+    payload = b'x' * size
+    for i in range(count):
+        q.put(payload)
+
+
+def consume(q, count):
+    for i in range(count):
+        q.get()
+
+
+def run(open_queue, remove_queue, count, size, threads):
+    q = open_queue()
+    per_thread = count // threads
+    workers = [
+        threading.Thread(target=produce, args=(q, per_thread, size))
+        for i in range(threads)]
+    workers.extend(
+        threading.Thread(target=consume, args=(q, per_thread))
+        for i in range(threads))
+    start = time.time()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.time() - start
+    remove_queue(q)
+    return per_thread * threads, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--count', type=int, default=200000)
+    parser.add_argument('--size', type=int, default=32)
+    parser.add_argument('--threads', default='1,2,4,8')
+    args = parser.parse_args()
+
+    for name, open_queue, remove_queue in BACKENDS:
+        for threads in [int(n) for n in args.threads.split(',')]:
+            count, elapsed = run(
+                open_queue, remove_queue, args.count, args.size, threads)
+            print('{:<10} {:>3} threads {:>12.0f} msgs/s  {:>8.3f} s'.format(
+                name, threads, count / elapsed, elapsed))
+
+
+if __name__ == '__main__':
+    main()
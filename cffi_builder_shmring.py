@@ -0,0 +1,61 @@
+
+import os.path
+
+import cffi
+
+ffibuilder = cffi.FFI()
+
+ffibuilder.cdef(
+    r'''
+    typedef enum {
+        SHMRING_OK,
+        SHMRING_E,
+        SHMRING_E_VALUE,
+        SHMRING_E_PERMISSIONS,
+        SHMRING_E_RESOURCES,
+        SHMRING_E_DESCRIPTOR,
+        SHMRING_E_SIGNAL,
+        SHMRING_E_SIZE,
+        SHMRING_E_TIMEOUT,
+        SHMRING_E_DOESNT_EXIST
+    } ShmRingResult;
+
+    typedef struct {
+        size_t size;
+        size_t max_size;
+        size_t max_msgbytes;
+        size_t bytes;
+        size_t max_bytes;
+    } ShmRingAttr;
+
+    typedef struct {
+        ...;
+    } ShmRing;
+
+    ShmRingResult shmring_open(const char * const name, ShmRing ** const ring,
+            const size_t maxmsgsize, const size_t maxsize);
+
+    ShmRingResult shmring_close(ShmRing * const ring);
+
+    ShmRingResult shmring_unlink(const char * const name);
+
+    ShmRingResult shmring_put(ShmRing * const ring, const char * const msg,
+            const size_t msg_size, const double timeout);
+
+    ShmRingResult shmring_get(ShmRing * const ring, char * const buffer,
+            size_t * const size, const double timeout);
+
+    ShmRingResult shmring_get_attr(ShmRing * const ring,
+            ShmRingAttr * const attr);
+    '''
+)
+
+ffibuilder.set_source(
+    'ipcqueue._shmring',
+    '#include "ipcqueue/shmring.h"',
+    sources=['ipcqueue/shmring.c'],
+    extra_compile_args=[
+        '-I{}'.format(os.path.abspath(os.path.dirname(__file__))),
+    ],
+    libraries=['rt']
+)
@@ -15,6 +15,31 @@ http://man7.org/linux/man-pages/man7/svipc.7.html.
 POSIX queue provides receiving messages according their priority, blocking
 with timeout is supported, but doesn't provide  message's type. See
 http://man7.org/linux/man-pages/man7/mq_overview.7.html.
+
+Shared memory ring buffer queue has the same interface as POSIX queue
+without priorities, messages are exchanged in POSIX shared memory without
+system calls unless the queue is empty or full. See
+http://man7.org/linux/man-pages/man7/shm_overview.7.html.
 """
 
 __version__ = '0.9.7'
+
+_SUBMODULES = frozenset([
+    'bridge', 'coalesce', 'handoff', 'limits', 'overflow', 'posixmq',
+    'priority', 'scheduler', 'serializers', 'shmring', 'snapshot', 'sysvmq',
+    'topic', 'tracing', 'waiters', 'watermark',
+])
+
+
+def __getattr__(name):
+    # Submodules are imported on the first access (Python 3.7+), so
+    # ``import ipcqueue`` loads neither C extensions nor optional features
+    if name in _SUBMODULES:
+        import importlib
+        return importlib.import_module('.' + name, __name__)
+    raise AttributeError(
+        'module {!r} has no attribute {!r}'.format(__name__, name))
+
+
+def __dir__():
+    return sorted(set(globals()) | _SUBMODULES)
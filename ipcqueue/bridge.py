@@ -0,0 +1,485 @@
+"""
+Bridge relaying messages between hosts over TCP. :class:`Sender` drains
+a local queue and ships messages in batches to a :class:`Receiver` on the
+peer host, which puts them into its local queue. Batches are numbered and
+acknowledged, unacknowledged batches are resent after reconnect and the
+receiver drops batches it has already applied, so messages are delivered
+at least once (exactly once while the receiver runs). Messages drained
+by the sender and not acknowledged yet live in the sender's memory only.
+
+Frames are length-prefixed, a frame starts with ``<I`` size of the rest
+of the frame and ``<B`` type:
+
+* hello ``<Q`` sender's identifier, sent by the sender on connect,
+* batch ``<QI`` sequence number and count of messages, followed by
+  messages ``<Iq`` size and priority or message type, and data,
+* ack ``<Qq`` the last applied sequence number and depth of the
+  receiver's queue, sent after every batch and periodically.
+
+Bridge daemons can be started from the command line::
+
+    python -m ipcqueue.bridge receive --posixmq /foo --listen 0.0.0.0:7000
+    python -m ipcqueue.bridge send --posixmq /foo --connect host:7000
+"""
+
+import argparse
+import collections
+import errno
+import os
+import select
+import signal
+import socket
+import struct
+import threading
+import time
+
+from . import posixmq, sysvmq
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+__all__ = ['Sender', 'Receiver']
+
+_FRAME = struct.Struct('<IB')
+_HELLO = struct.Struct('<Q')
+_BATCH = struct.Struct('<QI')
+_MESSAGE = struct.Struct('<Iq')
+_ACK = struct.Struct('<Qq')
+
+_HELLO_FRAME = 1
+_BATCH_FRAME = 2
+_ACK_FRAME = 3
+
+_MAX_FRAME_SIZE = 1 << 30
+
+
+class BridgeError(Exception):
+    """
+    Indicates violation of the bridge protocol.
+    """
+
+
+def _tag_keyword(q):
+    # SYS V queues carry message type, others priority
+    if isinstance(q, sysvmq.Queue):
+        return 'msg_type'
+    return 'priority'
+
+
+def _frame(frame_type, body):
+    return _FRAME.pack(len(body) + 1, frame_type) + body
+
+
+def _parse_frames(buf):
+    # Remove complete frames from bytearray *buf* and return list of
+    # their types and bodies
+    offset = 0
+    frames = []
+    while len(buf) - offset >= _FRAME.size:
+        size, frame_type = _FRAME.unpack_from(buf, offset)
+        if size < 1 or size > _MAX_FRAME_SIZE:
+            raise BridgeError('Invalid frame size {}'.format(size))
+        end = offset + 4 + size
+        if len(buf) < end:
+            break
+        frames.append((frame_type, bytes(buf[offset + _FRAME.size:end])))
+        offset = end
+    del buf[:offset]
+    return frames
+
+
+def _parse_address(address):
+    host, port = address.rsplit(':', 1)
+    return host, int(port)
+
+
+class Sender(object):
+    """
+    Sender drains queue *q* (:class:`ipcqueue.posixmq.Queue` or
+    :class:`ipcqueue.sysvmq.Queue`) and sends messages to the receiver
+    at *address* ``(host, port)``. A batch is sent when it has
+    *batch_size* messages or *linger* seconds after its first message.
+    At most *window* batches are sent without acknowledgement. If
+    *max_remote_depth* is set, sending pauses while the receiver's queue
+    holds that many messages, including messages in flight. The local
+    queue is polled every *poll_interval* seconds when it's empty, lost
+    connection is retried every *reconnect_interval* seconds.
+    """
+
+    def __init__(self, q, address, batch_size=100, linger=0.005, window=8,
+                 max_remote_depth=None, poll_interval=0.005,
+                 reconnect_interval=0.5):
+        self._queue = q
+        self._address = address
+        self._batch_size = batch_size
+        self._linger = linger
+        self._window = window
+        self._max_remote_depth = max_remote_depth
+        self._poll_interval = poll_interval
+        self._reconnect_interval = reconnect_interval
+        self._sender_id = struct.unpack('<Q', os.urandom(8))[0]
+        self._sequence = 0
+        self._unacked = collections.OrderedDict()
+        self._remote_depth = 0
+        self._sock = None
+        self._recv_buf = bytearray()
+        self._lock = threading.Lock()
+        self._draining = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+        self.sent = 0
+        self.acked = 0
+        self.resent = 0
+
+    def start(self):
+        """
+        Run the sender in a background thread.
+        """
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        """
+        Run the sender until :meth:`close` is called.
+        """
+        while not self._closed.is_set():
+            if self._sock is None and not self._connect():
+                self._closed.wait(self._reconnect_interval)
+                continue
+            try:
+                self._read_acks(0.0)
+                if self._can_send():
+                    self._send_batch()
+                else:
+                    self._read_acks(self._poll_interval)
+            except (socket.error, BridgeError):
+                self._disconnect()
+        self._disconnect()
+
+    def metrics(self):
+        """
+        Return counters as a :class:`dict`: number of ``'sent'`` and
+        ``'acked'`` messages, ``'resent'`` batches, ``'pending'``
+        unacknowledged messages, estimated ``'remote_depth'`` and
+        ``'connected'`` flag.
+        """
+        with self._lock:
+            return {
+                'sent': self.sent,
+                'acked': self.acked,
+                'resent': self.resent,
+                'pending': sum(
+                    count for _, count in self._unacked.values()),
+                'remote_depth': self._remote_depth,
+                'connected': self._sock is not None,
+            }
+
+    def close(self, timeout=1.0):
+        """
+        Stop draining the local queue, wait at most *timeout* seconds for
+        acknowledgement of sent batches and stop the sender.
+        """
+        self._draining.set()
+        deadline = time.time() + timeout
+        while self._unacked and time.time() < deadline:
+            time.sleep(self._poll_interval)
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _connect(self):
+        try:
+            sock = socket.create_connection(
+                self._address, self._reconnect_interval)
+        except socket.error:
+            return False
+        sock.settimeout(None)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self._sock = sock
+        self._recv_buf = bytearray()
+        try:
+            sock.sendall(
+                _frame(_HELLO_FRAME, _HELLO.pack(self._sender_id)))
+            # Receiver answers with the last applied batch, resend the rest
+            if not self._read_acks(self._reconnect_interval):
+                raise socket.error(errno.ETIMEDOUT, 'No answer to hello')
+            for frame, _ in list(self._unacked.values()):
+                sock.sendall(frame)
+                self.resent += 1
+        except (socket.error, BridgeError):
+            self._disconnect()
+            return False
+        return True
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+            with self._lock:
+                self._sock = None
+
+    def _can_send(self):
+        if self._draining.is_set() or len(self._unacked) >= self._window:
+            return False
+        return (self._max_remote_depth is None or
+                self._remote_depth < self._max_remote_depth)
+
+    def _read_acks(self, timeout):
+        # Process acks received within *timeout* seconds, return True if
+        # any was received
+        readable, _, _ = select.select([self._sock], [], [], timeout)
+        if not readable:
+            return False
+        data = self._sock.recv(65536)
+        if not data:
+            raise socket.error(errno.ECONNRESET, 'Connection closed')
+        self._recv_buf.extend(data)
+        received = False
+        for frame_type, body in _parse_frames(self._recv_buf):
+            if frame_type != _ACK_FRAME:
+                raise BridgeError('Unexpected frame {}'.format(frame_type))
+            self._ack(*_ACK.unpack(body))
+            received = True
+        return received
+
+    def _ack(self, sequence, depth):
+        with self._lock:
+            while self._unacked:
+                first = next(iter(self._unacked))
+                if first > sequence:
+                    break
+                self.acked += self._unacked.pop(first)[1]
+            # Messages of batches still in flight aren't counted yet
+            self._remote_depth = depth + sum(
+                count for _, count in self._unacked.values())
+
+    def _collect(self):
+        messages = []
+        deadline = None
+        while len(messages) < self._batch_size:
+            try:
+                messages.append(self._queue.get_raw(block=False))
+            except queue.Empty:
+                now = time.time()
+                if deadline is None:
+                    if messages:
+                        deadline = now + self._linger
+                    else:
+                        return messages
+                if now >= deadline:
+                    break
+                time.sleep(min(self._poll_interval, deadline - now))
+            else:
+                if deadline is None:
+                    deadline = time.time() + self._linger
+        return messages
+
+    def _send_batch(self):
+        messages = self._collect()
+        if not messages:
+            self._read_acks(self._poll_interval)
+            return
+        self._sequence += 1
+        parts = [_BATCH.pack(self._sequence, len(messages))]
+        for data, tag in messages:
+            parts.append(_MESSAGE.pack(len(data), tag))
+            parts.append(data)
+        frame = _frame(_BATCH_FRAME, b''.join(parts))
+        with self._lock:
+            self._unacked[self._sequence] = (frame, len(messages))
+            self._remote_depth += len(messages)
+            self.sent += len(messages)
+        self._sock.sendall(frame)
+
+
+class Receiver(object):
+    """
+    Receiver listens on *address* ``(host, port)`` for senders and puts
+    received messages into queue *q* (:class:`ipcqueue.posixmq.Queue` or
+    :class:`ipcqueue.sysvmq.Queue`), blocking while it's full. Depth of
+    the queue is reported to senders after every batch and every
+    *status_interval* seconds. Port ``0`` binds a free port, see
+    :attr:`address`. Messages the queue refuses, e.g. too big ones, are
+    dropped and counted in :attr:`dropped`, so they can't stop the link.
+    """
+
+    def __init__(self, q, address=('127.0.0.1', 0), status_interval=0.1):
+        self._queue = q
+        self._status_interval = status_interval
+        self._tag_keyword = _tag_keyword(q)
+        self._server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self._server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+        self._server.bind(address)
+        self._server.listen(16)
+        self._applied = {}
+        self._lock = threading.Lock()
+        self._connections = set()
+        self._closed = threading.Event()
+        self._thread = None
+        self.received = 0
+        self.duplicates = 0
+        self.dropped = 0
+
+    @property
+    def address(self):
+        """
+        Address ``(host, port)`` the receiver listens on.
+        """
+        return self._server.getsockname()
+
+    def start(self):
+        """
+        Run the receiver in a background thread.
+        """
+        self._thread = threading.Thread(target=self.run)
+        self._thread.daemon = True
+        self._thread.start()
+
+    def run(self):
+        """
+        Accept senders until :meth:`close` is called.
+        """
+        while not self._closed.is_set():
+            readable, _, _ = select.select(
+                [self._server], [], [], self._status_interval)
+            if not readable:
+                continue
+            try:
+                sock, _ = self._server.accept()
+            except socket.error:
+                continue
+            sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+            with self._lock:
+                self._connections.add(sock)
+            thread = threading.Thread(target=self._serve, args=(sock,))
+            thread.daemon = True
+            thread.start()
+
+    def close(self):
+        """
+        Stop the receiver and close connections of senders.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        self._server.close()
+        with self._lock:
+            for sock in self._connections:
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except socket.error:
+                    pass
+
+    def _serve(self, sock):
+        sender_id = None
+        buf = bytearray()
+        try:
+            sock.settimeout(self._status_interval)
+            while not self._closed.is_set():
+                try:
+                    data = sock.recv(65536)
+                except socket.timeout:
+                    if sender_id is not None:
+                        self._send_ack(sock, sender_id)
+                    continue
+                if not data:
+                    break
+                buf.extend(data)
+                for frame_type, body in _parse_frames(buf):
+                    if frame_type == _HELLO_FRAME:
+                        sender_id = _HELLO.unpack(body)[0]
+                    elif frame_type == _BATCH_FRAME and sender_id is not None:
+                        self._apply(sender_id, body)
+                    else:
+                        raise BridgeError(
+                            'Unexpected frame {}'.format(frame_type))
+                    self._send_ack(sock, sender_id)
+        except (socket.error, BridgeError):
+            pass
+        finally:
+            with self._lock:
+                self._connections.discard(sock)
+            sock.close()
+
+    def _apply(self, sender_id, body):
+        sequence, count = _BATCH.unpack_from(body)
+        if sequence <= self._applied.get(sender_id, 0):
+            self.duplicates += count
+            return
+        offset = _BATCH.size
+        for i in range(count):
+            size, tag = _MESSAGE.unpack_from(body, offset)
+            offset += _MESSAGE.size
+            try:
+                self._queue.put_raw(
+                    body[offset:offset + size], **{self._tag_keyword: tag})
+            except (posixmq.QueueError, sysvmq.QueueError):
+                # The batch is acknowledged anyway, otherwise the sender
+                # would resend it forever
+                with self._lock:
+                    self.dropped += 1
+            offset += size
+        with self._lock:
+            self._applied[sender_id] = sequence
+            self.received += count
+
+    def _send_ack(self, sock, sender_id):
+        sock.sendall(_frame(_ACK_FRAME, _ACK.pack(
+            self._applied.get(sender_id, 0), self._queue.qsize())))
+
+
+def _open_queue(args):
+    if args.posixmq is not None:
+        return posixmq.Queue(
+            args.posixmq, maxsize=args.maxsize, maxmsgsize=args.maxmsgsize)
+    return sysvmq.Queue(args.sysvmq)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ipcqueue.bridge',
+        description='Relay messages of a local queue over TCP.')
+    parser.add_argument('mode', choices=['send', 'receive'])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--posixmq', metavar='NAME')
+    target.add_argument('--sysvmq', metavar='KEY', type=int)
+    parser.add_argument('--maxsize', type=int, default=10)
+    parser.add_argument('--maxmsgsize', type=int, default=1024)
+    parser.add_argument('--connect', metavar='HOST:PORT')
+    parser.add_argument('--listen', metavar='HOST:PORT')
+    parser.add_argument('--batch-size', type=int, default=100)
+    parser.add_argument('--linger', type=float, default=0.005)
+    parser.add_argument('--window', type=int, default=8)
+    parser.add_argument('--max-remote-depth', type=int)
+    args = parser.parse_args(argv)
+
+    q = _open_queue(args)
+    if args.mode == 'send':
+        if not args.connect:
+            parser.error('send requires --connect')
+        bridge = Sender(
+            q, _parse_address(args.connect), batch_size=args.batch_size,
+            linger=args.linger, window=args.window,
+            max_remote_depth=args.max_remote_depth)
+    else:
+        if not args.listen:
+            parser.error('receive requires --listen')
+        bridge = Receiver(q, _parse_address(args.listen))
+
+    signal.signal(signal.SIGTERM, lambda signum, frame: bridge.close())
+    bridge.start()
+    try:
+        while bridge._thread.is_alive():
+            bridge._thread.join(1)
+    except KeyboardInterrupt:
+        bridge.close()
+    finally:
+        # Closing SYS V queue removes it with already acknowledged messages
+        if isinstance(q, posixmq.Queue):
+            q.close()
+
+
+if __name__ == '__main__':
+    main()
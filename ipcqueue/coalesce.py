@@ -0,0 +1,133 @@
+"""
+Coalescing producer for state updates, where only the newest value per key
+matters. Updates are kept in a pending map in the process and only the
+latest value of each key is put into the queue.
+"""
+
+import collections
+import threading
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+__all__ = ['CoalescingProducer']
+
+
+def _is_rejected(error):
+    # Errors of items which can never be put into the queue, e.g. too big
+    # ones, constants are defined by QueueError of every queue module
+    return hasattr(error, 'TOO_BIG_MESSAGE') and error.errno in (
+        error.TOO_BIG_MESSAGE, error.INVALID_VALUE)
+
+
+class CoalescingProducer(object):
+    """
+    Producer which coalesces updates of the same key before putting them
+    into *queue* (:class:`ipcqueue.posixmq.Queue` or
+    :class:`ipcqueue.sysvmq.Queue`). Pending updates are flushed in order
+    of their first update while the queue has free space, on every
+    :meth:`update` and every *interval* seconds by a background thread
+    (``None`` disables the thread). *put_kwargs* are passed to
+    :meth:`put_nowait` of the queue, e.g. ``{'priority': 1}``. Updates
+    the queue refuses, e.g. too big ones, are dropped and counted.
+    """
+
+    def __init__(self, queue, interval=0.05, put_kwargs=None):
+        self._queue = queue
+        self._put_kwargs = put_kwargs or {}
+        self._pending = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self.submitted = 0
+        self.coalesced = 0
+        self.sent = 0
+        self.dropped = 0
+        self._thread = None
+        if interval is not None:
+            self._thread = threading.Thread(
+                target=self._flusher, args=(interval,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._pending)
+
+    def update(self, key, item):
+        """
+        Set *item* as the newest value of *key*. If the previous value
+        of *key* wasn't sent yet, it's replaced and keeps its position.
+        """
+        with self._lock:
+            if key in self._pending:
+                self.coalesced += 1
+            self._pending[key] = item
+            self.submitted += 1
+            self._flush()
+
+    def flush(self):
+        """
+        Put pending updates into the queue while it has free space. Return
+        ``True`` if all pending updates were sent.
+        """
+        with self._lock:
+            return self._flush()
+
+    def metrics(self):
+        """
+        Return counters as a :class:`dict`: number of ``'submitted'``
+        updates, updates ``'coalesced'`` away by newer values, ``'sent'``
+        updates, ``'dropped'`` updates refused by the queue and currently
+        ``'pending'`` updates.
+        """
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'coalesced': self.coalesced,
+                'sent': self.sent,
+                'dropped': self.dropped,
+                'pending': len(self._pending),
+            }
+
+    def close(self, flush=True):
+        """
+        Stop the background thread. If *flush* is ``True``, put pending
+        updates into the queue, blocking if necessary.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        if flush:
+            with self._lock:
+                while self._pending:
+                    self._put_first(self._queue.put)
+
+    def _flush(self):
+        while self._pending:
+            try:
+                self._put_first(self._queue.put_nowait)
+            except queue.Full:
+                return False
+        return True
+
+    def _put_first(self, put):
+        key, item = next(iter(self._pending.items()))
+        try:
+            put(item, **self._put_kwargs)
+        except Exception as e:
+            if not _is_rejected(e):
+                raise
+            # The item would stay at the head and block the others
+            self.dropped += 1
+        else:
+            self.sent += 1
+        del self._pending[key]
+
+    def _flusher(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                self.flush()
+            except Exception:
+                # Pending updates are retried by the next flush
+                pass
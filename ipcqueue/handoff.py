@@ -0,0 +1,120 @@
+"""
+In-process hand-off of items between producers and consumers of the same
+queue living in one process, used by queues opened with ``local=True``.
+An item is handed over in memory only to a consumer which is already
+waiting for it, so nothing gets stuck in the process when consumers run
+elsewhere; otherwise the item goes through the kernel queue as usual.
+"""
+
+import collections
+import errno
+import fcntl
+import os
+import select
+import threading
+
+__all__ = ['Channel', 'channel']
+
+_channels = {}
+_channels_lock = threading.Lock()
+
+
+def channel(key):
+    """
+    Return the :class:`Channel` of the queue identified by *key*, shared
+    by all queue objects of the process.
+    """
+    with _channels_lock:
+        try:
+            return _channels[key]
+        except KeyError:
+            result = _channels[key] = Channel()
+            return result
+
+
+class Channel(object):
+    """
+    Hand-off of items to waiting consumers. Consumers register by
+    :meth:`wait`, producers :meth:`offer` items, which are accepted only
+    if there is a waiting consumer without an item. A pipe is readable
+    while the channel has items, so consumers can wait for the kernel
+    queue and the channel at once.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._open()
+
+    def __len__(self):
+        return len(self._items)
+
+    def offer(self, item):
+        """
+        Hand *item* over to a waiting consumer. Return ``False`` if no
+        consumer is waiting.
+        """
+        with self._lock:
+            self._check_fork()
+            if self._waiting <= len(self._items):
+                return False
+            self._items.append(item)
+            os.write(self._write_fd, b'\0')
+            return True
+
+    def take(self):
+        """
+        Return tuple ``(True, item)`` with the oldest handed over item,
+        or ``(False, None)`` if there is none.
+        """
+        with self._lock:
+            self._check_fork()
+            if not self._items:
+                return False, None
+            item = self._items.popleft()
+            try:
+                os.read(self._read_fd, 1)
+            except OSError as e:
+                if e.errno != errno.EAGAIN:
+                    raise
+            return True, item
+
+    def wait(self, fds, timeout):
+        """
+        Wait at most *timeout* seconds (``None`` is forever) until an
+        item is offered or one of file descriptors *fds* is readable.
+        Return ``True`` if the channel has an item.
+        """
+        with self._lock:
+            self._check_fork()
+            self._waiting += 1
+            read_fd = self._read_fd
+        try:
+            readable, _, _ = select.select(
+                [read_fd] + list(fds), [], [], timeout)
+        finally:
+            with self._lock:
+                self._waiting = max(0, self._waiting - 1)
+                # Item offered after select returned has no other
+                # consumer left to take it
+                stranded = len(self._items) > self._waiting
+        return read_fd in readable or stranded
+
+    def _open(self):
+        self._pid = os.getpid()
+        self._items = collections.deque()
+        self._waiting = 0
+        self._read_fd, self._write_fd = os.pipe()
+        for fd in (self._read_fd, self._write_fd):
+            _set_nonblocking(fd)
+
+    def _check_fork(self):
+        # Waiting consumers and their items stayed in the parent process
+        if self._pid != os.getpid():
+            os.close(self._read_fd)
+            os.close(self._write_fd)
+            self._open()
+
+
+def _set_nonblocking(fd):
+    flags = fcntl.fcntl(fd, fcntl.F_GETFL)
+    fcntl.fcntl(fd, fcntl.F_SETFL, flags | os.O_NONBLOCK)
@@ -0,0 +1,227 @@
+"""
+Kernel limits of message queues and planning of queue sizes. Values are
+read from ``/proc/sys/fs/mqueue``, ``/proc/sys/kernel`` and resource
+limits of the process. See
+http://man7.org/linux/man-pages/man7/mq_overview.7.html and
+http://man7.org/linux/man-pages/man7/svipc.7.html.
+"""
+
+import os
+import resource
+
+__all__ = [
+    'posix_limits', 'sysv_limits', 'posix_queue_bytes', 'posix_usage',
+    'plan_posix', 'plan_sysv',
+]
+
+# Ceilings of POSIX queue attributes for processes with CAP_SYS_RESOURCE
+HARD_MSGMAX = 65536
+HARD_MSGSIZEMAX = 16 * 1024 * 1024
+
+# Kernel's bookkeeping per POSIX queue message, struct msg_msg and
+# struct posix_msg_tree_node on 64-bit systems
+_MSG_OVERHEAD = 48
+_TREE_NODE_SIZE = 48
+_MQ_PRIO_MAX = 32768
+
+_CAP_SYS_RESOURCE = 24
+
+
+def _read_sysctl(path, default=None):
+    try:
+        with open(path) as f:
+            return int(f.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return default
+
+
+def _has_cap_sys_resource():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('CapEff:'):
+                    caps = int(line.split()[1], 16)
+                    return bool(caps & (1 << _CAP_SYS_RESOURCE))
+    except (IOError, OSError, ValueError, IndexError):
+        pass
+    return os.geteuid() == 0
+
+
+def _sizes(msg_sizes):
+    if isinstance(msg_sizes, int):
+        msg_sizes = [msg_sizes]
+    msg_sizes = list(msg_sizes)
+    if not msg_sizes or min(msg_sizes) < 0:
+        raise ValueError('Message sizes must be non-empty and positive')
+    return msg_sizes
+
+
+def posix_limits():
+    """
+    Return limits of POSIX message queues as a :class:`dict`. Keys
+    ``'msg_max'`` and ``'msgsize_max'`` are the maximum *maxsize* and
+    *maxmsgsize* of the queue allowed for the current process,
+    ``'queues_max'`` is the system-wide limit of number of queues and
+    ``'bytes_max'`` is the ``RLIMIT_MSGQUEUE`` limit of bytes allocated
+    by all queues of the user (``None`` if unlimited).
+    """
+    base = '/proc/sys/fs/mqueue/'
+    if _has_cap_sys_resource():
+        msg_max = HARD_MSGMAX
+        msgsize_max = HARD_MSGSIZEMAX
+    else:
+        msg_max = _read_sysctl(base + 'msg_max', 10)
+        msgsize_max = _read_sysctl(base + 'msgsize_max', 8192)
+    bytes_max = resource.getrlimit(resource.RLIMIT_MSGQUEUE)[0]
+    if bytes_max == resource.RLIM_INFINITY:
+        bytes_max = None
+    return {
+        'msg_max': msg_max,
+        'msgsize_max': msgsize_max,
+        'msg_default': _read_sysctl(base + 'msg_default', 10),
+        'msgsize_default': _read_sysctl(base + 'msgsize_default', 8192),
+        'queues_max': _read_sysctl(base + 'queues_max', 256),
+        'bytes_max': bytes_max,
+    }
+
+
+def sysv_limits():
+    """
+    Return limits of SYS V message queues as a :class:`dict`. Key
+    ``'msgmax'`` is the maximum size of the message, limited also by the
+    size of the message buffer, ``'msgmnb'`` is the default and maximum
+    (for unprivileged processes) *max_bytes* of the queue and ``'msgmni'``
+    is the system-wide limit of number of queues.
+    """
+    from ipcqueue._sysvmq import lib
+
+    base = '/proc/sys/kernel/'
+    msgmax = _read_sysctl(base + 'msgmax', 8192)
+    return {
+        'msgmax': min(msgmax, lib.MTEXT_BUFFER_SIZE),
+        'msgmnb': _read_sysctl(base + 'msgmnb', 16384),
+        'msgmni': _read_sysctl(base + 'msgmni', 32000),
+    }
+
+
+def posix_queue_bytes(maxsize, maxmsgsize):
+    """
+    Return number of bytes charged to the user's ``RLIMIT_MSGQUEUE``
+    budget by the POSIX queue with *maxsize* and *maxmsgsize*.
+    """
+    tree_size = (maxsize * _MSG_OVERHEAD +
+                 min(maxsize, _MQ_PRIO_MAX) * _TREE_NODE_SIZE)
+    return maxsize * maxmsgsize + tree_size
+
+
+def posix_usage(names=None):
+    """
+    Return a :class:`list` of :class:`dict` with budget usage of POSIX
+    queues *names*. If *names* is ``None``, queues owned by the current
+    user are found in ``/dev/mqueue``, if it's mounted. Every item
+    contains keys ``'name'``, ``'max_size'``, ``'max_msgbytes'``,
+    ``'bytes'`` charged to the user's budget and ``'budget'``, fraction
+    of the ``RLIMIT_MSGQUEUE`` (``None`` if unlimited).
+    """
+    from ipcqueue._posixmq import ffi, lib
+
+    if names is None:
+        names = []
+        if os.path.isdir('/dev/mqueue'):
+            uid = os.geteuid()
+            for name in sorted(os.listdir('/dev/mqueue')):
+                if os.stat(os.path.join('/dev/mqueue', name)).st_uid == uid:
+                    names.append('/' + name)
+
+    bytes_max = posix_limits()['bytes_max']
+    usage = []
+    mq = ffi.new('int *')
+    attr = ffi.new('struct mq_attr *')
+    for name in names:
+        if lib.posixmq_attach(name.encode('utf-8'), mq) != lib.POSIXMQ_OK:
+            continue
+        try:
+            if lib.posixmq_get_attr(mq[0], attr) != lib.POSIXMQ_OK:
+                continue
+        finally:
+            lib.posixmq_close(mq[0])
+        queue_bytes = posix_queue_bytes(attr.mq_maxmsg, attr.mq_msgsize)
+        usage.append({
+            'name': name,
+            'max_size': attr.mq_maxmsg,
+            'max_msgbytes': attr.mq_msgsize,
+            'bytes': queue_bytes,
+            'budget': (
+                None if bytes_max is None
+                else float(queue_bytes) / bytes_max),
+        })
+    return usage
+
+
+def plan_posix(msg_sizes, budget=None):
+    """
+    Compute the largest feasible *maxsize* and *maxmsgsize* of a POSIX
+    queue for messages of *msg_sizes* (size of serialized message in
+    bytes, or a sample of sizes). *budget* is a maximum number of bytes
+    charged to the user's ``RLIMIT_MSGQUEUE``, default is the part of the
+    limit not used by other queues of the user. Return :class:`dict`
+    ``{'maxsize': 10, 'maxmsgsize': 1024, 'bytes': 10720}``. Raise
+    :class:`ValueError` if messages can't fit into the queue.
+    """
+    limits = posix_limits()
+    maxmsgsize = max(_sizes(msg_sizes))
+    if maxmsgsize > limits['msgsize_max']:
+        raise ValueError('Message size {} exceeds limit {}'.format(
+            maxmsgsize, limits['msgsize_max']))
+    maxmsgsize = max(maxmsgsize, 1)
+
+    if budget is None:
+        budget = limits['bytes_max']
+        if budget is not None:
+            budget -= sum(item['bytes'] for item in posix_usage())
+    if budget is None:
+        maxsize = limits['msg_max']
+    else:
+        per_message = maxmsgsize + _MSG_OVERHEAD + _TREE_NODE_SIZE
+        maxsize = min(limits['msg_max'], budget // per_message)
+    if maxsize < 1:
+        raise ValueError('Budget {} is too small'.format(budget))
+
+    return {
+        'maxsize': maxsize,
+        'maxmsgsize': maxmsgsize,
+        'bytes': posix_queue_bytes(maxsize, maxmsgsize),
+    }
+
+
+def plan_sysv(msg_sizes, budget=None):
+    """
+    Compute the largest feasible *max_bytes* of a SYS V queue for
+    messages of *msg_sizes* (size of serialized message in bytes, or a
+    sample of sizes). *budget* is a maximum number of bytes in the queue,
+    it's bounded by ``msgmnb`` unless the process has ``CAP_SYS_RESOURCE``.
+    Return :class:`dict` ``{'max_bytes': 16384, 'expected_size': 32}``,
+    where *expected_size* is number of messages of average size which
+    fit into the queue. Raise :class:`ValueError` if messages can't fit
+    into the queue.
+    """
+    limits = sysv_limits()
+    sizes = _sizes(msg_sizes)
+    if max(sizes) > limits['msgmax']:
+        raise ValueError('Message size {} exceeds limit {}'.format(
+            max(sizes), limits['msgmax']))
+
+    if budget is None:
+        max_bytes = limits['msgmnb']
+    elif _has_cap_sys_resource():
+        max_bytes = budget
+    else:
+        max_bytes = min(budget, limits['msgmnb'])
+    if max_bytes < max(sizes):
+        raise ValueError('Budget {} is too small'.format(max_bytes))
+
+    average = max(1.0, float(sum(sizes)) / len(sizes))
+    return {
+        'max_bytes': max_bytes,
+        'expected_size': int(max_bytes // average),
+    }
@@ -0,0 +1,322 @@
+"""
+Spill-to-disk overflow tier for message queues. When the kernel queue is
+full, serialized messages are appended to segment files on local disk
+and moved back into the queue when space frees up.
+"""
+
+import errno
+import mmap
+import os
+import struct
+import threading
+import zlib
+
+__all__ = ['SpillBuffer', 'Overflow']
+
+_FRAME = struct.Struct('<IIq')
+_CHECKPOINT = struct.Struct('<QQ')
+_SEGMENT_SUFFIX = '.seg'
+_CHECKPOINT_NAME = 'checkpoint'
+
+
+def _segment_name(number):
+    return '{:020d}{}'.format(number, _SEGMENT_SUFFIX)
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class SpillBuffer(object):
+    """
+    Append-only buffer of serialized messages on disk, stored in
+    *directory*. Messages are appended as CRC protected frames to segment
+    files, a new segment is started when the current one exceeds
+    *segment_size* bytes. Segments are read through :mod:`mmap` and
+    removed when all their messages are consumed. The read position is
+    persisted by :meth:`checkpoint`; after a crash, torn frames at the end
+    of the last segment are truncated and messages consumed after the
+    last checkpoint are delivered again. Full segments are always flushed
+    to the disk when rotated; if *fsync* is ``True``, every append and
+    checkpoint is flushed as well.
+    """
+
+    def __init__(self, directory, segment_size=64 * 1024 * 1024,
+                 fsync=False):
+        try:
+            os.makedirs(directory)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._directory = directory
+        self._segment_size = segment_size
+        self._fsync = fsync
+        self._read_map = None
+        self._read_map_size = 0
+        self._write_fd = None
+        self._count = 0
+        self._recover()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, data, tag=0):
+        """
+        Append serialized *data* with *tag* (priority or message type)
+        to the end of the buffer. *data* is a buffer or a sequence of
+        buffers, which are concatenated.
+        """
+        if isinstance(data, (list, tuple)):
+            data = b''.join(data)
+        elif not isinstance(data, bytes):
+            data = memoryview(data).tobytes()
+        if self._write_size >= self._segment_size:
+            self._rotate()
+        header = _FRAME.pack(len(data), zlib.crc32(data) & 0xffffffff, tag)
+        os.write(self._write_fd, header + data)
+        if self._fsync:
+            os.fsync(self._write_fd)
+        self._write_size += _FRAME.size + len(data)
+        self._count += 1
+
+    def peek(self):
+        """
+        Return the oldest message as ``(data, tag)`` tuple without removing
+        it, or ``None`` if the buffer is empty.
+        """
+        if not self._count:
+            return None
+        while self._read_offset >= self._segment_length(self._read_segment):
+            self._next_read_segment()
+        buf = self._map_read_segment(self._read_offset + _FRAME.size)
+        size, _, tag = _FRAME.unpack_from(buf, self._read_offset)
+        start = self._read_offset + _FRAME.size
+        buf = self._map_read_segment(start + size)
+        return buf[start:start + size], tag
+
+    def pop(self):
+        """
+        Remove the oldest message, returned by :meth:`peek`.
+        """
+        buf = self._map_read_segment(self._read_offset + _FRAME.size)
+        size = _FRAME.unpack_from(buf, self._read_offset)[0]
+        self._read_offset += _FRAME.size + size
+        self._count -= 1
+
+    def checkpoint(self):
+        """
+        Atomically persist the read position and remove consumed segments.
+        """
+        if (self._read_segment != self._write_segment and
+                self._read_offset >= self._segment_length(self._read_segment)):
+            self._next_read_segment()
+        path = os.path.join(self._directory, _CHECKPOINT_NAME)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            f.write(_CHECKPOINT.pack(self._read_segment, self._read_offset))
+            if self._fsync:
+                f.flush()
+                os.fsync(f.fileno())
+        os.rename(tmp_path, path)
+        for number in self._segments():
+            if number < self._read_segment:
+                os.unlink(self._segment_path(number))
+
+    def close(self):
+        """
+        Persist the read position and close segment files.
+        """
+        if self._write_fd is None:
+            return
+        self.checkpoint()
+        self._unmap_read_segment()
+        os.close(self._write_fd)
+        self._write_fd = None
+
+    def _segments(self):
+        return sorted(
+            int(name[:-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(self._directory)
+            if name.endswith(_SEGMENT_SUFFIX))
+
+    def _segment_path(self, number):
+        return os.path.join(self._directory, _segment_name(number))
+
+    def _segment_length(self, number):
+        if number == self._write_segment:
+            return self._write_size
+        return os.path.getsize(self._segment_path(number))
+
+    def _recover(self):
+        segments = self._segments()
+        try:
+            path = os.path.join(self._directory, _CHECKPOINT_NAME)
+            with open(path, 'rb') as f:
+                read_segment, read_offset = _CHECKPOINT.unpack(f.read())
+        except (IOError, OSError, struct.error):
+            read_segment = segments[0] if segments else 0
+            read_offset = 0
+        segments = [number for number in segments if number >= read_segment]
+        if not segments or segments[0] != read_segment:
+            read_offset = 0
+            read_segment = segments[0] if segments else read_segment
+
+        self._count = 0
+        for number in segments:
+            offset = read_offset if number == read_segment else 0
+            end, count = self._scan_segment(number, offset)
+            self._count += count
+            if end < os.path.getsize(self._segment_path(number)):
+                # Torn write, drop the incomplete tail
+                with open(self._segment_path(number), 'r+b') as f:
+                    f.truncate(end)
+
+        self._read_segment = read_segment
+        self._read_offset = read_offset
+        self._write_segment = segments[-1] if segments else read_segment
+        self._open_write_segment()
+
+    def _scan_segment(self, number, offset):
+        count = 0
+        with open(self._segment_path(number), 'rb') as f:
+            f.seek(offset)
+            while True:
+                header = f.read(_FRAME.size)
+                if len(header) < _FRAME.size:
+                    break
+                size, crc, _ = _FRAME.unpack(header)
+                data = f.read(size)
+                if len(data) < size or zlib.crc32(data) & 0xffffffff != crc:
+                    break
+                offset += _FRAME.size + size
+                count += 1
+        return offset, count
+
+    def _open_write_segment(self):
+        path = self._segment_path(self._write_segment)
+        self._write_fd = os.open(
+            path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        self._write_size = os.fstat(self._write_fd).st_size
+
+    def _rotate(self):
+        os.fsync(self._write_fd)
+        os.close(self._write_fd)
+        self._write_segment += 1
+        self._open_write_segment()
+        _fsync_dir(self._directory)
+
+    def _next_read_segment(self):
+        self._unmap_read_segment()
+        self._read_segment += 1
+        self._read_offset = 0
+
+    def _map_read_segment(self, length):
+        if self._read_map is None or self._read_map_size < length:
+            self._unmap_read_segment()
+            with open(self._segment_path(self._read_segment), 'rb') as f:
+                self._read_map_size = os.fstat(f.fileno()).st_size
+                self._read_map = mmap.mmap(
+                    f.fileno(), self._read_map_size, access=mmap.ACCESS_READ)
+        return self._read_map
+
+    def _unmap_read_segment(self):
+        if self._read_map is not None:
+            self._read_map.close()
+            self._read_map = None
+            self._read_map_size = 0
+
+
+class Overflow(object):
+    """
+    Overflow tier of the queue. *send* is a callable which puts serialized
+    data with tag into the kernel queue without blocking, it returns
+    ``False`` if the queue is full. When the queue is full, or messages
+    are already spilled, data is appended to :class:`SpillBuffer` in
+    *directory*, so the order of messages is preserved. If
+    *refill_interval* isn't ``None``, a background thread moves spilled
+    messages back to the queue every *refill_interval* seconds.
+    *rejected* is a callable which returns ``True`` if an exception
+    raised by *send* means that the data can never be sent, e.g. it's
+    too big for the queue. Such spilled messages are dropped, so they
+    don't block the following ones, and counted in :attr:`dropped`.
+    """
+
+    def __init__(self, directory, send, segment_size=64 * 1024 * 1024,
+                 fsync=False, refill_interval=0.05, rejected=None):
+        self._buffer = SpillBuffer(
+            directory, segment_size=segment_size, fsync=fsync)
+        self._send = send
+        self._rejected = rejected or (lambda error: False)
+        self.dropped = 0
+        self._lock = threading.Lock()
+        self._closed = threading.Event()
+        self._thread = None
+        if refill_interval is not None:
+            self._thread = threading.Thread(
+                target=self._refiller, args=(refill_interval,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __len__(self):
+        return len(self._buffer)
+
+    def put(self, data, tag):
+        """
+        Send *data* into the queue, or spill it to the disk. Return ``True``
+        if data was sent, ``False`` if it was spilled.
+        """
+        with self._lock:
+            if self._refill() and self._send(data, tag):
+                return True
+            self._buffer.append(data, tag)
+            return False
+
+    def refill(self):
+        """
+        Move spilled messages into the queue while it has free space.
+        Return ``True`` if all spilled messages were moved.
+        """
+        with self._lock:
+            return self._refill()
+
+    def close(self):
+        """
+        Stop the refiller thread and close the spill buffer.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            self._buffer.close()
+
+    def _refill(self):
+        moved = 0
+        try:
+            while len(self._buffer):
+                data, tag = self._buffer.peek()
+                try:
+                    if not self._send(data, tag):
+                        return False
+                except Exception as e:
+                    if not self._rejected(e):
+                        raise
+                    self.dropped += 1
+                self._buffer.pop()
+                moved += 1
+            return True
+        finally:
+            if moved:
+                self._buffer.checkpoint()
+
+    def _refiller(self, interval):
+        while not self._closed.wait(interval):
+            try:
+                self.refill()
+            except Exception:
+                # E.g. the queue was removed, keep spilled messages and
+                # retry, put() raises the error to the producer
+                pass
@@ -8,11 +8,14 @@
 #include <math.h>
 #include <mqueue.h>
 #include <stdlib.h>
+#include <string.h>
 #include <sys/stat.h>
 #include <sys/time.h>
 
 #include "posixmq.h"
 
+#define GATHER_STACK_BUFFER_SIZE 4096
+
 
 static void inline timeout_to_timespec(const double timeout,
         struct timespec * const abs_timeout) {
@@ -65,6 +68,36 @@ PosixMqResult posixmq_open(const char * const name, int * const mq,
     }
 }
 
+PosixMqResult posixmq_attach(const char * const name, int * const mq) {
+    mqd_t mqdes = mq_open(name, O_RDWR);
+
+    if (mqdes < 0) {
+        switch (errno) {
+            case EACCES:
+                return POSIXMQ_E_PERMISSIONS;
+                break;
+            case EINVAL:
+            case ENAMETOOLONG:
+                return POSIXMQ_E_VALUE;
+                break;
+            case ENOENT:
+                return POSIXMQ_E_DOESNT_EXIST;
+                break;
+            case EMFILE:
+            case ENFILE:
+            case ENOMEM:
+                return POSIXMQ_E_RESOURCES;
+                break;
+            default:
+                return POSIXMQ_E;
+        }
+    }
+    else {
+        *mq = mqdes;
+        return POSIXMQ_OK;
+    }
+}
+
 PosixMqResult posixmq_close(const int mq) {
     if (mq_close(mq) < 0) {
         switch (errno) {
@@ -101,21 +134,19 @@ PosixMqResult posixmq_unlink(const char * const name) {
     }
 }
 
-PosixMqResult posixmq_put(const int mq, const char * const msg,
+static PosixMqResult send_msg(const int mq, const char * const msg,
         const size_t size, const unsigned int priority,
-        const double timeout) {
+        const struct timespec * const abs_timeout) {
 
     ssize_t res;
 
-    if (isinf(timeout)) {
+    if (abs_timeout == NULL) {
         /* Block forever */
         res = mq_send(mq, msg, size, priority);
     }
     else {
         /* Block with timeout */
-        struct timespec abs_timeout;
-        timeout_to_timespec(timeout, &abs_timeout);
-        res = mq_timedsend(mq, msg, size, priority, &abs_timeout);
+        res = mq_timedsend(mq, msg, size, priority, abs_timeout);
     }
 
     if (res < 0) {
@@ -144,21 +175,100 @@ PosixMqResult posixmq_put(const int mq, const char * const msg,
     }
 }
 
-PosixMqResult posixmq_get(const int mq, char * const buffer,
-        size_t * const size, unsigned int * const priority,
+PosixMqResult posixmq_put(const int mq, const char * const msg,
+        const size_t size, const unsigned int priority,
         const double timeout) {
 
+    if (isinf(timeout)) {
+        return send_msg(mq, msg, size, priority, NULL);
+    }
+    else {
+        struct timespec abs_timeout;
+        timeout_to_timespec(timeout, &abs_timeout);
+        return send_msg(mq, msg, size, priority, &abs_timeout);
+    }
+}
+
+PosixMqResult posixmq_putv(const int mq, const char * const * const msgs,
+        const size_t * const msg_sizes, const size_t count,
+        const unsigned int priority, const double timeout) {
+
+    char stack_buffer[GATHER_STACK_BUFFER_SIZE];
+    char *buffer = stack_buffer;
+    PosixMqResult res;
+    size_t size = 0;
+    size_t i;
+
+    if (count == 0) {
+        return posixmq_put(mq, "", 0, priority, timeout);
+    }
+    else if (count == 1) {
+        return posixmq_put(mq, msgs[0], msg_sizes[0], priority, timeout);
+    }
+
+    for (i = 0; i < count; ++i) {
+        size += msg_sizes[i];
+    }
+    if (size > GATHER_STACK_BUFFER_SIZE) {
+        buffer = malloc(size);
+        if (buffer == NULL) {
+            return POSIXMQ_E_RESOURCES;
+        }
+    }
+    size = 0;
+    for (i = 0; i < count; ++i) {
+        memcpy(buffer + size, msgs[i], msg_sizes[i]);
+        size += msg_sizes[i];
+    }
+
+    res = posixmq_put(mq, buffer, size, priority, timeout);
+
+    if (buffer != stack_buffer) {
+        free(buffer);
+    }
+    return res;
+}
+
+PosixMqResult posixmq_put_many(const int * const mqs, const size_t count,
+        const char * const msg, const size_t msg_size,
+        const unsigned int priority, const double timeout,
+        PosixMqResult * const results) {
+
+    /* All queues share the same deadline */
+    struct timespec abs_timeout;
+    struct timespec *abs_timeout_ptr = NULL;
+    PosixMqResult res = POSIXMQ_OK;
+    size_t i;
+
+    if (!isinf(timeout)) {
+        timeout_to_timespec(timeout, &abs_timeout);
+        abs_timeout_ptr = &abs_timeout;
+    }
+
+    for (i = 0; i < count; ++i) {
+        results[i] = send_msg(mqs[i], msg, msg_size, priority,
+                abs_timeout_ptr);
+        if (results[i] != POSIXMQ_OK) {
+            res = POSIXMQ_E;
+        }
+    }
+
+    return res;
+}
+
+static PosixMqResult receive_msg(const int mq, char * const buffer,
+        size_t * const size, unsigned int * const priority,
+        const struct timespec * const abs_timeout) {
+
     ssize_t res;
 
-    if (isinf(timeout)) {
+    if (abs_timeout == NULL) {
         /* Block forever */
         res = mq_receive(mq, buffer, *size, priority);
     }
     else {
         /* Block with timeout */
-        struct timespec abs_timeout;
-        timeout_to_timespec(timeout, &abs_timeout);
-        res = mq_timedreceive(mq, buffer, *size, priority, &abs_timeout);
+        res = mq_timedreceive(mq, buffer, *size, priority, abs_timeout);
     }
 
     if (res < 0) {
@@ -188,6 +298,88 @@ PosixMqResult posixmq_get(const int mq, char * const buffer,
     }
 }
 
+PosixMqResult posixmq_get(const int mq, char * const buffer,
+        size_t * const size, unsigned int * const priority,
+        const double timeout) {
+
+    struct timespec abs_timeout;
+
+    if (isinf(timeout)) {
+        return receive_msg(mq, buffer, size, priority, NULL);
+    }
+    else {
+        timeout_to_timespec(timeout, &abs_timeout);
+        return receive_msg(mq, buffer, size, priority, &abs_timeout);
+    }
+}
+
+PosixMqResult posixmq_get_batch(const int mq, char * const buffer,
+        const size_t buffer_size, size_t * const msg_sizes,
+        unsigned int * const priorities, const size_t max_count,
+        size_t * const count) {
+
+    /* Receive messages without blocking until the queue is empty, or
+       until the buffer can't hold a message of the maximum size */
+    struct mq_attr attr;
+    struct timespec abs_timeout;
+    size_t offset = 0;
+    size_t size;
+    PosixMqResult res;
+
+    *count = 0;
+    res = posixmq_get_attr(mq, &attr);
+    if (res != POSIXMQ_OK) {
+        return res;
+    }
+    timeout_to_timespec(0.0, &abs_timeout);
+
+    while (*count < max_count &&
+            buffer_size - offset >= (size_t)attr.mq_msgsize) {
+        size = buffer_size - offset;
+        res = receive_msg(mq, buffer + offset, &size,
+                priorities + *count, &abs_timeout);
+        if (res == POSIXMQ_E_TIMEOUT) {
+            break;
+        }
+        else if (res != POSIXMQ_OK) {
+            return res;
+        }
+        msg_sizes[*count] = size;
+        offset += size;
+        ++*count;
+    }
+
+    return POSIXMQ_OK;
+}
+
+PosixMqResult posixmq_put_batch(const int mq, const char * const buffer,
+        const size_t * const msg_sizes,
+        const unsigned int * const priorities, const size_t count,
+        const double timeout, size_t * const sent) {
+
+    /* All messages share the same deadline */
+    struct timespec abs_timeout;
+    struct timespec *abs_timeout_ptr = NULL;
+    size_t offset = 0;
+    PosixMqResult res;
+
+    if (!isinf(timeout)) {
+        timeout_to_timespec(timeout, &abs_timeout);
+        abs_timeout_ptr = &abs_timeout;
+    }
+
+    for (*sent = 0; *sent < count; ++*sent) {
+        res = send_msg(mq, buffer + offset, msg_sizes[*sent],
+                priorities[*sent], abs_timeout_ptr);
+        if (res != POSIXMQ_OK) {
+            return res;
+        }
+        offset += msg_sizes[*sent];
+    }
+
+    return POSIXMQ_OK;
+}
+
 PosixMqResult posixmq_get_attr(const int mq, struct mq_attr * const attr) {
     if (mq_getattr(mq, attr) < 0) {
         switch (errno) {
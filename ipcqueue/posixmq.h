@@ -20,6 +20,8 @@ typedef enum {
 PosixMqResult posixmq_open(const char * const name, int * const mq,
         const size_t maxmsgsize, const size_t maxsize);
 
+PosixMqResult posixmq_attach(const char * const name, int * const mq);
+
 PosixMqResult posixmq_close(const int mq);
 
 PosixMqResult posixmq_unlink(const char * const name);
@@ -28,10 +30,29 @@ PosixMqResult posixmq_put(const int mq, const char * const msg,
         const size_t msg_size, const unsigned int priority,
         const double timeout);
 
+PosixMqResult posixmq_putv(const int mq, const char * const * const msgs,
+        const size_t * const msg_sizes, const size_t count,
+        const unsigned int priority, const double timeout);
+
+PosixMqResult posixmq_put_many(const int * const mqs, const size_t count,
+        const char * const msg, const size_t msg_size,
+        const unsigned int priority, const double timeout,
+        PosixMqResult * const results);
+
 PosixMqResult posixmq_get(const int mq, char * const buffer,
         size_t * const size, unsigned int * const priority,
         const double timeout);
 
+PosixMqResult posixmq_get_batch(const int mq, char * const buffer,
+        const size_t buffer_size, size_t * const msg_sizes,
+        unsigned int * const priorities, const size_t max_count,
+        size_t * const count);
+
+PosixMqResult posixmq_put_batch(const int mq, const char * const buffer,
+        const size_t * const msg_sizes,
+        const unsigned int * const priorities, const size_t count,
+        const double timeout, size_t * const sent);
+
 PosixMqResult posixmq_get_attr(const int mq, struct mq_attr * const attr);
 
 #endif
@@ -2,12 +2,15 @@
 Interprocess POSIX message queue implementation.
 """
 
+import threading
+import time
+
 from .serializers import PickleSerializer
 
 try:
-    import Queue as queue
-except ImportError:
     import queue
+except ImportError:
+    import Queue as queue
 
 from ipcqueue._posixmq import ffi, lib
 
@@ -52,7 +55,7 @@ class QueueError(Exception):
             try:
                 msg = self._errno_to_str_map[errno]
             except KeyError:
-                msg = self._errno_to_str_map[-1]
+                msg = self._errno_to_str_map[self.ERROR]
         self.errno = errno
         self.msg = msg
         super(QueueError, self).__init__('{}, {}'.format(errno, msg))
@@ -68,19 +71,43 @@ def unlink(name):
         raise QueueError(res)
 
 
+def _size(data):
+    if isinstance(data, bytes):
+        return len(data)
+    elif isinstance(data, (list, tuple)):
+        return sum(_size(part) for part in data)
+    return memoryview(data).nbytes
+
+
+def _is_rejected(error):
+    # Errors of data which can never be sent into the queue
+    return isinstance(error, QueueError) and error.errno in (
+        QueueError.TOO_BIG_MESSAGE, QueueError.INVALID_VALUE)
+
+
 class Queue(object):
     """
-    POSIX message queue.
+    POSIX message queue. The queue object can be shared by threads,
+    concurrent :meth:`put` and :meth:`get` calls are safe and don't
+    contend on any lock unless watermarks, overflow or scheduler are set.
+    Blocking calls release the GIL. Don't call :meth:`close` while other
+    threads use the queue.
     """
 
-    def __init__(self, name, maxsize=10, maxmsgsize=1024, serializer=PickleSerializer):
+    def __init__(self, name, maxsize=10, maxmsgsize=1024, serializer=PickleSerializer,
+                 local=False):
         """
         Constructor for message queue. *name* is an unique identifier of the
         queue, must starts with ``/``. *maxsize* is an integer that sets
         the upperbound limit on the number of items that can be placed in
         the queue (maximum value depends on system limit). *maxmsgsize*
         is a maximum size of the message in bytes (maximum value depends
-        on hard system limit).
+        on hard system limit). If *local* is ``True``, items put by
+        a thread of the process are handed over to a consumer of the same
+        process already waiting in :meth:`get` without serialization and
+        the kernel, see :mod:`ipcqueue.handoff`. Other items still go
+        through the kernel queue. Handed over items are the same objects,
+        not copies.
         """
         queue_name = ffi.new('char[]', name.encode('utf-8'))
         queue_id = ffi.new('int *')
@@ -90,13 +117,47 @@ class Queue(object):
         self._queue_id = queue_id[0]
         self._name = name
         self._maxsize = maxsize
-        self._max_msg_size = maxmsgsize
+        # An existing queue keeps its own attributes
+        attr = ffi.new('struct mq_attr *')
+        res = lib.posixmq_get_attr(self._queue_id, attr)
+        if res != lib.POSIXMQ_OK:
+            raise QueueError(res)
+        self._max_msg_size = attr.mq_msgsize
         self._serializer = serializer
+        self._local = threading.local()
+        self._handoff = None
+        if local:
+            from . import handoff
+            self._handoff = handoff.channel(('posixmq', name))
+        self._watermarks = None
+        self._overflow = None
+        self._scheduler = None
+
+    @classmethod
+    def open_auto(cls, name, msg_sizes, budget=None,
+                  serializer=PickleSerializer):
+        """
+        Open message queue *name* with the largest *maxsize* and
+        *maxmsgsize* allowed by kernel limits for messages of *msg_sizes*
+        (size of serialized message in bytes, or a sample of sizes).
+        *budget* is a maximum number of bytes charged to the user's
+        ``RLIMIT_MSGQUEUE``, see :func:`ipcqueue.limits.plan_posix`.
+        """
+        from . import limits
+        plan = limits.plan_posix(msg_sizes, budget=budget)
+        return cls(name, maxsize=plan['maxsize'],
+                   maxmsgsize=plan['maxmsgsize'], serializer=serializer)
 
     def close(self):
         """
         Close a message queue.
         """
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+        if self._overflow is not None:
+            self._overflow.close()
+            self._overflow = None
         res = lib.posixmq_close(self._queue_id)
         if res != lib.POSIXMQ_OK:
             raise QueueError(res)
@@ -109,7 +170,7 @@ class Queue(object):
         """
         unlink(self._name)
 
-    def put(self, item, block=True, timeout=None, priority=0):
+    def put(self, item, block=True, timeout=None, priority=0, delay=None):
         """
         Put *item* into the queue. If *block* is ``True`` and *timeout* is
         ``None`` (the default), block if necessary until a free slot is
@@ -119,21 +180,57 @@ class Queue(object):
         ``False``), put an *item* on the queue if a free slot is immediately
         available, else raise the :class:`queue.Full` exception (*timeout*
         is ignored in that case). *priority* is a priority of the message,
-        the highest valued items are retrieved first.
+        the highest valued items are retrieved first. If overflow is set
+        by :meth:`set_overflow`, *item* is spilled to the disk instead
+        of blocking when the queue is full. If *delay* is set, *item* is
+        put into the queue after *delay* seconds by the scheduler set by
+        :meth:`set_scheduler`, *block* and *timeout* are ignored.
         """
+        if (self._handoff is not None and delay is None and
+                self._overflow is None and self._handoff.offer(item)):
+            return
+        self.put_raw(
+            self._serializer.dumps(item), block=block, timeout=timeout,
+            priority=priority, delay=delay)
+
+    def put_raw(self, data, block=True, timeout=None, priority=0,
+                delay=None):
+        """
+        Put *data* into the queue as it is, without the serializer. *data*
+        is any C-contiguous object supporting the buffer protocol, e.g.
+        :class:`bytes`, :class:`bytearray`, :class:`memoryview` or
+        :class:`array.array`, it's passed to the kernel without copying.
+        *data* can be also a :class:`list` or :class:`tuple` of such
+        objects, they are gathered into one message in C. Serializers
+        can return the same types. Other arguments are the same as
+        for :meth:`put`.
+        """
+        if _size(data) > self._max_msg_size:
+            raise QueueError(lib.POSIXMQ_E_SIZE)
+
+        if delay is not None:
+            self._schedule(data, time.time() + delay, priority)
+            return
         if not block:
             timeout = 0.0
         elif timeout is None:
             timeout = float('inf')
-        data = self._serializer.dumps(item)
 
-        res = lib.posixmq_put(
-                self._queue_id, data, len(data), priority, timeout)
+        if self._overflow is not None:
+            self._overflow.put(data, priority)
+        else:
+            self._send(data, priority, timeout)
 
-        if res == lib.POSIXMQ_E_TIMEOUT:
-            raise queue.Full
-        elif res != lib.POSIXMQ_OK:
-            raise QueueError(res)
+    def put_at(self, item, when, priority=0):
+        """
+        Put *item* into the queue at time *when* (seconds since the epoch)
+        by the scheduler set by :meth:`set_scheduler`. *priority* is
+        a priority of the message.
+        """
+        data = self._serializer.dumps(item)
+        if _size(data) > self._max_msg_size:
+            raise QueueError(lib.POSIXMQ_E_SIZE)
+        self._schedule(data, when, priority)
 
     def put_nowait(self, item, priority=0):
         """
@@ -144,6 +241,102 @@ class Queue(object):
         """
         return self.put(item, block=False, priority=priority)
 
+    def put_if_below(self, item, watermark, block=True, timeout=None,
+                     priority=0):
+        """
+        Put *item* into the queue only if the number of messages in the
+        queue is below *watermark*, else raise the :class:`queue.Full`
+        exception. The depth is sampled as configured by
+        :meth:`set_watermarks`, or read from the queue on every call if
+        watermarks are not set. Other arguments are the same as
+        for :meth:`put`.
+        """
+        if self._depth() >= watermark:
+            raise queue.Full
+        self.put(item, block=block, timeout=timeout, priority=priority)
+
+    def put_or_drop(self, item, priority=0):
+        """
+        Put low priority *item* into the queue without blocking, or drop it
+        with a probability growing linearly from ``0`` at the low watermark
+        to ``1`` at the high watermark. Return ``True`` if *item* was put
+        into the queue, ``False`` if it was dropped. Watermarks must be set
+        by :meth:`set_watermarks`.
+        """
+        if self._watermarks is None:
+            raise ValueError('Watermarks are not set')
+        if self._watermarks.should_drop():
+            return False
+        try:
+            self.put(item, block=False, priority=priority)
+        except queue.Full:
+            return False
+        return True
+
+    def set_watermarks(self, high, low=None, on_high=None, on_low=None,
+                       sample_interval=0.01):
+        """
+        Set *high* and *low* watermarks of the number of messages in the
+        queue. *on_high* callback is called with the current depth when
+        it reaches *high*, *on_low* callback is called when it falls back
+        to *low* (default is *high*). Depth of the queue is sampled at
+        most once per *sample_interval* seconds and estimated from put and
+        got messages in between. Pass ``None`` as *high* to remove
+        watermarks.
+        """
+        if high is None:
+            self._watermarks = None
+        else:
+            from .watermark import Watermarks
+            self._watermarks = Watermarks(
+                self.qsize, high, low=low, on_high=on_high, on_low=on_low,
+                sample_interval=sample_interval)
+
+    def set_overflow(self, directory, segment_size=64 * 1024 * 1024,
+                     fsync=False, refill_interval=0.05):
+        """
+        Spill messages to segment files in *directory* when the queue is
+        full, instead of blocking. Spilled messages are moved back into
+        the queue when it has free space, on every :meth:`put` and every
+        *refill_interval* seconds by a background thread, so FIFO order
+        of messages is preserved. A new segment file is started when the
+        current one exceeds *segment_size* bytes, if *fsync* is ``True``,
+        every spilled message is flushed to the disk. Spilled messages
+        left by previous process are loaded from *directory*. Pass
+        ``None`` as *directory* to remove overflow.
+        """
+        if self._overflow is not None:
+            self._overflow.close()
+            self._overflow = None
+        if directory is not None:
+            from .overflow import Overflow
+            self._overflow = Overflow(
+                directory, self._send_nowait, segment_size=segment_size,
+                fsync=fsync, refill_interval=refill_interval,
+                rejected=_is_rejected)
+
+    def set_scheduler(self, journal=None, tick=0.01, batch_size=1000,
+                      fsync=False):
+        """
+        Enable delayed messages, see :meth:`put_at` and *delay* of
+        :meth:`put`. Scheduled messages are kept in the process in
+        a hierarchical timer wheel with resolution *tick* seconds, a
+        background thread puts due messages into the queue in batches of
+        at most *batch_size* messages. If *journal* is a path to a file,
+        scheduled messages are journaled into it and loaded again by the
+        next :meth:`set_scheduler` with the same *journal*, if *fsync* is
+        ``True``, every record is flushed to the disk. Pass ``False`` as
+        *journal* to remove the scheduler.
+        """
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+        if journal is not False:
+            from .scheduler import Scheduler
+            self._scheduler = Scheduler(
+                self._send_nowait, journal=journal, tick=tick,
+                batch_size=batch_size, fsync=fsync, rejected=_is_rejected)
+
     def get(self, block=True, timeout=None):
         """
         Remove and return an item from the queue. If *block* is ``True`` and
@@ -154,13 +347,24 @@ class Queue(object):
         return an item if one is immediately available, else raise the
         :class:`queue.Empty` exception (*timeout* is ignored in that case).
         """
+        if self._handoff is not None:
+            return self._get_local(block, timeout)
+        data, _ = self.get_raw(block=block, timeout=timeout)
+        return self._serializer.loads(data)
+
+    def get_raw(self, block=True, timeout=None):
+        """
+        Remove and return a message from the queue as it is, without the
+        serializer. Return a tuple ``(data, priority)`` where *data* is
+        :class:`bytes` and *priority* is the priority of the message.
+        Arguments are the same as for :meth:`get`.
+        """
         if not block:
             timeout = 0.0
         elif timeout is None:
             timeout = float('inf')
-        buf = ffi.new('char[]', self._max_msg_size)
-        size = ffi.new('size_t *', self._max_msg_size)
-        priority = ffi.new('unsigned int *')
+        buf, size, priority = self._buffers()
+        size[0] = self._max_msg_size
 
         res = lib.posixmq_get(self._queue_id, buf, size, priority, timeout)
 
@@ -169,9 +373,10 @@ class Queue(object):
         elif res != lib.POSIXMQ_OK:
             raise QueueError(res)
 
-        data_size = size[0]
-        data = ffi.buffer(buf[0:data_size])[:]
-        return self._serializer.loads(data)
+        if self._watermarks is not None:
+            self._watermarks.adjust(-1)
+
+        return ffi.buffer(buf, size[0])[:], priority[0]
 
     def get_nowait(self):
         """
@@ -182,17 +387,22 @@ class Queue(object):
     def qattr(self):
         """
         Return attributes of the message queue as a :class:`dict`:
-        ``{'size': 5, 'max_size': 10, 'max_msgbytes': 1024}``.
+        ``{'size': 5, 'max_size': 10, 'max_msgbytes': 1024}``. If overflow
+        is set, the number of messages spilled to the disk is returned
+        under the ``'spilled'`` key.
         """
         attr = ffi.new('struct mq_attr *')
         res = lib.posixmq_get_attr(self._queue_id, attr)
         if res != lib.POSIXMQ_OK:
             raise QueueError(res)
-        return {
+        result = {
             'size': attr.mq_curmsgs,
             'max_size': attr.mq_maxmsg,
             'max_msgbytes': attr.mq_msgsize,
         }
+        if self._overflow is not None:
+            result['spilled'] = len(self._overflow)
+        return result
 
     def qsize(self):
         """
@@ -202,4 +412,91 @@ class Queue(object):
         not block.
         """
         attr = self.qattr()
+        if self._handoff is not None:
+            return attr['size'] + len(self._handoff)
         return attr['size']
+
+    def fileno(self):
+        """
+        Return the queue descriptor. On Linux it's a file descriptor, the
+        queue is readable by :func:`select.select` when it has a message.
+        """
+        return self._queue_id
+
+    def _get_local(self, block, timeout):
+        # Messages of the kernel queue are taken first, they were put
+        # before the consumer started to wait
+        deadline = None
+        if not block:
+            deadline = time.time()
+        elif timeout is not None:
+            deadline = time.time() + timeout
+        offered = False
+        while True:
+            if not offered:
+                try:
+                    data, _ = self.get_raw(block=False)
+                except queue.Empty:
+                    pass
+                else:
+                    return self._serializer.loads(data)
+            found, item = self._handoff.take()
+            if found:
+                return item
+            remaining = None
+            if deadline is not None:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    raise queue.Empty
+            # Item offered while waiting was put after messages of the
+            # kernel queue checked above
+            offered = self._handoff.wait([self._queue_id], remaining)
+
+    def _buffers(self):
+        # Receive buffers are allocated once per thread, so concurrent
+        # get() calls neither allocate nor share them
+        local = self._local
+        try:
+            return local.buf, local.size, local.priority
+        except AttributeError:
+            local.buf = ffi.new('char[]', self._max_msg_size)
+            local.size = ffi.new('size_t *')
+            local.priority = ffi.new('unsigned int *')
+            return local.buf, local.size, local.priority
+
+    def _depth(self):
+        if self._watermarks is not None:
+            return self._watermarks.depth()
+        return self.qsize()
+
+    def _send(self, data, priority, timeout):
+        if isinstance(data, (list, tuple)):
+            msgs = [ffi.from_buffer(part) for part in data]
+            res = lib.posixmq_putv(
+                    self._queue_id, msgs, [len(msg) for msg in msgs],
+                    len(msgs), priority, timeout)
+        else:
+            if not isinstance(data, bytes):
+                data = ffi.from_buffer(data)
+            res = lib.posixmq_put(
+                    self._queue_id, data, len(data), priority, timeout)
+
+        if res == lib.POSIXMQ_E_TIMEOUT:
+            raise queue.Full
+        elif res != lib.POSIXMQ_OK:
+            raise QueueError(res)
+
+        if self._watermarks is not None:
+            self._watermarks.adjust(1)
+
+    def _schedule(self, data, when, priority):
+        if self._scheduler is None:
+            raise ValueError('Scheduler is not set')
+        self._scheduler.schedule(data, when, priority)
+
+    def _send_nowait(self, data, priority):
+        try:
+            self._send(data, priority, 0.0)
+        except queue.Full:
+            return False
+        return True
@@ -0,0 +1,235 @@
+"""
+Consumer scheduling messages of several priority bands. POSIX queues
+always return the message with the highest priority first, so messages
+of low priority starve under sustained load of high priority messages.
+:class:`PriorityScheduler` prefetches messages of every band into the
+process and serves bands by deficit round robin with weights, bands whose
+oldest message waits too long are served first.
+"""
+
+import bisect
+import collections
+import select
+import threading
+import time
+
+from .tracing import Histogram
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+__all__ = ['PriorityScheduler']
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
+
+class _Band(object):
+
+    def __init__(self, weight, max_wait):
+        if weight <= 0:
+            raise ValueError('Weight must be positive')
+        self.weight = weight
+        self.max_wait = max_wait
+        self.messages = collections.deque()
+        self.deficit = 0.0
+        self.served = 0
+        self.aged = 0
+        self.latency = Histogram()
+
+
+class PriorityScheduler(object):
+    """
+    Consumer of POSIX message queues *queues*
+    (:class:`ipcqueue.posixmq.Queue`), one queue per band. Band ``0`` is
+    the most urgent one. Bands are served by deficit round robin, band
+    gets ``weights[i]`` messages per round (default is ``1`` for all
+    bands, fractions are allowed). If ``max_wait[i]`` is set and the
+    oldest message of the band waits at least that many seconds, the band
+    is served out of turn. At most *prefetch* messages per band are
+    read into the process ahead. Waiting time is measured from the moment
+    the message was prefetched, combine it with
+    :class:`ipcqueue.tracing.TracingSerializer` to measure time spent in
+    the kernel queue.
+    """
+
+    def __init__(self, queues, weights=None, max_wait=None, prefetch=16):
+        self._setup(
+            [(q, self._fixed_band(i), [i]) for i, q in enumerate(queues)],
+            len(queues), weights, max_wait, prefetch)
+
+    @classmethod
+    def split(cls, q, priorities, weights=None, max_wait=None,
+              prefetch=16):
+        """
+        Create the scheduler of one queue *q*, whose messages are split
+        into bands by their priority. *priorities* are the lowest
+        priorities of bands in descending order, e.g. ``[10, 1, 0]``
+        creates bands of priorities ``10`` and higher, ``1`` to ``9`` and
+        ``0``. The kernel returns messages in priority order, so messages
+        of a band are reached only after all waiting messages of higher
+        bands. While a band has less than *prefetch* messages, the queue
+        is drained, so higher bands may hold more messages than
+        *prefetch*, at most the maximum size of *q* more in total.
+        """
+        if list(priorities) != sorted(priorities, reverse=True):
+            raise ValueError('Priorities must be in descending order')
+        count = len(priorities)
+        ascending = sorted(priorities)
+
+        def band_of(priority):
+            # Priorities below the lowest bound belong to the last band
+            band = count - bisect.bisect_right(ascending, priority)
+            return min(band, count - 1)
+
+        scheduler = cls.__new__(cls)
+        scheduler._setup(
+            [(q, band_of, list(range(count)))], count, weights, max_wait,
+            prefetch)
+        return scheduler
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return an item of the band scheduled next. If *block*
+        is ``True`` and *timeout* is ``None`` (the default), block if
+        necessary until an item is available. If *timeout* is a positive
+        number, it blocks at most *timeout* seconds and raises the
+        :class:`queue.Empty` exception if no item was available within
+        that time. Otherwise (*block* is ``False``), return an item if one
+        is immediately available, else raise the :class:`queue.Empty`
+        exception.
+        """
+        if not block:
+            timeout = 0.0
+        deadline = None if timeout is None else _monotonic() + timeout
+        with self._lock:
+            while True:
+                self._fill()
+                if any(band.messages for band in self._bands):
+                    break
+                remaining = None
+                if deadline is not None:
+                    remaining = deadline - _monotonic()
+                    if remaining <= 0:
+                        raise queue.Empty
+                select.select(
+                    [q.fileno() for q, _, _ in self._sources], [], [],
+                    remaining)
+            band = self._schedule()
+            source, data, seen = band.messages.popleft()
+            band.served += 1
+            band.latency.record(int((_monotonic() - seen) * 1000000000))
+        return self._sources[source][0]._serializer.loads(data)
+
+    def get_nowait(self):
+        """
+        Get and return an item, equivalent to ``get(block=False)``.
+        """
+        return self.get(block=False)
+
+    def stats(self):
+        """
+        Return a :class:`list` of statistics of bands, every item is
+        a :class:`dict` with number of ``'served'`` messages, messages
+        served out of turn due to ``'aged'`` *max_wait*, ``'throughput'``
+        in messages per second since the start or the last
+        :meth:`reset_stats`, number of ``'pending'`` prefetched messages
+        and ``'latency'``, :class:`ipcqueue.tracing.Histogram` of waiting
+        times in nanoseconds.
+        """
+        with self._lock:
+            elapsed = max(_monotonic() - self._started, 1e-9)
+            return [{
+                'served': band.served,
+                'aged': band.aged,
+                'throughput': band.served / elapsed,
+                'pending': len(band.messages),
+                'latency': band.latency.snapshot(),
+            } for band in self._bands]
+
+    def reset_stats(self):
+        """
+        Reset statistics of all bands.
+        """
+        with self._lock:
+            for band in self._bands:
+                band.served = 0
+                band.aged = 0
+                band.latency.reset()
+            self._started = _monotonic()
+
+    def _setup(self, sources, count, weights, max_wait, prefetch):
+        weights = weights or [1] * count
+        max_wait = max_wait or [None] * count
+        if len(weights) != count or len(max_wait) != count:
+            raise ValueError('Every band must have weight and max_wait')
+        self._bands = [
+            _Band(weight, wait) for weight, wait in zip(weights, max_wait)]
+        self._sources = sources
+        # Messages of the source in the process, beyond prefetch of its
+        # bands at most a full kernel queue read ahead to lower bands
+        self._limits = [
+            prefetch * len(bands) + q.qattr()['max_size']
+            for q, _, bands in sources]
+        self._prefetch = prefetch
+        self._current = 0
+        self._granted = False
+        self._lock = threading.Lock()
+        self._started = _monotonic()
+
+    @staticmethod
+    def _fixed_band(index):
+        return lambda priority: index
+
+    def _fill(self):
+        now = _monotonic()
+        for source, (q, band_of, bands) in enumerate(self._sources):
+            # The kernel returns messages in priority order, after
+            # a message of a band only messages of the same or lower
+            # bands follow, read while any of them needs messages
+            buffered = sum(len(self._bands[i].messages) for i in bands)
+            while buffered < self._limits[source] and any(
+                    len(self._bands[i].messages) < self._prefetch
+                    for i in bands):
+                buffered += 1
+                try:
+                    data, priority = q.get_raw(block=False)
+                except queue.Empty:
+                    break
+                index = band_of(priority)
+                self._bands[index].messages.append((source, data, now))
+                bands = [i for i in bands if i >= index]
+
+    def _schedule(self):
+        # Aged bands first, the one with the oldest message wins
+        now = _monotonic()
+        aged = None
+        for band in self._bands:
+            if (band.messages and band.max_wait is not None and
+                    now - band.messages[0][2] >= band.max_wait):
+                if aged is None or band.messages[0][2] < aged.messages[0][2]:
+                    aged = band
+        if aged is not None:
+            aged.deficit -= 1
+            aged.aged += 1
+            return aged
+
+        # Deficit round robin, every visited band gets its weight once
+        # and is served while its deficit lasts
+        while True:
+            band = self._bands[self._current]
+            if band.messages:
+                if not self._granted:
+                    band.deficit += band.weight
+                    self._granted = True
+                if band.deficit >= 1:
+                    band.deficit -= 1
+                    return band
+            else:
+                band.deficit = 0.0
+            self._current = (self._current + 1) % len(self._bands)
+            self._granted = False
@@ -0,0 +1,287 @@
+"""
+Delayed delivery of messages. Messages are parked in a hierarchical timer
+wheel and moved into the target queue in batches when they come due.
+Scheduled messages can be journaled to a file, so they survive restart
+of the scheduler.
+"""
+
+import collections
+import itertools
+import os
+import struct
+import threading
+import time
+
+__all__ = ['TimerWheel', 'Scheduler']
+
+
+class TimerWheel(object):
+    """
+    Hierarchical timer wheel with resolution *tick* seconds. The wheel
+    has *levels* levels of ``2 ** bits`` slots, timers further in the
+    future than the wheel's range wait in an overflow list. Inserting a
+    timer and expiring a timer are O(1) operations.
+    """
+
+    def __init__(self, tick=0.01, bits=8, levels=4, now=None):
+        self.tick = tick
+        self._bits = bits
+        self._mask = (1 << bits) - 1
+        self._levels = levels
+        self._slots = [
+            [[] for i in range(1 << bits)] for level in range(levels)]
+        self._overflow = []
+        self._level_counts = [0] * levels
+        self._ticks = self._to_ticks(time.time() if now is None else now)
+        self._count = 0
+
+    def __len__(self):
+        return self._count
+
+    def add(self, when, entry):
+        """
+        Add *entry* which expires at time *when* (seconds since the epoch).
+        """
+        self._insert(max(self._to_ticks(when), self._ticks + 1), entry)
+        self._count += 1
+
+    def advance(self, now):
+        """
+        Advance the wheel to the time *now* and return :class:`list` of
+        expired entries.
+        """
+        target = self._to_ticks(now)
+        expired = []
+        while self._ticks < target:
+            if not self._count:
+                self._ticks = target
+                break
+            # Skip ticks until the lowest non-empty level wraps around,
+            # nothing can expire before
+            level = 0
+            while level < self._levels and not self._level_counts[level]:
+                level += 1
+            if level:
+                skip_to = self._ticks | ((1 << (self._bits * level)) - 1)
+                if skip_to >= target:
+                    self._ticks = target
+                    break
+                self._ticks = skip_to
+            self._ticks += 1
+            self._cascade(1)
+            slot = self._slots[0][self._ticks & self._mask]
+            if slot:
+                expired.extend(entry for _, entry in slot)
+                self._level_counts[0] -= len(slot)
+                del slot[:]
+        self._count -= len(expired)
+        return expired
+
+    def _to_ticks(self, when):
+        return int(when / self.tick)
+
+    def _insert(self, ticks, entry):
+        delta = ticks - self._ticks
+        for level in range(self._levels):
+            if delta < 1 << (self._bits * (level + 1)):
+                index = (ticks >> (self._bits * level)) & self._mask
+                self._slots[level][index].append((ticks, entry))
+                self._level_counts[level] += 1
+                return
+        self._overflow.append((ticks, entry))
+
+    def _cascade(self, level):
+        # Move timers of the next slot of upper level to lower levels
+        # whenever lower level wraps around
+        if (self._ticks & ((1 << (self._bits * level)) - 1)) != 0:
+            return
+        if level == self._levels:
+            overflow, self._overflow = self._overflow, []
+            for ticks, entry in overflow:
+                self._insert(ticks, entry)
+            return
+        self._cascade(level + 1)
+        index = (self._ticks >> (self._bits * level)) & self._mask
+        slot = self._slots[level][index]
+        if slot:
+            self._slots[level][index] = []
+            self._level_counts[level] -= len(slot)
+            for ticks, entry in slot:
+                self._insert(ticks, entry)
+
+
+class Scheduler(object):
+    """
+    Scheduler of delayed messages. *send* is a callable which puts
+    serialized data with tag (priority or message type) into the target
+    queue without blocking, it returns ``False`` if the queue is full.
+    A background thread advances the timer wheel every *tick* seconds
+    and sends due messages in batches of at most *batch_size* messages;
+    messages which don't fit into the full queue are retried on the next
+    tick. If *journal* is a path to a file, scheduled messages are
+    appended to it and loaded again when a scheduler is created with
+    the same journal, so pending messages survive restart. If *fsync* is
+    ``True``, every journal record is flushed to the disk. If
+    *background* is ``False``, the thread isn't started and
+    :meth:`run_pending` must be called by the owner. *rejected* is
+    a callable which returns ``True`` if an exception raised by *send*
+    means that the data can never be sent, such messages are dropped and
+    counted in :attr:`dropped`.
+    """
+
+    _RECORD = struct.Struct('<BQdqI')
+    _SCHEDULED = 1
+    _DELIVERED = 2
+
+    def __init__(self, send, journal=None, tick=0.01, batch_size=1000,
+                 fsync=False, background=True, rejected=None):
+        self._send = send
+        self._rejected = rejected or (lambda error: False)
+        self.dropped = 0
+        self._batch_size = batch_size
+        self._fsync = fsync
+        self._lock = threading.Lock()
+        self._wheel = TimerWheel(tick=tick)
+        self._due = collections.deque()
+        self._ids = itertools.count()
+        self._journal = journal
+        self._journal_fd = None
+        self._journal_records = 0
+        if journal is not None:
+            self._load_journal()
+        self._closed = threading.Event()
+        self._thread = None
+        if background:
+            self._thread = threading.Thread(target=self._run, args=(tick,))
+            self._thread.daemon = True
+            self._thread.start()
+
+    def __len__(self):
+        with self._lock:
+            return len(self._wheel) + len(self._due)
+
+    def schedule(self, data, when, tag=0):
+        """
+        Schedule serialized *data* with *tag* to be put into the queue at
+        time *when* (seconds since the epoch).
+        """
+        if isinstance(data, (list, tuple)):
+            data = b''.join(data)
+        elif not isinstance(data, bytes):
+            data = memoryview(data).tobytes()
+        with self._lock:
+            entry_id = next(self._ids)
+            if self._journal_fd is not None:
+                self._write_record(
+                    self._SCHEDULED, entry_id, when, tag, data)
+            self._wheel.add(when, (entry_id, data, tag))
+
+    def run_pending(self, now=None):
+        """
+        Send messages which are due at time *now* (default is the current
+        time) into the queue. Return number of sent messages.
+        """
+        with self._lock:
+            self._due.extend(
+                self._wheel.advance(time.time() if now is None else now))
+            sent = 0
+            while self._due and sent < self._batch_size:
+                entry_id, data, tag = self._due[0]
+                try:
+                    if not self._send(data, tag):
+                        break
+                except Exception as e:
+                    if not self._rejected(e):
+                        raise
+                    self.dropped += 1
+                else:
+                    sent += 1
+                self._due.popleft()
+                if self._journal_fd is not None:
+                    self._write_record(self._DELIVERED, entry_id)
+            if (self._journal_fd is not None and self._journal_records >
+                    2 * (len(self._wheel) + len(self._due)) + 10000):
+                self._compact_journal()
+            return sent
+
+    def close(self):
+        """
+        Stop the scheduler. Pending messages are kept in the journal.
+        """
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join()
+        with self._lock:
+            if self._journal_fd is not None:
+                os.close(self._journal_fd)
+                self._journal_fd = None
+
+    def _run(self, tick):
+        while not self._closed.wait(tick):
+            try:
+                while self.run_pending() == self._batch_size:
+                    pass
+            except Exception:
+                # E.g. the queue was removed, keep due messages and retry
+                pass
+
+    def _write_record(self, op, entry_id, when=0.0, tag=0, data=b''):
+        os.write(
+            self._journal_fd,
+            self._RECORD.pack(op, entry_id, when, tag, len(data)) + data)
+        if self._fsync:
+            os.fsync(self._journal_fd)
+        self._journal_records += 1
+
+    def _load_journal(self):
+        pending = collections.OrderedDict()
+        try:
+            with open(self._journal, 'rb') as f:
+                while True:
+                    header = f.read(self._RECORD.size)
+                    if len(header) < self._RECORD.size:
+                        break
+                    op, entry_id, when, tag, size = self._RECORD.unpack(
+                        header)
+                    data = f.read(size)
+                    if len(data) < size:
+                        break
+                    if op == self._SCHEDULED:
+                        pending[entry_id] = (when, tag, data)
+                    else:
+                        pending.pop(entry_id, None)
+        except IOError:
+            pass
+
+        self._ids = itertools.count()
+        for when, tag, data in pending.values():
+            self._wheel.add(when, (next(self._ids), data, tag))
+        self._compact_journal()
+
+    def _compact_journal(self):
+        # Rewrite journal with pending messages only
+        entries = []
+        for level in self._wheel._slots:
+            for slot in level:
+                entries.extend(slot)
+        entries.extend(self._wheel._overflow)
+        tick = self._wheel.tick
+        records = [(ticks * tick, entry) for ticks, entry in entries]
+        records.extend((0.0, entry) for entry in self._due)
+
+        tmp_path = self._journal + '.tmp'
+        fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644)
+        try:
+            for when, (entry_id, data, tag) in records:
+                os.write(fd, self._RECORD.pack(
+                    self._SCHEDULED, entry_id, when, tag, len(data)) + data)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+        os.rename(tmp_path, self._journal)
+
+        if self._journal_fd is not None:
+            os.close(self._journal_fd)
+        self._journal_fd = os.open(
+            self._journal, os.O_WRONLY | os.O_APPEND, 0o644)
+        self._journal_records = len(records)
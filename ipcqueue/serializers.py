@@ -1,17 +1,35 @@
+import struct
+import sys
+
+# pickle is imported on the first use, it's the most expensive import
+# of the package and it isn't needed by other serializers
+pickle = None
+
 try:
-    import cPickle as pickle
-except ImportError:
-    import pickle
+    _text_type = unicode
+    _integer_types = (int, long)
+except NameError:
+    _text_type = str
+    _integer_types = (int,)
+
+
+def _load_pickle():
+    global pickle
+    if sys.version_info[0] < 3:
+        import cPickle as pickle
+    else:
+        import pickle
+    return pickle
 
 
 class PickleSerializer:
     @staticmethod
     def dumps(obj):
-        return pickle.dumps(obj, protocol=1)
+        return (pickle or _load_pickle()).dumps(obj, protocol=1)
 
     @staticmethod
     def loads(data):
-        return pickle.loads(data)
+        return (pickle or _load_pickle()).loads(data)
 
 
 class RawSerializer:
@@ -22,3 +40,79 @@ class RawSerializer:
     @staticmethod
     def loads(data):
         return data
+
+
+# Type tags of TaggedSerializer
+_PICKLE = b'\x00'
+_NONE = b'\x01'
+_FALSE = b'\x02'
+_TRUE = b'\x03'
+_INT = b'\x04'
+_FLOAT = b'\x05'
+_BYTES = b'\x06'
+_TEXT = b'\x07'
+
+# Protocol 3 stores bytes natively, unlike protocols readable by Python 2
+_PICKLE_PROTOCOL = 3 if sys.version_info[0] >= 3 else 2
+
+_INT64 = struct.Struct('<q')
+_FLOAT64 = struct.Struct('<d')
+
+
+def _encode_int(obj):
+    try:
+        return _INT + _INT64.pack(obj)
+    except struct.error:
+        return None
+
+
+_ENCODERS = {
+    type(None): lambda obj: _NONE,
+    bool: lambda obj: _TRUE if obj else _FALSE,
+    float: lambda obj: _FLOAT + _FLOAT64.pack(obj),
+    bytes: lambda obj: _BYTES + obj,
+    _text_type: lambda obj: _TEXT + obj.encode('utf-8'),
+}
+for _cls in _integer_types:
+    _ENCODERS[_cls] = _encode_int
+
+_DECODERS = {
+    _PICKLE: lambda data: (pickle or _load_pickle()).loads(data[1:]),
+    _NONE: lambda data: None,
+    _FALSE: lambda data: False,
+    _TRUE: lambda data: True,
+    _INT: lambda data: _INT64.unpack_from(data, 1)[0],
+    _FLOAT: lambda data: _FLOAT64.unpack_from(data, 1)[0],
+    _BYTES: lambda data: data[1:],
+    _TEXT: lambda data: data[1:].decode('utf-8'),
+}
+
+
+class TaggedSerializer:
+    """
+    Serializer with compact type-tagged encoding of common scalar
+    payloads: ``None``, :class:`bool`, 64-bit :class:`int`,
+    :class:`float`, :class:`bytes` and :class:`str` are encoded as one
+    tag byte followed by the raw value. Other objects, e.g. tuples, are
+    pickled with protocol 3 (2 on Python 2), which unlike
+    :class:`PickleSerializer` stores :class:`bytes` natively. Both
+    producers and consumers must use it.
+    """
+
+    @staticmethod
+    def dumps(obj):
+        encode = _ENCODERS.get(type(obj))
+        if encode is not None:
+            data = encode(obj)
+            if data is not None:
+                return data
+        return _PICKLE + (pickle or _load_pickle()).dumps(
+            obj, protocol=_PICKLE_PROTOCOL)
+
+    @staticmethod
+    def loads(data):
+        try:
+            decode = _DECODERS[data[:1]]
+        except KeyError:
+            raise ValueError('Invalid tag {!r}'.format(data[:1]))
+        return decode(data)
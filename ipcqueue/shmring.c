@@ -0,0 +1,413 @@
+
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
+#endif
+
+#include <errno.h>
+#include <fcntl.h>
+#include <limits.h>
+#include <linux/futex.h>
+#include <math.h>
+#include <stdint.h>
+#include <stdlib.h>
+#include <string.h>
+#include <sys/mman.h>
+#include <sys/stat.h>
+#include <sys/syscall.h>
+#include <time.h>
+#include <unistd.h>
+
+#include "shmring.h"
+
+#define SHMRING_MAGIC 0x52494e47
+#define SHMRING_WRAP 0xffffffff
+#define SHMRING_ALIGN(size) (((size) + 7) & ~((uint64_t)7))
+#define SHMRING_HEADER_SIZE SHMRING_ALIGN(sizeof(ShmRingHeader))
+#define SHMRING_RECORD_SIZE(size) SHMRING_ALIGN(sizeof(uint32_t) + (size))
+#define SHMRING_OPEN_RETRIES 1000
+
+
+static inline long futex_wait(uint32_t * const addr, const uint32_t value,
+        const struct timespec * const timeout) {
+    return syscall(SYS_futex, addr, FUTEX_WAIT, value, timeout, NULL, 0);
+}
+
+static inline long futex_wake(uint32_t * const addr, const int count) {
+    return syscall(SYS_futex, addr, FUTEX_WAKE, count, NULL, NULL, 0);
+}
+
+/* Mutex implemented on futex, see "Futexes Are Tricky" by U. Drepper.
+ * 0 is unlocked, 1 is locked, 2 is locked with waiters. */
+static void ring_lock(uint32_t * const lock) {
+    uint32_t c = 0;
+
+    if (__atomic_compare_exchange_n(lock, &c, 1, 0,
+            __ATOMIC_ACQUIRE, __ATOMIC_RELAXED)) {
+        return;
+    }
+    if (c != 2) {
+        c = __atomic_exchange_n(lock, 2, __ATOMIC_ACQUIRE);
+    }
+    while (c != 0) {
+        futex_wait(lock, 2, NULL);
+        c = __atomic_exchange_n(lock, 2, __ATOMIC_ACQUIRE);
+    }
+}
+
+static void ring_unlock(uint32_t * const lock) {
+    if (__atomic_fetch_sub(lock, 1, __ATOMIC_RELEASE) != 1) {
+        __atomic_store_n(lock, 0, __ATOMIC_RELEASE);
+        futex_wake(lock, 1);
+    }
+}
+
+static inline double monotonic_now(void) {
+    struct timespec now;
+
+    clock_gettime(CLOCK_MONOTONIC, &now);
+    return now.tv_sec + now.tv_nsec / 1e9;
+}
+
+/* Wait until *seq* is changed or *deadline* is reached */
+static ShmRingResult ring_wait(uint32_t * const seq, const uint32_t value,
+        uint32_t * const waiters, const double deadline) {
+
+    long res;
+
+    __atomic_fetch_add(waiters, 1, __ATOMIC_SEQ_CST);
+    if (isinf(deadline)) {
+        res = futex_wait(seq, value, NULL);
+    }
+    else {
+        struct timespec timeout;
+        double integral;
+        double remaining = deadline - monotonic_now();
+
+        if (remaining <= 0.0) {
+            __atomic_fetch_sub(waiters, 1, __ATOMIC_SEQ_CST);
+            return SHMRING_E_TIMEOUT;
+        }
+        timeout.tv_nsec = modf(remaining, &integral) * 1000000000;
+        timeout.tv_sec = integral;
+        res = futex_wait(seq, value, &timeout);
+    }
+    __atomic_fetch_sub(waiters, 1, __ATOMIC_SEQ_CST);
+
+    if (res < 0) {
+        switch (errno) {
+            case EAGAIN:
+                return SHMRING_OK;
+                break;
+            case EINTR:
+                return SHMRING_E_SIGNAL;
+                break;
+            case ETIMEDOUT:
+                return SHMRING_E_TIMEOUT;
+                break;
+            default:
+                return SHMRING_E;
+        }
+    }
+    return SHMRING_OK;
+}
+
+static inline void ring_notify(uint32_t * const seq,
+        uint32_t * const waiters) {
+    __atomic_fetch_add(seq, 1, __ATOMIC_SEQ_CST);
+    if (__atomic_load_n(waiters, __ATOMIC_SEQ_CST) > 0) {
+        futex_wake(seq, INT_MAX);
+    }
+}
+
+static ShmRingResult open_errno_to_result(void) {
+    switch (errno) {
+        case EACCES:
+        case EPERM:
+            return SHMRING_E_PERMISSIONS;
+            break;
+        case EINVAL:
+        case ENAMETOOLONG:
+        case ENOENT:
+            return SHMRING_E_VALUE;
+            break;
+        case EFBIG:
+        case EMFILE:
+        case ENFILE:
+        case ENOMEM:
+        case ENOSPC:
+            return SHMRING_E_RESOURCES;
+            break;
+        default:
+            return SHMRING_E;
+    }
+}
+
+ShmRingResult shmring_open(const char * const name, ShmRing ** const ring,
+        const size_t maxmsgsize, const size_t maxsize) {
+
+    ShmRing *r;
+    struct stat st;
+    uint64_t capacity;
+    size_t map_size;
+    void *addr;
+    int created = 1;
+    int fd;
+    int i;
+
+    if (name[0] != '/' || name[1] == '\0' || strchr(name + 1, '/') != NULL) {
+        return SHMRING_E_VALUE;
+    }
+    if (maxsize == 0 || maxmsgsize == 0 || maxmsgsize >= SHMRING_WRAP ||
+            maxsize > (SIZE_MAX - SHMRING_HEADER_SIZE) /
+                SHMRING_RECORD_SIZE(maxmsgsize) - 1) {
+        return SHMRING_E_VALUE;
+    }
+
+    fd = shm_open(name, O_CREAT | O_EXCL | O_RDWR, 0644);
+    if (fd < 0 && errno == EEXIST) {
+        created = 0;
+        fd = shm_open(name, O_RDWR, 0644);
+    }
+    if (fd < 0) {
+        return open_errno_to_result();
+    }
+
+    if (created) {
+        /* One record more, it's wasted by wrapping around the end */
+        capacity = (maxsize + 1) * SHMRING_RECORD_SIZE(maxmsgsize);
+        map_size = SHMRING_HEADER_SIZE + capacity;
+        if (ftruncate(fd, map_size) < 0) {
+            ShmRingResult res = open_errno_to_result();
+            close(fd);
+            shm_unlink(name);
+            return res;
+        }
+    }
+    else {
+        /* Wait until creator of the ring resizes it */
+        for (i = 0; ; ++i) {
+            if (fstat(fd, &st) < 0) {
+                close(fd);
+                return SHMRING_E;
+            }
+            if ((size_t)st.st_size >= SHMRING_HEADER_SIZE) {
+                break;
+            }
+            if (i == SHMRING_OPEN_RETRIES) {
+                close(fd);
+                return SHMRING_E_VALUE;
+            }
+            usleep(1000);
+        }
+        map_size = st.st_size;
+    }
+
+    addr = mmap(NULL, map_size, PROT_READ | PROT_WRITE, MAP_SHARED, fd, 0);
+    close(fd);
+    if (addr == MAP_FAILED) {
+        if (created) {
+            shm_unlink(name);
+        }
+        return SHMRING_E_RESOURCES;
+    }
+
+    r = malloc(sizeof(ShmRing));
+    if (r == NULL) {
+        munmap(addr, map_size);
+        return SHMRING_E_RESOURCES;
+    }
+    r->header = addr;
+    r->data = (char *)addr + SHMRING_HEADER_SIZE;
+    r->map_size = map_size;
+
+    if (created) {
+        r->header->capacity = capacity;
+        r->header->max_msg_size = maxmsgsize;
+        r->header->max_count = maxsize;
+        __atomic_store_n(&r->header->magic, SHMRING_MAGIC, __ATOMIC_RELEASE);
+    }
+    else {
+        /* Wait until creator of the ring initializes it */
+        for (i = 0; __atomic_load_n(&r->header->magic, __ATOMIC_ACQUIRE) !=
+                SHMRING_MAGIC; ++i) {
+            if (i == SHMRING_OPEN_RETRIES) {
+                munmap(addr, map_size);
+                free(r);
+                return SHMRING_E_VALUE;
+            }
+            usleep(1000);
+        }
+    }
+
+    *ring = r;
+    return SHMRING_OK;
+}
+
+ShmRingResult shmring_close(ShmRing * const ring) {
+    if (munmap(ring->header, ring->map_size) < 0) {
+        return SHMRING_E_DESCRIPTOR;
+    }
+    free(ring);
+    return SHMRING_OK;
+}
+
+ShmRingResult shmring_unlink(const char * const name) {
+    if (shm_unlink(name) < 0) {
+        switch (errno) {
+            case EACCES:
+                return SHMRING_E_PERMISSIONS;
+                break;
+            case ENAMETOOLONG:
+            case EINVAL:
+                return SHMRING_E_VALUE;
+                break;
+            case ENOENT:
+                return SHMRING_E_DOESNT_EXIST;
+                break;
+            default:
+                return SHMRING_E;
+        }
+    }
+    else {
+        return SHMRING_OK;
+    }
+}
+
+/* Write the message, the lock must be held */
+static int ring_write(ShmRing * const ring, const char * const msg,
+        const size_t size) {
+
+    ShmRingHeader * const h = ring->header;
+    const uint64_t record_size = SHMRING_RECORD_SIZE(size);
+    const uint64_t free_bytes = h->capacity - (h->tail - h->head);
+    uint64_t pos = h->tail % h->capacity;
+    uint64_t contiguous = h->capacity - pos;
+    uint32_t msg_size = size;
+
+    if (h->count >= h->max_count) {
+        return 0;
+    }
+    if (record_size > contiguous) {
+        /* Skip the rest of the buffer and wrap around */
+        if (free_bytes < contiguous + record_size) {
+            return 0;
+        }
+        *(uint32_t *)(ring->data + pos) = SHMRING_WRAP;
+        h->tail += contiguous;
+        pos = 0;
+    }
+    else if (free_bytes < record_size) {
+        return 0;
+    }
+
+    memcpy(ring->data + pos, &msg_size, sizeof(uint32_t));
+    memcpy(ring->data + pos + sizeof(uint32_t), msg, size);
+    h->tail += record_size;
+    h->count += 1;
+    return 1;
+}
+
+/* Read the message, the lock must be held */
+static ShmRingResult ring_read(ShmRing * const ring, char * const buffer,
+        size_t * const size) {
+
+    ShmRingHeader * const h = ring->header;
+    uint64_t pos = h->head % h->capacity;
+    uint32_t msg_size;
+
+    memcpy(&msg_size, ring->data + pos, sizeof(uint32_t));
+    if (msg_size == SHMRING_WRAP) {
+        h->head += h->capacity - pos;
+        pos = 0;
+        memcpy(&msg_size, ring->data, sizeof(uint32_t));
+    }
+    if (msg_size > *size) {
+        return SHMRING_E_SIZE;
+    }
+
+    memcpy(buffer, ring->data + pos + sizeof(uint32_t), msg_size);
+    h->head += SHMRING_RECORD_SIZE(msg_size);
+    h->count -= 1;
+    *size = msg_size;
+    return SHMRING_OK;
+}
+
+ShmRingResult shmring_put(ShmRing * const ring, const char * const msg,
+        const size_t msg_size, const double timeout) {
+
+    ShmRingHeader * const h = ring->header;
+    const double deadline = isinf(timeout) ? timeout :
+        monotonic_now() + timeout;
+    ShmRingResult res;
+    uint32_t seq;
+
+    if (msg_size > h->max_msg_size) {
+        return SHMRING_E_SIZE;
+    }
+
+    for (;;) {
+        ring_lock(&h->lock);
+        if (ring_write(ring, msg, msg_size)) {
+            ring_unlock(&h->lock);
+            ring_notify(&h->not_empty, &h->get_waiters);
+            return SHMRING_OK;
+        }
+        seq = __atomic_load_n(&h->not_full, __ATOMIC_SEQ_CST);
+        ring_unlock(&h->lock);
+
+        if (timeout == 0.0) {
+            return SHMRING_E_TIMEOUT;
+        }
+        res = ring_wait(&h->not_full, seq, &h->put_waiters, deadline);
+        if (res != SHMRING_OK) {
+            return res;
+        }
+    }
+}
+
+ShmRingResult shmring_get(ShmRing * const ring, char * const buffer,
+        size_t * const size, const double timeout) {
+
+    ShmRingHeader * const h = ring->header;
+    const double deadline = isinf(timeout) ? timeout :
+        monotonic_now() + timeout;
+    ShmRingResult res;
+    uint32_t seq;
+
+    for (;;) {
+        ring_lock(&h->lock);
+        if (h->count > 0) {
+            res = ring_read(ring, buffer, size);
+            ring_unlock(&h->lock);
+            if (res == SHMRING_OK) {
+                ring_notify(&h->not_full, &h->put_waiters);
+            }
+            return res;
+        }
+        seq = __atomic_load_n(&h->not_empty, __ATOMIC_SEQ_CST);
+        ring_unlock(&h->lock);
+
+        if (timeout == 0.0) {
+            return SHMRING_E_TIMEOUT;
+        }
+        res = ring_wait(&h->not_empty, seq, &h->get_waiters, deadline);
+        if (res != SHMRING_OK) {
+            return res;
+        }
+    }
+}
+
+ShmRingResult shmring_get_attr(ShmRing * const ring,
+        ShmRingAttr * const attr) {
+
+    ShmRingHeader * const h = ring->header;
+
+    ring_lock(&h->lock);
+    attr->size = h->count;
+    attr->bytes = h->tail - h->head;
+    ring_unlock(&h->lock);
+    attr->max_size = h->max_count;
+    attr->max_msgbytes = h->max_msg_size;
+    attr->max_bytes = h->capacity;
+    return SHMRING_OK;
+}
@@ -0,0 +1,67 @@
+
+#ifndef __SHMRING_H__
+#define __SHMRING_H__
+
+#include <stddef.h>
+#include <stdint.h>
+
+typedef enum {
+    SHMRING_OK,
+    SHMRING_E,
+    SHMRING_E_VALUE,
+    SHMRING_E_PERMISSIONS,
+    SHMRING_E_RESOURCES,
+    SHMRING_E_DESCRIPTOR,
+    SHMRING_E_SIGNAL,
+    SHMRING_E_SIZE,
+    SHMRING_E_TIMEOUT,
+    SHMRING_E_DOESNT_EXIST
+} ShmRingResult;
+
+typedef struct {
+    size_t size;
+    size_t max_size;
+    size_t max_msgbytes;
+    size_t bytes;
+    size_t max_bytes;
+} ShmRingAttr;
+
+/* Header of the ring, shared by all processes */
+typedef struct {
+    uint32_t magic;
+    uint32_t lock;
+    uint32_t not_empty;
+    uint32_t not_full;
+    uint32_t get_waiters;
+    uint32_t put_waiters;
+    uint64_t capacity;
+    uint64_t max_msg_size;
+    uint64_t max_count;
+    uint64_t count;
+    uint64_t head;
+    uint64_t tail;
+} ShmRingHeader;
+
+/* Mapping of the ring in the current process */
+typedef struct {
+    ShmRingHeader *header;
+    char *data;
+    size_t map_size;
+} ShmRing;
+
+ShmRingResult shmring_open(const char * const name, ShmRing ** const ring,
+        const size_t maxmsgsize, const size_t maxsize);
+
+ShmRingResult shmring_close(ShmRing * const ring);
+
+ShmRingResult shmring_unlink(const char * const name);
+
+ShmRingResult shmring_put(ShmRing * const ring, const char * const msg,
+        const size_t msg_size, const double timeout);
+
+ShmRingResult shmring_get(ShmRing * const ring, char * const buffer,
+        size_t * const size, const double timeout);
+
+ShmRingResult shmring_get_attr(ShmRing * const ring, ShmRingAttr * const attr);
+
+#endif
@@ -0,0 +1,232 @@
+"""
+Interprocess message queue implemented as a ring buffer in POSIX shared
+memory. Messages don't pass through the kernel, producers and consumers
+copy them directly into and from the shared memory, the ring is guarded
+by a futex and blocking with timeout is supported. Note, a process
+killed while it holds the lock of the ring blocks all other users of the
+ring.
+"""
+
+import threading
+
+from .serializers import PickleSerializer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ipcqueue._shmring import ffi, lib
+
+__all__ = ['QueueError', 'unlink', 'Queue']
+
+
+class QueueError(Exception):
+    """
+    Indicates Queue error. Contains additional attributes *errno* and *msg*.
+    Value of the *errno* is system dependent, do don't use numeric codes
+    directly, use constants **QueueError.ERROR**, **QueueError.INVALID_VALUE**,
+    **QueueError.NO_PERMISSIONS**, **QueueError.NO_SYSTEM_RESOURCES**,
+    **QueueError.INVALID_DESCRIPTOR**, **QueueError.INTERRUPTED**,
+    **QueueError.TOO_BIG_MESSAGE**, **QueueError.TIMEOUT** and
+    **QueueError.DOES_NOT_EXIST**.
+    """
+
+    ERROR = lib.SHMRING_E
+    INVALID_VALUE = lib.SHMRING_E_VALUE
+    NO_PERMISSIONS = lib.SHMRING_E_PERMISSIONS
+    NO_SYSTEM_RESOURCES = lib.SHMRING_E_RESOURCES
+    INVALID_DESCRIPTOR = lib.SHMRING_E_DESCRIPTOR
+    INTERRUPTED = lib.SHMRING_E_SIGNAL
+    TOO_BIG_MESSAGE = lib.SHMRING_E_SIZE
+    TIMEOUT = lib.SHMRING_E_TIMEOUT
+    DOES_NOT_EXIST = lib.SHMRING_E_DOESNT_EXIST
+
+    _errno_to_str_map = {
+        ERROR: 'Error',
+        INVALID_VALUE: 'Invalid value',
+        NO_PERMISSIONS: 'No permissions',
+        NO_SYSTEM_RESOURCES: 'No system resources',
+        INVALID_DESCRIPTOR: 'Invalid queue descriptor',
+        INTERRUPTED: 'Interrupted by signal',
+        TOO_BIG_MESSAGE: 'Data is too big',
+        TIMEOUT: 'Timeout',
+        DOES_NOT_EXIST: 'Queue does not exist',
+    }
+
+    def __init__(self, errno, msg=None):
+        if not msg:
+            try:
+                msg = self._errno_to_str_map[errno]
+            except KeyError:
+                msg = self._errno_to_str_map[self.ERROR]
+        self.errno = errno
+        self.msg = msg
+        super(QueueError, self).__init__('{}, {}'.format(errno, msg))
+
+
+def unlink(name):
+    """
+    Remove a shared memory ring *name*.
+    """
+    q_name = ffi.new('char[]', name.encode('utf-8'))
+    res = lib.shmring_unlink(q_name)
+    if res != lib.SHMRING_OK:
+        raise QueueError(res)
+
+
+class Queue(object):
+    """
+    Shared memory ring buffer queue. The queue object can be shared by
+    threads, the ring is guarded by its futex and blocking calls release
+    the GIL. Don't call :meth:`close` while other threads use the queue.
+    """
+
+    def __init__(self, name, maxsize=10, maxmsgsize=1024, serializer=PickleSerializer):
+        """
+        Constructor for message queue. *name* is an unique identifier of the
+        queue, must starts with ``/``. *maxsize* is an integer that sets
+        the upperbound limit on the number of items that can be placed in
+        the queue. *maxmsgsize* is a maximum size of the message in bytes.
+        Shared memory of size about ``maxsize * maxmsgsize`` bytes is
+        allocated. If the queue already exists, *maxsize* and *maxmsgsize*
+        are ignored.
+        """
+        queue_name = ffi.new('char[]', name.encode('utf-8'))
+        ring = ffi.new('ShmRing **')
+        res = lib.shmring_open(queue_name, ring, maxmsgsize, maxsize)
+        if res != lib.SHMRING_OK:
+            raise QueueError(res)
+        self._ring = ring[0]
+        self._name = name
+        self._serializer = serializer
+        self._local = threading.local()
+        attr = self.qattr()
+        self._maxsize = attr['max_size']
+        self._max_msg_size = attr['max_msgbytes']
+
+    def close(self):
+        """
+        Close a message queue.
+        """
+        if self._ring == ffi.NULL:
+            raise QueueError(lib.SHMRING_E_DESCRIPTOR)
+        res = lib.shmring_close(self._ring)
+        if res != lib.SHMRING_OK:
+            raise QueueError(res)
+        self._ring = ffi.NULL
+
+    def unlink(self):
+        """
+        Remove a message queue. Shared memory has kernel persistence,
+        so if it's not removed by this method, a message queue will exist
+        until the system is shut down.
+        """
+        unlink(self._name)
+
+    def put(self, item, block=True, timeout=None):
+        """
+        Put *item* into the queue. If *block* is ``True`` and *timeout* is
+        ``None`` (the default), block if necessary until a free slot is
+        available. If *timeout* is a positive number, it blocks at most
+        *timeout* seconds and raises the :class:`queue.Full` exception if
+        no free slot was available within that time. Otherwise (*block* is
+        ``False``), put an *item* on the queue if a free slot is immediately
+        available, else raise the :class:`queue.Full` exception (*timeout*
+        is ignored in that case).
+        """
+        if not block:
+            timeout = 0.0
+        elif timeout is None:
+            timeout = float('inf')
+        if self._ring == ffi.NULL:
+            raise QueueError(lib.SHMRING_E_DESCRIPTOR)
+        data = self._serializer.dumps(item)
+
+        res = lib.shmring_put(self._ring, data, len(data), timeout)
+
+        if res == lib.SHMRING_E_TIMEOUT:
+            raise queue.Full
+        elif res != lib.SHMRING_OK:
+            raise QueueError(res)
+
+    def put_nowait(self, item):
+        """
+        Put *item* into the queue, equivalent to ``put(item, block=False)``.
+        """
+        return self.put(item, block=False)
+
+    def get(self, block=True, timeout=None):
+        """
+        Remove and return an item from the queue. If *block* is ``True`` and
+        *timeout* is ``None`` (the default), block if necessary until an item
+        is available. If *timeout* is a positive number, it blocks at most
+        *timeout* seconds and raises the :class:`queue.Empty` exception if no
+        item was available within that time. Otherwise (block is ``False``),
+        return an item if one is immediately available, else raise the
+        :class:`queue.Empty` exception (*timeout* is ignored in that case).
+        """
+        if not block:
+            timeout = 0.0
+        elif timeout is None:
+            timeout = float('inf')
+        if self._ring == ffi.NULL:
+            raise QueueError(lib.SHMRING_E_DESCRIPTOR)
+        buf, size = self._buffers()
+        size[0] = self._max_msg_size
+
+        res = lib.shmring_get(self._ring, buf, size, timeout)
+
+        if res == lib.SHMRING_E_TIMEOUT:
+            raise queue.Empty
+        elif res != lib.SHMRING_OK:
+            raise QueueError(res)
+
+        data = ffi.buffer(buf, size[0])[:]
+        return self._serializer.loads(data)
+
+    def get_nowait(self):
+        """
+        Get and return an item from queue, equivalent to ``get(block=False)``.
+        """
+        return self.get(block=False)
+
+    def qattr(self):
+        """
+        Return attributes of the message queue as a :class:`dict`:
+        ``{'size': 5, 'max_size': 10, 'max_msgbytes': 1024, 'bytes': 80,
+        'max_bytes': 11352}``.
+        """
+        if self._ring == ffi.NULL:
+            raise QueueError(lib.SHMRING_E_DESCRIPTOR)
+        attr = ffi.new('ShmRingAttr *')
+        res = lib.shmring_get_attr(self._ring, attr)
+        if res != lib.SHMRING_OK:
+            raise QueueError(res)
+        return {
+            'size': attr.size,
+            'max_size': attr.max_size,
+            'max_msgbytes': attr.max_msgbytes,
+            'bytes': attr.bytes,
+            'max_bytes': attr.max_bytes,
+        }
+
+    def qsize(self):
+        """
+        Return the approximate size of the queue. Note, ``qsize() > 0``
+        doesn't guarantee that a subsequent :meth:`get` will not block,
+        nor will ``qsize() < maxsize`` guarantee that :meth:`put` will
+        not block.
+        """
+        return self.qattr()['size']
+
+    def _buffers(self):
+        # Receive buffers are allocated once per thread, so concurrent
+        # get() calls neither allocate nor share them
+        local = self._local
+        try:
+            return local.buf, local.size
+        except AttributeError:
+            local.buf = ffi.new('char[]', self._max_msg_size)
+            local.size = ffi.new('size_t *')
+            return local.buf, local.size
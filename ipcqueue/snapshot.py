@@ -0,0 +1,239 @@
+"""
+Snapshot of queue contents, e.g. to move messages into a resized queue or
+over a reboot. :func:`dump` drains all messages of a queue into a file,
+:func:`load` puts them back. Messages are received and sent in large
+batches in C, payloads aren't deserialized and priorities of POSIX
+messages or types of SYS V messages are preserved. Files are written and
+read by chunks, so queues bigger than memory can be moved.
+
+A file starts with header ``<8sBB``, magic ``IPCQSNAP``, version and
+backend (``1`` POSIX, ``2`` SYS V), followed by chunks. A chunk starts with
+``<III`` number of messages, size of their data and CRC32 of the rest of
+the chunk, followed by ``<I`` sizes of messages, ``<q`` their priorities
+or types and their data.
+
+Queues can be dumped and loaded from the command line::
+
+    python -m ipcqueue.snapshot dump --posixmq /foo foo.snapshot
+    python -m ipcqueue.snapshot load --posixmq /foo --maxsize 100 foo.snapshot
+"""
+
+import argparse
+import os
+import struct
+import time
+import zlib
+
+from . import posixmq, sysvmq
+
+__all__ = ['dump', 'load']
+
+_MAGIC = b'IPCQSNAP'
+_VERSION = 1
+_POSIX = 1
+_SYSV = 2
+
+_HEADER = struct.Struct('<8sBB')
+_CHUNK = struct.Struct('<III')
+
+_MAX_BATCH_COUNT = 65536
+
+
+def _backend(q):
+    if isinstance(q, posixmq.Queue):
+        return _POSIX
+    elif isinstance(q, sysvmq.Queue):
+        return _SYSV
+    raise TypeError('Unsupported queue {!r}'.format(q))
+
+
+class _PosixBatches(object):
+
+    from ipcqueue._posixmq import ffi, lib
+
+    tag_type = 'unsigned int[]'
+
+    def __init__(self, q):
+        self._queue = q
+        attr = self.ffi.new('struct mq_attr *')
+        res = self.lib.posixmq_get_attr(q._queue_id, attr)
+        if res != self.lib.POSIXMQ_OK:
+            raise posixmq.QueueError(res)
+        self.max_msg_size = attr.mq_msgsize
+
+    def get(self, buf, buf_size, sizes, tags, max_count, count):
+        res = self.lib.posixmq_get_batch(
+            self._queue._queue_id, buf, buf_size, sizes, tags, max_count,
+            count)
+        if res != self.lib.POSIXMQ_OK:
+            raise posixmq.QueueError(res)
+
+    def put(self, data, sizes, tags, count, sent):
+        res = self.lib.posixmq_put_batch(
+            self._queue._queue_id, data, sizes, tags, count, float('inf'),
+            sent)
+        if res != self.lib.POSIXMQ_OK:
+            raise posixmq.QueueError(res)
+
+
+class _SysVBatches(object):
+
+    from ipcqueue._sysvmq import ffi, lib
+
+    tag_type = 'long[]'
+
+    def __init__(self, q):
+        self._queue = q
+        self.max_msg_size = self.lib.MTEXT_BUFFER_SIZE
+
+    def get(self, buf, buf_size, sizes, tags, max_count, count):
+        res = self.lib.sysvmq_get_batch(
+            self._queue._queue_id, buf, buf_size, sizes, tags, max_count,
+            count)
+        if res != self.lib.SYSVMQ_OK:
+            raise sysvmq.QueueError(res)
+
+    def put(self, data, sizes, tags, count, sent):
+        res = self.lib.sysvmq_put_batch(
+            self._queue._queue_id, data, sizes, tags, count, float('inf'),
+            sent)
+        if res != self.lib.SYSVMQ_OK:
+            raise sysvmq.QueueError(res)
+
+
+def _batches(backend, q):
+    if backend == _POSIX:
+        return _PosixBatches(q)
+    return _SysVBatches(q)
+
+
+def dump(q, path, buffer_size=4 * 1024 * 1024, fsync=True):
+    """
+    Drain all messages of queue *q* (:class:`ipcqueue.posixmq.Queue` or
+    :class:`ipcqueue.sysvmq.Queue`) into the file *path* and return
+    number of dumped messages. Messages are received in batches of at
+    most *buffer_size* bytes, until the queue is empty. Messages put by
+    producers meanwhile are dumped too, stop producers to get a consistent
+    snapshot. If *fsync* is ``True``, the file is flushed to the disk.
+    Messages spilled by the overflow aren't dumped, they are already
+    stored in files.
+    """
+    backend = _backend(q)
+    batches = _batches(backend, q)
+    ffi = batches.ffi
+    # Buffers are filled by the kernel, don't waste time by zeroing them
+    alloc = ffi.new_allocator(should_clear_after_alloc=False)
+    buffer_size = max(buffer_size, batches.max_msg_size)
+    buf = alloc('char[]', buffer_size)
+    sizes = alloc('size_t[]', _MAX_BATCH_COUNT)
+    tags = alloc(batches.tag_type, _MAX_BATCH_COUNT)
+    count = ffi.new('size_t *')
+
+    total = 0
+    with open(path, 'wb') as f:
+        f.write(_HEADER.pack(_MAGIC, _VERSION, backend))
+        while True:
+            batches.get(buf, buffer_size, sizes, tags, _MAX_BATCH_COUNT, count)
+            n = count[0]
+            if not n:
+                break
+            msg_sizes = sizes[0:n]
+            body = (struct.pack('<{}I'.format(n), *msg_sizes) +
+                    struct.pack('<{}q'.format(n), *tags[0:n]) +
+                    ffi.buffer(buf, sum(msg_sizes))[:])
+            f.write(_CHUNK.pack(
+                n, len(body), zlib.crc32(body) & 0xffffffff))
+            f.write(body)
+            total += n
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    return total
+
+
+def load(q, path):
+    """
+    Put all messages from the file *path* created by :func:`dump` into
+    queue *q* of the same kind and return number of loaded messages.
+    It blocks while the queue is full. Raise :class:`ValueError` if the
+    file is corrupted, messages of chunks before the corrupted one are
+    loaded.
+    """
+    backend = _backend(q)
+    batches = _batches(backend, q)
+    ffi = batches.ffi
+    sent = ffi.new('size_t *')
+
+    total = 0
+    with open(path, 'rb') as f:
+        header = f.read(_HEADER.size)
+        if len(header) < _HEADER.size:
+            raise ValueError('Not a queue snapshot')
+        magic, version, file_backend = _HEADER.unpack(header)
+        if magic != _MAGIC or version != _VERSION:
+            raise ValueError('Not a queue snapshot')
+        if file_backend != backend:
+            raise ValueError('Snapshot of a different kind of queue')
+
+        while True:
+            chunk = f.read(_CHUNK.size)
+            if not chunk:
+                break
+            if len(chunk) < _CHUNK.size:
+                raise ValueError('Truncated snapshot')
+            n, size, crc = _CHUNK.unpack(chunk)
+            body = f.read(size)
+            if len(body) < size:
+                raise ValueError('Truncated snapshot')
+            if zlib.crc32(body) & 0xffffffff != crc:
+                raise ValueError('Corrupted snapshot')
+            msg_sizes = ffi.new(
+                'size_t[]', struct.unpack_from('<{}I'.format(n), body))
+            tags = ffi.new(
+                batches.tag_type,
+                struct.unpack_from('<{}q'.format(n), body, 4 * n))
+            data = ffi.from_buffer(body)
+            batches.put(data + 12 * n, msg_sizes, tags, n, sent)
+            total += n
+    return total
+
+
+def _open_queue(args):
+    if args.posixmq is not None:
+        return posixmq.Queue(
+            args.posixmq, maxsize=args.maxsize, maxmsgsize=args.maxmsgsize)
+    return sysvmq.Queue(args.sysvmq, max_bytes=args.max_bytes)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        prog='python -m ipcqueue.snapshot',
+        description='Dump messages of a queue into a file or load them.')
+    parser.add_argument('mode', choices=['dump', 'load'])
+    target = parser.add_mutually_exclusive_group(required=True)
+    target.add_argument('--posixmq', metavar='NAME')
+    target.add_argument('--sysvmq', metavar='KEY', type=int)
+    parser.add_argument('--maxsize', type=int, default=10)
+    parser.add_argument('--maxmsgsize', type=int, default=1024)
+    parser.add_argument('--max-bytes', type=int)
+    parser.add_argument('path')
+    args = parser.parse_args(argv)
+
+    q = _open_queue(args)
+    try:
+        start = time.time()
+        if args.mode == 'dump':
+            count = dump(q, args.path)
+        else:
+            count = load(q, args.path)
+        print('{} {} messages in {:.3f} s'.format(
+            'Dumped' if args.mode == 'dump' else 'Loaded', count,
+            time.time() - start))
+    finally:
+        # Closing SYS V queue removes it with all messages
+        if isinstance(q, posixmq.Queue):
+            q.close()
+
+
+if __name__ == '__main__':
+    main()
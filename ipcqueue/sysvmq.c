@@ -1,4 +1,8 @@
 
+#ifndef _GNU_SOURCE
+#define _GNU_SOURCE
+#endif
+
 #include <errno.h>
 #include <math.h>
 #include <stdlib.h>
@@ -9,6 +13,10 @@
 
 #include "sysvmq.h"
 
+#ifndef MSG_COPY
+#define MSG_COPY 040000
+#endif
+
 SysVMqResult sysvmq_open(const unsigned int key, int * const mq) {
     int mqdes = msgget(key == 0 ? IPC_PRIVATE : key, 0644 | IPC_CREAT);
 
@@ -54,16 +62,27 @@ SysVMqResult sysvmq_put(const int mq, const char * const msg,
         const size_t msg_size, const long msg_type,
         const double timeout) {
 
+    return sysvmq_putv(mq, &msg, &msg_size, 1, msg_type, timeout);
+}
+
+SysVMqResult sysvmq_putv(const int mq, const char * const * const msgs,
+        const size_t * const msg_sizes, const size_t count,
+        const long msg_type, const double timeout) {
+
     SysVMqBuffer buffer;
+    size_t msg_size = 0;
+    size_t i;
     int res;
 
-    if (msg_size > MTEXT_BUFFER_SIZE) {
-        return SYSVMQ_E_SIZE;
-    }
-    else {
-        buffer.mtype = msg_type;
-        memcpy(&buffer.mtext, msg, msg_size);
+    /* Gather parts of the message directly into the message buffer */
+    for (i = 0; i < count; ++i) {
+        if (msg_sizes[i] > MTEXT_BUFFER_SIZE - msg_size) {
+            return SYSVMQ_E_SIZE;
+        }
+        memcpy(buffer.mtext + msg_size, msgs[i], msg_sizes[i]);
+        msg_size += msg_sizes[i];
     }
+    buffer.mtype = msg_type;
 
     if (isinf(timeout)) {
         /* Block forever */
@@ -107,24 +126,13 @@ SysVMqResult sysvmq_put(const int mq, const char * const msg,
     }
 }
 
-SysVMqResult sysvmq_get(const int mq, char * const buffer,
-        size_t * const size, const long msg_type,
-        const double timeout) {
+static SysVMqResult receive_msg(const int mq, char * const buffer,
+        size_t * const size, long * const msg_type, const int flags) {
 
     SysVMqBuffer msg_buf;
     ssize_t res;
 
-    if (isinf(timeout)) {
-        /* Block forever */
-        res = msgrcv(mq, &msg_buf, MTEXT_BUFFER_SIZE, msg_type, 0);
-    }
-    else if (timeout == 0.0) {
-        /* Don't block */
-        res = msgrcv(mq, &msg_buf, MTEXT_BUFFER_SIZE, msg_type, IPC_NOWAIT);
-    }
-    else {
-        return SYSVMQ_E_VALUE;
-    }
+    res = msgrcv(mq, &msg_buf, MTEXT_BUFFER_SIZE, *msg_type, flags);
 
     if (res < 0) {
         switch (errno) {
@@ -147,6 +155,9 @@ SysVMqResult sysvmq_get(const int mq, char * const buffer,
             case ENOMSG:
                 return SYSVMQ_E_EMPTY;
                 break;
+            case ENOSYS:
+                return SYSVMQ_E_NOT_SUPPORTED;
+                break;
             default:
                 return SYSVMQ_E;
         }
@@ -158,11 +169,91 @@ SysVMqResult sysvmq_get(const int mq, char * const buffer,
         else {
             memcpy(buffer, &msg_buf.mtext, res);
             *size = res;
+            *msg_type = msg_buf.mtype;
             return SYSVMQ_OK;
         }
     }
 }
 
+SysVMqResult sysvmq_get(const int mq, char * const buffer,
+        size_t * const size, long * const msg_type, const int except,
+        const double timeout) {
+
+    int flags = except ? MSG_EXCEPT : 0;
+
+    if (isinf(timeout)) {
+        /* Block forever */
+    }
+    else if (timeout == 0.0) {
+        /* Don't block */
+        flags |= IPC_NOWAIT;
+    }
+    else {
+        return SYSVMQ_E_VALUE;
+    }
+
+    return receive_msg(mq, buffer, size, msg_type, flags);
+}
+
+SysVMqResult sysvmq_peek(const int mq, char * const buffer,
+        size_t * const size, long * const msg_type, const long index) {
+
+    /* MSG_COPY reads message at position *index* without removing it */
+    *msg_type = index;
+    return receive_msg(mq, buffer, size, msg_type, MSG_COPY | IPC_NOWAIT);
+}
+
+SysVMqResult sysvmq_get_batch(const int mq, char * const buffer,
+        const size_t buffer_size, size_t * const msg_sizes,
+        long * const msg_types, const size_t max_count,
+        size_t * const count) {
+
+    /* Receive messages without blocking until the queue is empty, or
+       until the buffer can't hold a message of the maximum size */
+    size_t offset = 0;
+    size_t size;
+    SysVMqResult res;
+
+    *count = 0;
+    while (*count < max_count &&
+            buffer_size - offset >= MTEXT_BUFFER_SIZE) {
+        size = buffer_size - offset;
+        msg_types[*count] = 0;
+        res = receive_msg(mq, buffer + offset, &size, msg_types + *count,
+                IPC_NOWAIT);
+        if (res == SYSVMQ_E_EMPTY) {
+            break;
+        }
+        else if (res != SYSVMQ_OK) {
+            return res;
+        }
+        msg_sizes[*count] = size;
+        offset += size;
+        ++*count;
+    }
+
+    return SYSVMQ_OK;
+}
+
+SysVMqResult sysvmq_put_batch(const int mq, const char * const buffer,
+        const size_t * const msg_sizes, const long * const msg_types,
+        const size_t count, const double timeout, size_t * const sent) {
+
+    size_t offset = 0;
+    SysVMqResult res;
+
+    for (*sent = 0; *sent < count; ++*sent) {
+        res = sysvmq_put(mq, buffer + offset, msg_sizes[*sent],
+                msg_types[*sent], timeout);
+        if (res != SYSVMQ_OK) {
+            return res;
+        }
+        offset += msg_sizes[*sent];
+    }
+
+    return SYSVMQ_OK;
+}
+
 SysVMqResult sysvmq_get_attr(const int mq, SysVMqAttr * const attr) {
     struct msqid_ds buf;
 
@@ -15,6 +15,7 @@ typedef enum {
     SYSVMQ_E_SIZE,
     SYSVMQ_E_FULL,
     SYSVMQ_E_EMPTY,
+    SYSVMQ_E_NOT_SUPPORTED,
 } SysVMqResult;
 
 typedef struct {
@@ -37,10 +38,26 @@ SysVMqResult sysvmq_put(const int mq, const char * const msg,
         const size_t msg_size, const long msg_type,
         const double timeout);
 
+SysVMqResult sysvmq_putv(const int mq, const char * const * const msgs,
+        const size_t * const msg_sizes, const size_t count,
+        const long msg_type, const double timeout);
+
 SysVMqResult sysvmq_get(const int mq, char * const buffer,
-        size_t * const size, const long msg_type,
+        size_t * const size, long * const msg_type, const int except,
         const double timeout);
 
+SysVMqResult sysvmq_peek(const int mq, char * const buffer,
+        size_t * const size, long * const msg_type, const long index);
+
+SysVMqResult sysvmq_get_batch(const int mq, char * const buffer,
+        const size_t buffer_size, size_t * const msg_sizes,
+        long * const msg_types, const size_t max_count,
+        size_t * const count);
+
+SysVMqResult sysvmq_put_batch(const int mq, const char * const buffer,
+        const size_t * const msg_sizes, const long * const msg_types,
+        const size_t count, const double timeout, size_t * const sent);
+
 SysVMqResult sysvmq_get_attr(const int mq, SysVMqAttr * const attr);
 
 SysVMqResult sysvmq_set_max_bytes(const int mq, const size_t max_bytes);
@@ -2,16 +2,21 @@
 Interprocess SYS V message queue implementation.
 """
 
+import collections
+import functools
+import threading
+import time
+
 from .serializers import PickleSerializer
 
 try:
-    import Queue as queue
-except ImportError:
     import queue
+except ImportError:
+    import Queue as queue
 
 from ipcqueue._sysvmq import ffi, lib
 
-__all__ = ['QueueError', 'Queue']
+__all__ = ['QueueError', 'Queue', 'AsyncQueue']
 
 
 class QueueError(Exception):
@@ -20,8 +25,8 @@ class QueueError(Exception):
     Value of the *errno* is system dependent, do don't use numeric codes
     directly, use constants **QueueError.ERROR**, **QueueError.INVALID_VALUE**,
     **QueueError.NO_PERMISSIONS**, **QueueError.NO_SYSTEM_RESOURCES**,
-    **QueueError.INVALID_DESCRIPTOR**, **QueueError.INTERRUPTED** and
-    **QueueError.TOO_BIG_MESSAGE**.
+    **QueueError.INVALID_DESCRIPTOR**, **QueueError.INTERRUPTED**,
+    **QueueError.TOO_BIG_MESSAGE** and **QueueError.NOT_SUPPORTED**.
     """
 
     ERROR = lib.SYSVMQ_E
@@ -31,6 +36,7 @@ class QueueError(Exception):
     INVALID_DESCRIPTOR = lib.SYSVMQ_E_DESCRIPTOR
     INTERRUPTED = lib.SYSVMQ_E_SIGNAL
     TOO_BIG_MESSAGE = lib.SYSVMQ_E_SIZE
+    NOT_SUPPORTED = lib.SYSVMQ_E_NOT_SUPPORTED
 
     _errno_to_str_map = {
         ERROR: 'Error',
@@ -40,6 +46,7 @@ class QueueError(Exception):
         INVALID_DESCRIPTOR: 'Invalid queue descriptor',
         INTERRUPTED: 'Interrupted by signal',
         TOO_BIG_MESSAGE: 'Data is too big',
+        NOT_SUPPORTED: 'Not supported by the kernel',
     }
 
     def __init__(self, errno, msg=None):
@@ -47,23 +54,53 @@ class QueueError(Exception):
             try:
                 msg = self._errno_to_str_map[errno]
             except KeyError:
-                msg = self._errno_to_str_map[-1]
+                msg = self._errno_to_str_map[self.ERROR]
         self.errno = errno
         self.msg = msg
         super(QueueError, self).__init__('{}, {}'.format(errno, msg))
 
 
+# Interval of polling the kernel queue by local consumers
+_LOCAL_POLL_INTERVAL = 0.005
+
+
+def _size(data):
+    if isinstance(data, bytes):
+        return len(data)
+    elif isinstance(data, (list, tuple)):
+        return sum(_size(part) for part in data)
+    return memoryview(data).nbytes
+
+
+def _is_rejected(error):
+    # Errors of data which can never be sent into the queue
+    return isinstance(error, QueueError) and error.errno in (
+        QueueError.TOO_BIG_MESSAGE, QueueError.INVALID_VALUE)
+
+
 class Queue(object):
     """
-    SYS V message queue.
+    SYS V message queue. The queue object can be shared by threads,
+    concurrent :meth:`put` and :meth:`get` calls are safe and don't
+    contend on any lock unless watermarks, overflow or scheduler are set.
+    Blocking calls release the GIL. Don't call :meth:`close` while other
+    threads use the queue.
     """
 
-    def __init__(self, key=None, max_bytes=None, serializer=PickleSerializer):
+    def __init__(self, key=None, max_bytes=None, serializer=PickleSerializer,
+                 local=False):
         """
         Constructor for message queue. *key* is an unique identifier of
         the queue, must be positive number or ``0`` for private queue.
         *max_bytes* is a maximum number of bytes allowed in queue
-        (maximum value depends on hard system limit).
+        (maximum value depends on hard system limit). If *local* is
+        ``True``, items put by a thread of the process are handed over to
+        a consumer of the same process already waiting in :meth:`get`
+        (with *msg_type* ``0`` and no *exclude_type*) without
+        serialization and the kernel, see :mod:`ipcqueue.handoff`. Other
+        items still go through the kernel queue, which such consumers
+        poll every few milliseconds. Handed over items are the same
+        objects, not copies.
         """
         queue_id = ffi.new('int *')
         res = lib.sysvmq_open(0 if key is None else key, queue_id)
@@ -71,6 +108,14 @@ class Queue(object):
             raise QueueError(res)
         self._queue_id = queue_id[0]
         self._key = key
+        self._local = threading.local()
+        self._handoff = None
+        if local:
+            from . import handoff
+            self._handoff = handoff.channel(('sysvmq', self._queue_id))
+        self._watermarks = None
+        self._overflow = None
+        self._scheduler = None
 
         if max_bytes is None:
             max_bytes = self.qattr()['max_bytes']
@@ -79,42 +124,92 @@ class Queue(object):
             if res != lib.SYSVMQ_OK:
                 raise QueueError(res)
         self._max_bytes = max_bytes
+        self._max_msg_size = min(max_bytes, lib.MTEXT_BUFFER_SIZE)
         self._serializer = serializer
 
+    @classmethod
+    def open_auto(cls, key, msg_sizes, budget=None,
+                  serializer=PickleSerializer):
+        """
+        Open message queue *key* with the largest *max_bytes* allowed by
+        kernel limits for messages of *msg_sizes* (size of serialized
+        message in bytes, or a sample of sizes). *budget* is a maximum
+        number of bytes in the queue, see
+        :func:`ipcqueue.limits.plan_sysv`.
+        """
+        from . import limits
+        plan = limits.plan_sysv(msg_sizes, budget=budget)
+        return cls(key, max_bytes=plan['max_bytes'], serializer=serializer)
+
     def close(self):
         """
         Close a message queue.
         """
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+        if self._overflow is not None:
+            self._overflow.close()
+            self._overflow = None
         res = lib.sysvmq_close(self._queue_id)
         if res != lib.SYSVMQ_OK:
             raise QueueError(res)
 
-    def put(self, item, block=True, msg_type=1):
+    def put(self, item, block=True, msg_type=1, delay=None):
         """
         Put *item* into the queue. If *block* is ``True``, block if
         necessary until a free slot is available. Otherwise, put an *item*
         on the queue if a free slot is immediately available, else raise
         the :class:`queue.Full` exception. *msg_type* must be positive
         integer value, this value can be used by the receiving process
-        for message selection.
+        for message selection. If overflow is set by :meth:`set_overflow`,
+        *item* is spilled to the disk instead of blocking when the queue
+        is full. If *delay* is set, *item* is put into the queue after
+        *delay* seconds by the scheduler set by :meth:`set_scheduler`,
+        *block* is ignored.
+        """
+        if (self._handoff is not None and delay is None and
+                self._overflow is None and self._handoff.offer(item)):
+            return
+        self.put_raw(
+            self._serializer.dumps(item), block=block, msg_type=msg_type,
+            delay=delay)
+
+    def put_raw(self, data, block=True, msg_type=1, delay=None):
+        """
+        Put *data* into the queue as it is, without the serializer. *data*
+        is any C-contiguous object supporting the buffer protocol, e.g.
+        :class:`bytes`, :class:`bytearray`, :class:`memoryview` or
+        :class:`array.array`. *data* can be also a :class:`list` or
+        :class:`tuple` of such objects, they are gathered directly into
+        the message buffer in C. Serializers can return the same types.
+        Other arguments are the same as for :meth:`put`.
         """
         if block:
             timeout = float('inf')
         else:
             timeout = 0.0
-        data = self._serializer.dumps(item)
-        data_len = len(data)
 
-        if data_len > self._max_bytes:
+        if _size(data) > self._max_msg_size:
             raise QueueError(lib.SYSVMQ_E_SIZE)
 
-        res = lib.sysvmq_put(
-                self._queue_id, data, data_len, msg_type, timeout)
+        if delay is not None:
+            self._schedule(data, time.time() + delay, msg_type)
+        elif self._overflow is not None:
+            self._overflow.put(data, msg_type)
+        else:
+            self._send(data, msg_type, timeout)
 
-        if res == lib.SYSVMQ_E_FULL:
-            raise queue.Full
-        elif res != lib.SYSVMQ_OK:
-            raise QueueError(res)
+    def put_at(self, item, when, msg_type=1):
+        """
+        Put *item* into the queue at time *when* (seconds since the epoch)
+        by the scheduler set by :meth:`set_scheduler`. *msg_type* must be
+        positive integer value.
+        """
+        data = self._serializer.dumps(item)
+        if _size(data) > self._max_msg_size:
+            raise QueueError(lib.SYSVMQ_E_SIZE)
+        self._schedule(data, when, msg_type)
 
     def put_nowait(self, item, msg_type=1):
         """
@@ -125,7 +220,102 @@ class Queue(object):
         """
         return self.put(item, block=False, msg_type=msg_type)
 
-    def get(self, block=True, msg_type=0):
+    def put_if_below(self, item, watermark, block=True, msg_type=1):
+        """
+        Put *item* into the queue only if the number of messages in the
+        queue is below *watermark*, else raise the :class:`queue.Full`
+        exception. The depth is sampled as configured by
+        :meth:`set_watermarks`, or read from the queue on every call if
+        watermarks are not set. Other arguments are the same as
+        for :meth:`put`.
+        """
+        if self._depth() >= watermark:
+            raise queue.Full
+        self.put(item, block=block, msg_type=msg_type)
+
+    def put_or_drop(self, item, msg_type=1):
+        """
+        Put low priority *item* into the queue without blocking, or drop it
+        with a probability growing linearly from ``0`` at the low watermark
+        to ``1`` at the high watermark. Return ``True`` if *item* was put
+        into the queue, ``False`` if it was dropped. Watermarks must be set
+        by :meth:`set_watermarks`.
+        """
+        if self._watermarks is None:
+            raise ValueError('Watermarks are not set')
+        if self._watermarks.should_drop():
+            return False
+        try:
+            self.put(item, block=False, msg_type=msg_type)
+        except queue.Full:
+            return False
+        return True
+
+    def set_watermarks(self, high, low=None, on_high=None, on_low=None,
+                       sample_interval=0.01):
+        """
+        Set *high* and *low* watermarks of the number of messages in the
+        queue. *on_high* callback is called with the current depth when
+        it reaches *high*, *on_low* callback is called when it falls back
+        to *low* (default is *high*). Depth of the queue is sampled at
+        most once per *sample_interval* seconds and estimated from put and
+        got messages in between. Pass ``None`` as *high* to remove
+        watermarks.
+        """
+        if high is None:
+            self._watermarks = None
+        else:
+            from .watermark import Watermarks
+            self._watermarks = Watermarks(
+                self.qsize, high, low=low, on_high=on_high, on_low=on_low,
+                sample_interval=sample_interval)
+
+    def set_overflow(self, directory, segment_size=64 * 1024 * 1024,
+                     fsync=False, refill_interval=0.05):
+        """
+        Spill messages to segment files in *directory* when the queue is
+        full, instead of blocking. Spilled messages are moved back into
+        the queue when it has free space, on every :meth:`put` and every
+        *refill_interval* seconds by a background thread, so FIFO order
+        of messages is preserved. A new segment file is started when the
+        current one exceeds *segment_size* bytes, if *fsync* is ``True``,
+        every spilled message is flushed to the disk. Spilled messages
+        left by previous process are loaded from *directory*. Pass
+        ``None`` as *directory* to remove overflow.
+        """
+        if self._overflow is not None:
+            self._overflow.close()
+            self._overflow = None
+        if directory is not None:
+            from .overflow import Overflow
+            self._overflow = Overflow(
+                directory, self._send_nowait, segment_size=segment_size,
+                fsync=fsync, refill_interval=refill_interval,
+                rejected=_is_rejected)
+
+    def set_scheduler(self, journal=None, tick=0.01, batch_size=1000,
+                      fsync=False):
+        """
+        Enable delayed messages, see :meth:`put_at` and *delay* of
+        :meth:`put`. Scheduled messages are kept in the process in
+        a hierarchical timer wheel with resolution *tick* seconds, a
+        background thread puts due messages into the queue in batches of
+        at most *batch_size* messages. If *journal* is a path to a file,
+        scheduled messages are journaled into it and loaded again by the
+        next :meth:`set_scheduler` with the same *journal*, if *fsync* is
+        ``True``, every record is flushed to the disk. Pass ``False`` as
+        *journal* to remove the scheduler.
+        """
+        if self._scheduler is not None:
+            self._scheduler.close()
+            self._scheduler = None
+        if journal is not False:
+            from .scheduler import Scheduler
+            self._scheduler = Scheduler(
+                self._send_nowait, journal=journal, tick=tick,
+                batch_size=batch_size, fsync=fsync, rejected=_is_rejected)
+
+    def get(self, block=True, msg_type=0, exclude_type=None):
         """
         Remove and return an item from the queue. If *block* argument is
         ``True``, block if necessary until an item is available. Otherwise,
@@ -135,27 +325,51 @@ class Queue(object):
         queue is read, if it's greater than ``0``, then the first message
         in the queue of requested type is read and if it's less than ``0``,
         then the first message in the queue with the lowest type less than
-        or equal to the absolute value of *msg_type* will be read.
+        or equal to the absolute value of *msg_type* will be read. If
+        positive *exclude_type* is set, the first message in the queue
+        with type other than *exclude_type* is read (Linux only).
+        """
+        if (self._handoff is not None and msg_type == 0 and
+                exclude_type is None):
+            return self._get_local(block)
+        data, _ = self.get_raw(
+            block=block, msg_type=msg_type, exclude_type=exclude_type)
+        return self._serializer.loads(data)
+
+    def get_raw(self, block=True, msg_type=0, exclude_type=None):
+        """
+        Remove and return a message from the queue as it is, without the
+        serializer. Return a tuple ``(data, msg_type)`` where *data* is
+        :class:`bytes` and *msg_type* is the type of the message. Arguments
+        are the same as for :meth:`get`.
         """
         if block:
             timeout = float('inf')
         else:
             timeout = 0.0
-        buf = ffi.new('char[]', self._max_bytes)
-        size = ffi.new('size_t *', self._max_bytes)
+        if exclude_type is not None:
+            if msg_type != 0 or exclude_type <= 0:
+                raise QueueError(lib.SYSVMQ_E_VALUE)
+            msg_type = exclude_type
+        buf, size, received_type = self._buffers()
+        size[0] = self._max_bytes
+        received_type[0] = msg_type
 
-        res = lib.sysvmq_get(self._queue_id, buf, size, msg_type, timeout)
+        res = lib.sysvmq_get(
+            self._queue_id, buf, size, received_type,
+            exclude_type is not None, timeout)
 
         if res == lib.SYSVMQ_E_EMPTY:
             raise queue.Empty
         elif res != lib.SYSVMQ_OK:
             raise QueueError(res)
 
-        data_size = size[0]
-        data = ffi.buffer(buf[0:data_size])[:]
-        return self._serializer.loads(data)
+        if self._watermarks is not None:
+            self._watermarks.adjust(-1)
+
+        return ffi.buffer(buf, size[0])[:], received_type[0]
 
-    def get_nowait(self, msg_type=0):
+    def get_nowait(self, msg_type=0, exclude_type=None):
         """
         Get and return an item from queue, equivalent to ``get(block=False)``.
         *msg_type* specifies the type of requested message. If it's ``0``,
@@ -163,27 +377,502 @@ class Queue(object):
         ``0``, then the first message in the queue of requested type is
         read and if it's less than ``0``, then the first message in the
         queue with the lowest type less than or equal to the absolute value
-        of *msg_type* will be read.
+        of *msg_type* will be read. If positive *exclude_type* is set, the
+        first message in the queue with type other than *exclude_type*
+        is read.
+        """
+        return self.get(
+            block=False, msg_type=msg_type, exclude_type=exclude_type)
+
+    def peek(self, index=0):
+        """
+        Return an item at position *index* in the queue without removing
+        it, raise the :class:`IndexError` exception if there are not
+        enough messages in the queue. Requires Linux kernel with
+        ``CONFIG_CHECKPOINT_RESTORE``, else
+        **QueueError.NOT_SUPPORTED** is raised.
+        """
+        return self._peek(index)[1]
+
+    def iter_messages(self):
+        """
+        Iterate over messages in the queue without removing them, yield
+        ``(msg_type, item)`` tuples. Messages got or put by other
+        processes during the iteration may be skipped or returned twice.
+        See :meth:`peek`.
         """
-        return self.get(block=False, msg_type=msg_type)
+        index = 0
+        while True:
+            try:
+                yield self._peek(index)
+            except IndexError:
+                return
+            index += 1
 
     def qattr(self):
         """
         Return attributes of the message queue as a :class:`dict`:
-        ``{'size': 3, 'max_bytes': 8192}``.
+        ``{'size': 3, 'max_bytes': 8192}``. If overflow is set, the number
+        of messages spilled to the disk is returned under the ``'spilled'``
+        key.
         """
         attr = ffi.new('SysVMqAttr *')
         res = lib.sysvmq_get_attr(self._queue_id, attr)
         if res != lib.SYSVMQ_OK:
             raise QueueError(res)
-        return {
+        result = {
             'size': attr.size,
             'max_bytes': attr.max_bytes,
         }
+        if self._overflow is not None:
+            result['spilled'] = len(self._overflow)
+        return result
 
     def qsize(self):
         """
         Return the approximate size of the queue. Note, ``qsize() > 0``
         doesn't guarantee that a subsequent :meth:`get()` will not block.
         """
+        if self._handoff is not None:
+            return self.qattr()['size'] + len(self._handoff)
         return self.qattr()['size']
+
+    def _peek(self, index):
+        buf, size, msg_type = self._buffers()
+        size[0] = self._max_bytes
+
+        res = lib.sysvmq_peek(self._queue_id, buf, size, msg_type, index)
+
+        if res == lib.SYSVMQ_E_EMPTY:
+            raise IndexError(index)
+        elif res != lib.SYSVMQ_OK:
+            raise QueueError(res)
+
+        data = ffi.buffer(buf, size[0])[:]
+        return msg_type[0], self._serializer.loads(data)
+
+    def _get_local(self, block):
+        # SYS V queues have no descriptor to wait on, the kernel queue is
+        # polled while waiting for handed over items
+        while True:
+            try:
+                data, _ = self.get_raw(block=False)
+            except queue.Empty:
+                pass
+            else:
+                return self._serializer.loads(data)
+            found, item = self._handoff.take()
+            if found:
+                return item
+            if not block:
+                raise queue.Empty
+            self._handoff.wait([], _LOCAL_POLL_INTERVAL)
+
+    def _buffers(self):
+        # Receive buffers are allocated once per thread, so concurrent
+        # get() calls neither allocate nor share them
+        local = self._local
+        try:
+            return local.buf, local.size, local.msg_type
+        except AttributeError:
+            local.buf = ffi.new('char[]', self._max_bytes)
+            local.size = ffi.new('size_t *')
+            local.msg_type = ffi.new('long *')
+            return local.buf, local.size, local.msg_type
+
+    def _depth(self):
+        if self._watermarks is not None:
+            return self._watermarks.depth()
+        return self.qsize()
+
+    def _send(self, data, msg_type, timeout):
+        if isinstance(data, (list, tuple)):
+            msgs = [ffi.from_buffer(part) for part in data]
+            res = lib.sysvmq_putv(
+                    self._queue_id, msgs, [len(msg) for msg in msgs],
+                    len(msgs), msg_type, timeout)
+        else:
+            if not isinstance(data, bytes):
+                data = ffi.from_buffer(data)
+            res = lib.sysvmq_put(
+                    self._queue_id, data, len(data), msg_type, timeout)
+
+        if res == lib.SYSVMQ_E_FULL:
+            raise queue.Full
+        elif res != lib.SYSVMQ_OK:
+            raise QueueError(res)
+
+        if self._watermarks is not None:
+            self._watermarks.adjust(1)
+
+    def _schedule(self, data, when, msg_type):
+        if self._scheduler is None:
+            raise ValueError('Scheduler is not set')
+        self._scheduler.schedule(data, when, msg_type)
+
+    def _send_nowait(self, data, msg_type):
+        try:
+            self._send(data, msg_type, 0.0)
+        except queue.Full:
+            return False
+        return True
+
+
+class _Getters(object):
+
+    def __init__(self):
+        # Pairs (future, loop) in order of get() calls
+        self.futures = collections.deque()
+        # A waiter thread is blocked in the kernel
+        self.receiving = False
+        # The sentinel message was sent to wake the waiter and wasn't
+        # received yet
+        self.woken = False
+
+
+class AsyncQueue(object):
+    """
+    SYS V message queue for :mod:`asyncio`. SYS V queues have no file
+    descriptor for the event loop, so blocking calls are made by the
+    shared pool of waiter threads, see :mod:`ipcqueue.waiters`.
+    Coroutines waiting for the same *msg_type* share one blocking
+    receive and one thread, items are handed to them in order of
+    :meth:`get` calls. Every *msg_type* with pending gets holds its
+    thread, so the number of threads isn't limited for them. Items which don't fit into the full queue are
+    sent by a waiter thread in batches. Items are put and got without
+    threads when the queue isn't full or empty.
+
+    When the last pending :meth:`get` of a *msg_type* is cancelled, the
+    waiter blocked in the kernel is woken by a sentinel message of that
+    type, which is dropped by :class:`AsyncQueue` objects. Consumers of
+    the same message types in other processes should be
+    :class:`AsyncQueue` objects too, else they may receive the sentinel.
+    A message received by the waiter just when the last pending get is
+    cancelled is put back at the end of the queue, after messages of the
+    same type put meanwhile.
+    """
+
+    # Payload of the sentinel message
+    _WAKE = b'\x00ipcqueue.sysvmq.AsyncQueue.wake\x00'
+
+    def __init__(self, key=None, max_bytes=None, serializer=PickleSerializer,
+                 batch_size=100):
+        """
+        Constructor for asyncio message queue, *key*, *max_bytes* and
+        *serializer* are the same as for :class:`Queue`. Blocked puts
+        are sent in batches of at most *batch_size* items.
+        """
+        import asyncio
+        from . import waiters
+        self._asyncio = asyncio
+        self._waiters = waiters
+        self.queue = Queue(key, max_bytes=max_bytes, serializer=serializer)
+        self._serializer = serializer
+        self._batch_size = batch_size
+        self._lock = threading.Lock()
+        self._getters = {}
+        self._putters = collections.deque()
+        self._sending = False
+        self._closed = False
+
+    def close(self):
+        """
+        Cancel pending :meth:`get` and :meth:`put` calls and close the
+        message queue, see :meth:`Queue.close`.
+        """
+        with self._lock:
+            self._closed = True
+            pending = []
+            for getters in self._getters.values():
+                pending.extend(getters.futures)
+            pending.extend(
+                (fut, loop) for _, _, fut, loop in self._putters
+                if fut is not None)
+            self._putters.clear()
+        for fut, loop in pending:
+            loop.call_soon_threadsafe(fut.cancel)
+        # Waiters blocked in the kernel fail when the queue is removed
+        self.queue.close()
+
+    def put(self, item, msg_type=1):
+        """
+        Put *item* into the queue. Return :class:`asyncio.Future`, which
+        is done when *item* is in the queue. *msg_type* must be positive
+        integer value. Items put by one object are sent in order of
+        :meth:`put` calls. Cancelling the future doesn't stop sending of
+        the item, if a waiter thread is already sending it.
+        """
+        data = self._serializer.dumps(item)
+        # Blocked puts are gathered into one buffer of a batch
+        if isinstance(data, (list, tuple)):
+            data = b''.join(data)
+        elif not isinstance(data, bytes):
+            data = memoryview(data).tobytes()
+        loop = self._loop()
+        fut = self._asyncio.Future(loop=loop)
+        with self._lock:
+            if self._closed:
+                raise QueueError(lib.SYSVMQ_E_DESCRIPTOR)
+            if not self._putters and self.queue._send_nowait(data, msg_type):
+                fut.set_result(None)
+                return fut
+            self._putters.append((data, msg_type, fut, loop))
+            start = not self._sending
+            self._sending = True
+        if start:
+            self._waiters.pool().submit(self._send_job, blocking=True)
+        return fut
+
+    def get(self, msg_type=0):
+        """
+        Remove and return an item from the queue. Return
+        :class:`asyncio.Future` with the item, *msg_type* has the same
+        meaning as for :meth:`Queue.get`. Cancel the future to stop
+        waiting, e.g. by :func:`asyncio.wait_for`.
+        """
+        loop = self._loop()
+        fut = self._asyncio.Future(loop=loop)
+        with self._lock:
+            if self._closed:
+                raise QueueError(lib.SYSVMQ_E_DESCRIPTOR)
+            getters = self._getters.get(msg_type)
+            if getters is None:
+                data = self._receive_nowait(msg_type)
+                if data is not None:
+                    self._set_item(fut, data)
+                    return fut
+                getters = self._getters[msg_type] = _Getters()
+                start = True
+            else:
+                start = False
+            getters.futures.append((fut, loop))
+        fut.add_done_callback(functools.partial(self._get_done, msg_type))
+        if start:
+            self._waiters.pool().submit(
+                functools.partial(self._receive_job, msg_type), blocking=True)
+        return fut
+
+    def qsize(self):
+        """
+        Return the approximate size of the queue, see :meth:`Queue.qsize`.
+        """
+        return self.queue.qsize()
+
+    def _loop(self):
+        try:
+            return self._asyncio.get_running_loop()
+        except (AttributeError, RuntimeError):
+            return self._asyncio.get_event_loop()
+
+    def _receive_nowait(self, msg_type):
+        while True:
+            try:
+                data, _ = self.queue.get_raw(block=False, msg_type=msg_type)
+            except queue.Empty:
+                return None
+            if data != self._WAKE:
+                return data
+
+    def _set_item(self, fut, data):
+        try:
+            item = self._serializer.loads(data)
+        except Exception as e:
+            fut.set_exception(e)
+        else:
+            fut.set_result(item)
+
+    def _get_done(self, msg_type, fut):
+        if not fut.cancelled():
+            return
+        with self._lock:
+            getters = self._getters.get(msg_type)
+            if getters is None:
+                return
+            for entry in getters.futures:
+                if entry[0] is fut:
+                    getters.futures.remove(entry)
+                    break
+            start = False
+            if (not getters.futures and getters.receiving and
+                    not getters.woken and not self._closed):
+                # Positive types match themselves, type 1 matches zero and
+                # negative types. The sentinel is sent under the lock, so
+                # the waiter knows it's in the queue when woken is set. If
+                # the queue is full, the send job sends it later.
+                try:
+                    if not self.queue._send_nowait(
+                            self._WAKE, max(msg_type, 1)):
+                        self._putters.append(
+                            (self._WAKE, max(msg_type, 1), None, None))
+                        start = not self._sending
+                        self._sending = True
+                    getters.woken = True
+                except QueueError:
+                    pass
+        if start:
+            self._waiters.pool().submit(self._send_job, blocking=True)
+
+    def _deliver(self, msg_type, fut, data, received_type):
+        # Called in the loop of the future
+        if not fut.done():
+            self._set_item(fut, data)
+            return
+        # The future was cancelled meanwhile, hand the item to the next
+        # waiting coroutine or return it into the queue
+        with self._lock:
+            getters = self._getters.get(msg_type)
+            if getters is not None and getters.futures:
+                fut, loop = getters.futures.popleft()
+            else:
+                fut = loop = None
+        if fut is not None:
+            loop.call_soon_threadsafe(
+                self._deliver, msg_type, fut, data, received_type)
+        elif not self._closed:
+            self._put_back(data, received_type)
+
+    def _put_back(self, data, msg_type):
+        if not self.queue._send_nowait(data, msg_type):
+            with self._lock:
+                self._putters.append((data, msg_type, None, None))
+                start = not self._sending
+                self._sending = True
+            if start:
+                self._waiters.pool().submit(self._send_job, blocking=True)
+
+    def _receive_job(self, msg_type):
+        # Runs on a waiter thread while coroutines wait for msg_type
+        while True:
+            with self._lock:
+                getters = self._getters[msg_type]
+                if not getters.futures or self._closed:
+                    del self._getters[msg_type]
+                    stale = getters.woken and not self._closed
+                    break
+                getters.receiving = True
+            error = None
+            try:
+                data, received_type = self.queue.get_raw(msg_type=msg_type)
+            except QueueError as e:
+                error = e
+            with self._lock:
+                getters.receiving = False
+                if error is not None and error.errno == QueueError.INTERRUPTED:
+                    continue
+                elif error is not None:
+                    failed = list(getters.futures)
+                    del self._getters[msg_type]
+                elif data == self._WAKE:
+                    getters.woken = False
+                    continue
+                elif getters.futures:
+                    fut, loop = getters.futures.popleft()
+                else:
+                    fut = loop = None
+            if error is not None:
+                for fut, loop in failed:
+                    loop.call_soon_threadsafe(
+                        _set_exception, fut, error)
+                return
+            if fut is not None:
+                loop.call_soon_threadsafe(
+                    self._deliver, msg_type, fut, data, received_type)
+            elif not self._closed:
+                # All gets were cancelled before the sentinel arrived
+                self._put_back(data, received_type)
+        if stale:
+            # A message arrived before the sentinel, remove the sentinel so
+            # it doesn't stay in the queue for other consumers
+            self._remove_wake(max(msg_type, 1))
+
+    def _remove_wake(self, msg_type):
+        with self._lock:
+            for entry in self._putters:
+                if entry[0] is self._WAKE and entry[1] == msg_type:
+                    self._putters.remove(entry)
+                    return
+        # Messages received before the sentinel are put back after it
+        received = []
+        while True:
+            try:
+                data, received_type = self.queue.get_raw(
+                    block=False, msg_type=msg_type)
+            except (queue.Empty, QueueError):
+                break
+            if data == self._WAKE:
+                break
+            received.append((data, received_type))
+        for data, received_type in received:
+            self._put_back(data, received_type)
+
+    def _send_job(self):
+        # Runs on a waiter thread while items wait for free space
+        try:
+            while True:
+                with self._lock:
+                    batch = []
+                    while self._putters and len(batch) < self._batch_size:
+                        entry = self._putters.popleft()
+                        if entry[2] is None or not entry[2].cancelled():
+                            batch.append(entry)
+                    if not batch or self._closed:
+                        self._sending = False
+                        return
+                try:
+                    self._send_batch(batch)
+                except Exception as e:
+                    self._complete_batch(
+                        [(fut, loop, e) for _, _, fut, loop in batch])
+        except BaseException:
+            # Don't leave later puts waiting for a send job which is gone
+            with self._lock:
+                self._sending = False
+            raise
+
+    def _send_batch(self, batch):
+        sent = ffi.new('size_t *')
+        res = lib.sysvmq_put_batch(
+            self.queue._queue_id, b''.join(entry[0] for entry in batch),
+            ffi.new('size_t[]', [len(entry[0]) for entry in batch]),
+            ffi.new('long[]', [entry[1] for entry in batch]),
+            len(batch), float('inf'), sent)
+        count = sent[0]
+        if self.queue._watermarks is not None:
+            self.queue._watermarks.adjust(count)
+
+        results = [(fut, loop, None) for _, _, fut, loop in batch[:count]]
+        if res == lib.SYSVMQ_E_SIGNAL:
+            # Interrupted by signal, retry the rest
+            with self._lock:
+                self._putters.extendleft(reversed(batch[count:]))
+        elif res != lib.SYSVMQ_OK:
+            data, msg_type, fut, loop = batch[count]
+            results.append((fut, loop, QueueError(res)))
+            # Items after the failed one weren't tried
+            with self._lock:
+                self._putters.extendleft(reversed(batch[count + 1:]))
+        self._complete_batch(results)
+
+    def _complete_batch(self, results):
+        # Complete futures of the batch by one callback per loop
+        done = collections.OrderedDict()
+        for fut, loop, error in results:
+            if fut is not None:
+                done.setdefault(loop, []).append((fut, error))
+        for loop, futures in done.items():
+            loop.call_soon_threadsafe(_complete_puts, futures)
+
+
+def _set_exception(fut, error):
+    if not fut.done():
+        fut.set_exception(error)
+
+
+def _complete_puts(futures):
+    for fut, error in futures:
+        if fut.done():
+            continue
+        if error is None:
+            fut.set_result(None)
+        else:
+            fut.set_exception(error)
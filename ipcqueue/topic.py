@@ -0,0 +1,191 @@
+"""
+Publish/subscribe fan-out over POSIX message queues. Subscribers register
+their own queues to the topic by name, the publisher serializes each item
+once and sends it to all subscriber queues in a single C call. Subscriber
+lists are shared among processes through a registry directory, one file
+per subscriber queue.
+"""
+
+import errno
+import os
+import tempfile
+import time
+
+from .posixmq import QueueError
+from .serializers import PickleSerializer
+
+try:
+    import queue
+except ImportError:
+    import Queue as queue
+
+from ipcqueue._posixmq import ffi, lib
+
+__all__ = ['Topic']
+
+# Coarse granularity of file timestamps, a registry change within the same
+# tick as the last listing doesn't change the directory's mtime
+_MTIME_TICK = 1.0
+
+
+def _default_registry():
+    if os.path.isdir('/dev/shm'):
+        return '/dev/shm/ipcqueue-topics'
+    return os.path.join(tempfile.gettempdir(), 'ipcqueue-topics')
+
+
+class Topic(object):
+    """
+    Topic *name* distributes published items to subscribed POSIX message
+    queues. *policy* defines what happens with a slow subscriber, whose
+    queue is full: **Topic.SKIP** (the default) skips it, **Topic.BLOCK**
+    waits for a free slot and **Topic.EVICT** skips it and removes it
+    from subscribers. Subscribers are stored in the directory *registry*,
+    default is ``/dev/shm/ipcqueue-topics``.
+    """
+
+    SKIP = 'skip'
+    BLOCK = 'block'
+    EVICT = 'evict'
+
+    def __init__(self, name, policy=SKIP, serializer=PickleSerializer,
+                 registry=None):
+        if not name or os.sep in name or name.startswith('.'):
+            raise ValueError('Invalid topic name {!r}'.format(name))
+        if policy not in (self.SKIP, self.BLOCK, self.EVICT):
+            raise ValueError('Invalid policy {!r}'.format(policy))
+        self._name = name
+        self._policy = policy
+        self._serializer = serializer
+        self._path = os.path.join(registry or _default_registry(), name)
+        try:
+            os.makedirs(self._path)
+        except OSError as e:
+            if e.errno != errno.EEXIST:
+                raise
+        self._descriptors = {}
+        self._names = []
+        self._mqs = ffi.new('int[]', 0)
+        self._registry_mtime = None
+        self._listed_at = None
+
+    def subscribe(self, queue_name):
+        """
+        Register POSIX message queue *queue_name* (or
+        :class:`ipcqueue.posixmq.Queue` instance) as a subscriber.
+        """
+        with open(self._subscriber_path(queue_name), 'w'):
+            pass
+
+    def unsubscribe(self, queue_name):
+        """
+        Remove POSIX message queue *queue_name* (or
+        :class:`ipcqueue.posixmq.Queue` instance) from subscribers.
+        """
+        try:
+            os.unlink(self._subscriber_path(queue_name))
+        except OSError as e:
+            if e.errno != errno.ENOENT:
+                raise
+
+    def subscribers(self):
+        """
+        Return sorted list of names of subscribed queues.
+        """
+        return sorted('/' + name for name in os.listdir(self._path))
+
+    def publish(self, item, priority=0, timeout=None):
+        """
+        Send *item* to all subscribers. *priority* is a priority of the
+        message. *timeout* is used by **Topic.BLOCK** policy, it's a
+        maximum number of seconds to wait for slow subscribers, ``None``
+        (the default) waits forever. Return :class:`dict` of failed
+        subscribers, keys are queue names and values are
+        :class:`queue.Full` or :class:`ipcqueue.posixmq.QueueError`
+        exceptions.
+        """
+        self._refresh()
+        data = self._serializer.dumps(item)
+        count = len(self._names)
+        results = ffi.new('PosixMqResult[]', count)
+
+        lib.posixmq_put_many(
+            self._mqs, count, data, len(data), priority, 0.0, results)
+        failed = [i for i in range(count) if results[i] != lib.POSIXMQ_OK]
+
+        if failed and self._policy == self.BLOCK:
+            slow = [i for i in failed if results[i] == lib.POSIXMQ_E_TIMEOUT]
+            if slow:
+                if timeout is None:
+                    timeout = float('inf')
+                mqs = ffi.new('int[]', [self._mqs[i] for i in slow])
+                slow_results = ffi.new('PosixMqResult[]', len(slow))
+                lib.posixmq_put_many(
+                    mqs, len(slow), data, len(data), priority, timeout,
+                    slow_results)
+                for i, res in zip(slow, slow_results):
+                    results[i] = res
+                failed = [
+                    i for i in failed if results[i] != lib.POSIXMQ_OK]
+
+        errors = {}
+        for i in failed:
+            name = self._names[i]
+            if results[i] == lib.POSIXMQ_E_TIMEOUT:
+                errors[name] = queue.Full()
+            else:
+                errors[name] = QueueError(results[i])
+            if (self._policy == self.EVICT or
+                    results[i] == lib.POSIXMQ_E_DOESNT_EXIST):
+                self.unsubscribe(name)
+        return errors
+
+    def close(self):
+        """
+        Close descriptors of subscribed queues.
+        """
+        for mq in self._descriptors.values():
+            if mq is not None:
+                lib.posixmq_close(mq)
+        self._descriptors = {}
+        self._names = []
+        self._mqs = ffi.new('int[]', 0)
+        self._registry_mtime = None
+
+    def _subscriber_path(self, queue_name):
+        name = getattr(queue_name, '_name', queue_name)
+        if not name.startswith('/') or '/' in name[1:]:
+            raise ValueError('Invalid queue name {!r}'.format(name))
+        return os.path.join(self._path, name[1:])
+
+    def _refresh(self):
+        mtime = os.stat(self._path).st_mtime
+        if (mtime == self._registry_mtime and
+                self._listed_at - mtime >= _MTIME_TICK):
+            return
+        # Listing made a tick after the change saw all subscribers
+        self._registry_mtime = mtime
+        self._listed_at = time.time()
+
+        names = self.subscribers()
+        for name in set(self._descriptors) - set(names):
+            mq = self._descriptors.pop(name)
+            if mq is not None:
+                lib.posixmq_close(mq)
+        for name in names:
+            if name not in self._descriptors:
+                mq = ffi.new('int *')
+                res = lib.posixmq_attach(name.encode('utf-8'), mq)
+                if res == lib.POSIXMQ_OK:
+                    self._descriptors[name] = mq[0]
+                elif res == lib.POSIXMQ_E_DOESNT_EXIST:
+                    self.unsubscribe(name)
+                else:
+                    # Keep it to not retry until the registry is changed
+                    self._descriptors[name] = None
+
+        self._names = [
+            name for name in names
+            if self._descriptors.get(name) is not None]
+        self._mqs = ffi.new(
+            'int[]', [self._descriptors[name] for name in self._names])
@@ -0,0 +1,190 @@
+"""
+Tracing of the time messages spend in the queue. :class:`TracingSerializer`
+stamps each message with a monotonic enqueue timestamp, optionally with
+the producer's PID and a sequence number, and records queue residence
+time of received messages into a :class:`Histogram`.
+"""
+
+import itertools
+import os
+import struct
+import threading
+import time
+
+from .serializers import PickleSerializer
+
+__all__ = ['Histogram', 'TracingSerializer']
+
+try:
+    _monotonic_ns = time.monotonic_ns
+except AttributeError:
+    def _monotonic_ns():
+        return int(time.monotonic() * 1000000000)
+
+
+class Histogram(object):
+    """
+    Histogram of non-negative integer values with log-linear buckets, as
+    in HdrHistogram. Values below ``2 ** sub_bucket_bits`` are recorded
+    exactly, larger values with relative precision
+    ``2 ** (1 - sub_bucket_bits)``. Histograms with the same
+    *sub_bucket_bits* can be merged.
+    """
+
+    def __init__(self, sub_bucket_bits=7):
+        self.sub_bucket_bits = sub_bucket_bits
+        self._half = 1 << (sub_bucket_bits - 1)
+        self._counts = [0] * ((64 - sub_bucket_bits + 2) * self._half)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def record(self, value, count=1):
+        """
+        Record *value* *count* times.
+        """
+        self._counts[self._index(value)] += count
+        self.count += count
+        self.total += value * count
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        """
+        Return mean of recorded values, ``None`` if histogram is empty.
+        """
+        if not self.count:
+            return None
+        return float(self.total) / self.count
+
+    def percentile(self, percentile):
+        """
+        Return the value below which *percentile* percent of recorded
+        values fall, ``None`` if histogram is empty.
+        """
+        if not self.count:
+            return None
+        rank = max(1, int(round(percentile / 100.0 * self.count)))
+        seen = 0
+        for index, count in enumerate(self._counts):
+            seen += count
+            if seen >= rank:
+                return min(self._highest_value(index), self.max)
+        return self.max
+
+    def merge(self, other):
+        """
+        Add recorded values of *other* histogram into this histogram.
+        """
+        if other.sub_bucket_bits != self.sub_bucket_bits:
+            raise ValueError('Histograms have different precision')
+        for index, count in enumerate(other._counts):
+            if count:
+                self._counts[index] += count
+        self.count += other.count
+        self.total += other.total
+        for value in (other.min, other.max):
+            if value is not None:
+                if self.min is None or value < self.min:
+                    self.min = value
+                if self.max is None or value > self.max:
+                    self.max = value
+
+    def snapshot(self):
+        """
+        Return a copy of the histogram.
+        """
+        histogram = Histogram(self.sub_bucket_bits)
+        histogram.merge(self)
+        return histogram
+
+    def reset(self):
+        """
+        Remove all recorded values.
+        """
+        self._counts = [0] * len(self._counts)
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def _index(self, value):
+        shift = value.bit_length() - self.sub_bucket_bits
+        if shift <= 0:
+            return value
+        return (shift << (self.sub_bucket_bits - 1)) + (value >> shift)
+
+    def _highest_value(self, index):
+        if index < 2 * self._half:
+            return index
+        shift = (index >> (self.sub_bucket_bits - 1)) - 1
+        lowest = (index - (shift << (self.sub_bucket_bits - 1))) << shift
+        return lowest + (1 << shift) - 1
+
+
+class TracingSerializer(object):
+    """
+    Serializer which wraps *serializer* and prepends a small header to
+    each message: enqueue timestamp of the monotonic clock in nanoseconds
+    and, if *pid* and *sequence* are ``True``, producer's PID and its
+    sequence number. On receive, queue residence time in nanoseconds is
+    recorded into :attr:`histogram`. With *sequence* enabled, messages
+    lost between consecutive sequence numbers of each producer are
+    counted in :attr:`gaps`, :class:`dict` keyed by the producer's PID;
+    it assumes messages of the producer are received in FIFO order, i.e.
+    with the same priority. Producers and consumers must use the same
+    *pid* and *sequence* settings.
+    """
+
+    _VERSION = 1
+    _HEADER = struct.Struct('<BQ')
+    _PID = struct.Struct('<I')
+    _SEQUENCE = struct.Struct('<Q')
+
+    def __init__(self, serializer=PickleSerializer, pid=True, sequence=True,
+                 histogram=None):
+        if sequence and not pid:
+            raise ValueError('Sequence numbers require PID')
+        self._serializer = serializer
+        self._pid = pid
+        self._sequence = sequence
+        self._counter = itertools.count()
+        self._last_sequence = {}
+        self._lock = threading.Lock()
+        self.histogram = histogram or Histogram()
+        self.gaps = {}
+
+    def dumps(self, obj):
+        header = self._HEADER.pack(self._VERSION, _monotonic_ns())
+        if self._pid:
+            header += self._PID.pack(os.getpid())
+        if self._sequence:
+            header += self._SEQUENCE.pack(next(self._counter))
+        return header + self._serializer.dumps(obj)
+
+    def loads(self, data):
+        now = _monotonic_ns()
+        version, timestamp = self._HEADER.unpack_from(data)
+        if version != self._VERSION:
+            raise ValueError('Message is not traced')
+        offset = self._HEADER.size
+        with self._lock:
+            self.histogram.record(max(0, now - timestamp))
+            if self._pid:
+                pid = self._PID.unpack_from(data, offset)[0]
+                offset += self._PID.size
+            if self._sequence:
+                sequence = self._SEQUENCE.unpack_from(data, offset)[0]
+                offset += self._SEQUENCE.size
+                self._check_sequence(pid, sequence)
+        return self._serializer.loads(data[offset:])
+
+    def _check_sequence(self, pid, sequence):
+        last = self._last_sequence.get(pid)
+        if last is not None and sequence > last + 1:
+            self.gaps[pid] = self.gaps.get(pid, 0) + sequence - last - 1
+        if last is None or sequence > last:
+            self._last_sequence[pid] = sequence
@@ -0,0 +1,109 @@
+"""
+Shared pool of waiter threads, which block in the kernel on behalf of
+asyncio queues, see :class:`ipcqueue.sysvmq.AsyncQueue`. A job runs on a
+pool thread while it has work, so coroutines waiting for the same thing
+share one blocking call and one thread.
+"""
+
+import collections
+import os
+import threading
+import time
+
+__all__ = ['WaiterPool', 'pool']
+
+_pool = None
+_pool_pid = None
+_pool_lock = threading.Lock()
+
+
+def pool():
+    """
+    Return the :class:`WaiterPool` shared by the process.
+    """
+    global _pool, _pool_pid
+    with _pool_lock:
+        # Threads of the pool didn't survive fork
+        if _pool is None or _pool_pid != os.getpid():
+            _pool = WaiterPool()
+            _pool_pid = os.getpid()
+        return _pool
+
+
+class WaiterPool(object):
+    """
+    Pool of threads running submitted jobs. Jobs beyond *max_threads*
+    wait until a thread is free, except blocking jobs, which always get
+    a thread. Threads are started on demand and exit after
+    *idle_timeout* seconds without a job.
+    """
+
+    def __init__(self, max_threads=64, idle_timeout=5.0):
+        self._max_threads = max_threads
+        self._idle_timeout = idle_timeout
+        self._cond = threading.Condition(threading.Lock())
+        self._jobs = collections.deque()
+        self._threads = 0
+        self._idle = 0
+
+    def __len__(self):
+        """
+        Return number of running threads.
+        """
+        with self._cond:
+            return self._threads
+
+    def submit(self, job, blocking=False):
+        """
+        Run callable *job* on a pool thread. Set *blocking* to ``True``
+        if *job* may block in the kernel until other jobs finish, e.g.
+        waits for a message, such job is run by an idle thread or a new
+        one even beyond *max_threads*, so it can't wait behind other
+        blocking jobs forever.
+        """
+        with self._cond:
+            if self._idle > len(self._jobs):
+                self._jobs.append(job)
+                self._cond.notify()
+                return
+            if blocking:
+                # New thread runs the job first, not jobs waiting before
+                args = (job,)
+            elif self._threads < self._max_threads:
+                self._jobs.append(job)
+                args = ()
+            else:
+                self._jobs.append(job)
+                return
+            self._threads += 1
+            thread = threading.Thread(target=self._run, args=args)
+            thread.daemon = True
+            thread.start()
+
+    def _run(self, job=None):
+        if job is not None:
+            try:
+                job()
+            except BaseException:
+                with self._cond:
+                    self._threads -= 1
+                raise
+        with self._cond:
+            try:
+                while True:
+                    deadline = time.time() + self._idle_timeout
+                    while not self._jobs:
+                        remaining = deadline - time.time()
+                        if remaining <= 0:
+                            return
+                        self._idle += 1
+                        self._cond.wait(remaining)
+                        self._idle -= 1
+                    job = self._jobs.popleft()
+                    self._cond.release()
+                    try:
+                        job()
+                    finally:
+                        self._cond.acquire()
+            finally:
+                self._threads -= 1
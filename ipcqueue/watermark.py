@@ -0,0 +1,124 @@
+"""
+High/low watermarks of the queue depth, used by producers for
+backpressure and load shedding.
+"""
+
+import random
+import threading
+import time
+
+__all__ = ['Watermarks']
+
+try:
+    _monotonic = time.monotonic
+except AttributeError:
+    _monotonic = time.time
+
+
+class Watermarks(object):
+    """
+    Track depth of the queue against *high* and *low* watermarks. Depth
+    is obtained by calling *qsize*, but at most once per *sample_interval*
+    seconds; between samples the depth is estimated from the messages
+    put and got by the owning queue. When depth reaches *high*, *on_high*
+    callback is called, when it falls back to *low*, *on_low* callback
+    is called. Both callbacks receive the current depth as argument.
+    """
+
+    def __init__(self, qsize, high, low=None, on_high=None, on_low=None,
+                 sample_interval=0.01):
+        if low is None:
+            low = high
+        if not 0 <= low <= high:
+            raise ValueError('Watermarks must satisfy 0 <= low <= high')
+        self.high = high
+        self.low = low
+        self.sample_interval = sample_interval
+        self._qsize = qsize
+        self._on_high = on_high
+        self._on_low = on_low
+        self._lock = threading.Lock()
+        self._depth = 0
+        self._sampled_at = None
+        self._above = False
+
+    def depth(self):
+        """
+        Return the cached depth of the queue, sample it if the cached
+        value is older than *sample_interval*.
+        """
+        sampled_at = self._sampled_at
+        if (sampled_at is None or
+                _monotonic() - sampled_at >= self.sample_interval):
+            self.update(self._qsize())
+        return self._depth
+
+    def update(self, depth):
+        """
+        Set the sampled *depth* of the queue.
+        """
+        with self._lock:
+            self._depth = depth
+            self._sampled_at = _monotonic()
+            callback = self._check_crossing()
+        if callback is not None:
+            callback(depth)
+
+    def adjust(self, delta):
+        """
+        Adjust the cached depth by *delta* after a message was put or got
+        by the owning queue. If the cached value is older than
+        *sample_interval*, the queue is sampled instead, so messages put
+        or got through other queue objects are taken into account.
+        """
+        sampled_at = self._sampled_at
+        if (sampled_at is None or
+                _monotonic() - sampled_at >= self.sample_interval):
+            # The sample already includes the message
+            self.update(self._qsize())
+            return
+        with self._lock:
+            self._depth = max(0, self._depth + delta)
+            depth = self._depth
+            callback = self._check_crossing()
+        if callback is not None:
+            callback(depth)
+
+    def is_above(self):
+        """
+        Return ``True`` if the high watermark was reached and depth hasn't
+        fallen to the low watermark since.
+        """
+        self.depth()
+        return self._above
+
+    def drop_probability(self):
+        """
+        Return probability of dropping a low priority message. It is ``0``
+        below the low watermark, ``1`` at the high watermark and grows
+        linearly between them.
+        """
+        depth = self.depth()
+        if depth >= self.high:
+            return 1.0
+        elif depth <= self.low:
+            return 0.0
+        return float(depth - self.low) / (self.high - self.low)
+
+    def should_drop(self):
+        """
+        Randomly decide if a low priority message should be dropped,
+        according to :meth:`drop_probability`.
+        """
+        probability = self.drop_probability()
+        return probability > 0.0 and random.random() < probability
+
+    def _check_crossing(self):
+        if not self._above and self._depth >= self.high:
+            self._above = True
+            return self._on_high
+        elif (self._above and self._depth <= self.low and
+                self._depth < self.high):
+            self._above = False
+            return self._on_low
+        return None
@@ -75,5 +75,6 @@ setup(
     cffi_modules=[
         'cffi_builder_posix.py:ffibuilder',
         'cffi_builder_sysv.py:ffibuilder',
+        'cffi_builder_shmring.py:ffibuilder',
     ],
 )
@@ -0,0 +1,208 @@
+import os
+import signal
+import socket
+import struct
+import subprocess
+import sys
+import time
+
+import pytest
+
+from ipcqueue import bridge
+from ipcqueue.posixmq import Queue
+from ipcqueue.sysvmq import Queue as SysVQueue
+
+
+@pytest.fixture(scope='function')
+def source():
+    mq = Queue('/test_bridge_source', maxsize=10)
+    yield mq
+    mq.close()
+    mq.unlink()
+
+
+@pytest.fixture(scope='function')
+def target():
+    mq = Queue('/test_bridge_target', maxsize=10)
+    yield mq
+    mq.close()
+    mq.unlink()
+
+
+def wait_for(condition, timeout=5):
+    deadline = time.time() + timeout
+    while not condition():
+        if time.time() > deadline:
+            raise AssertionError('Condition not met')
+        time.sleep(0.01)
+
+
+def test_relay(source, target):
+    receiver = bridge.Receiver(target)
+    receiver.start()
+    sender = bridge.Sender(source, receiver.address, batch_size=3)
+    sender.start()
+    try:
+        for i in range(8):
+            source.put([i, 'test message'], priority=i % 2)
+        got = sorted(target.get(timeout=5)[0] for i in range(8))
+        assert got == list(range(8))
+        wait_for(lambda: sender.metrics()['acked'] == 8)
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_relay_keeps_priority(source, target):
+    receiver = bridge.Receiver(target)
+    receiver.start()
+    sender = bridge.Sender(source, receiver.address, linger=0.1)
+    try:
+        source.put([1, 'low'], priority=1)
+        source.put([2, 'high'], priority=5)
+        sender.start()
+        wait_for(lambda: target.qsize() == 2)
+        assert target.get_raw(block=False)[1] == 5
+        assert target.get_raw(block=False)[1] == 1
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_relay_sysvmq():
+    source = SysVQueue(None)
+    target = SysVQueue(None)
+    receiver = bridge.Receiver(target)
+    receiver.start()
+    sender = bridge.Sender(source, receiver.address)
+    sender.start()
+    try:
+        source.put([1, 'test message'], msg_type=3)
+        wait_for(lambda: target.qsize() == 1)
+        assert target.get(msg_type=3) == [1, 'test message']
+    finally:
+        sender.close()
+        receiver.close()
+        source.close()
+        target.close()
+
+
+def test_flow_control(source, target):
+    receiver = bridge.Receiver(target, status_interval=0.01)
+    receiver.start()
+    sender = bridge.Sender(
+        source, receiver.address, batch_size=1, max_remote_depth=3)
+    sender.start()
+    try:
+        for i in range(6):
+            source.put([i, 'test message'])
+        wait_for(lambda: target.qsize() == 3)
+        time.sleep(0.1)
+        assert target.qsize() == 3
+        assert source.qsize() == 3
+        for i in range(3):
+            target.get(timeout=1)
+        wait_for(lambda: source.qsize() == 0)
+    finally:
+        sender.close()
+        receiver.close()
+
+
+def test_resend_after_reconnect(source, target):
+    # Fake receiver answers the hello, reads one batch and drops the
+    # connection without acknowledgement
+    server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    server.bind(('127.0.0.1', 0))
+    server.listen(1)
+    address = server.getsockname()
+
+    sender = bridge.Sender(
+        source, address, linger=0.05, reconnect_interval=0.05)
+    source.put([1, 'test message'])
+    source.put([2, 'test message'])
+    sender.start()
+    try:
+        sock, _ = server.accept()
+        sock.recv(bridge._FRAME.size + bridge._HELLO.size)
+        sock.sendall(bridge._frame(
+            bridge._ACK_FRAME, bridge._ACK.pack(0, 0)))
+        header = sock.recv(bridge._FRAME.size)
+        size = struct.unpack('<I', header[:4])[0]
+        while size > 1:
+            size -= len(sock.recv(size - 1))
+        sock.close()
+        server.close()
+        assert source.qsize() == 0
+
+        receiver = bridge.Receiver(target, address)
+        receiver.start()
+        try:
+            assert target.get(timeout=5) == [1, 'test message']
+            assert target.get(timeout=5) == [2, 'test message']
+            wait_for(lambda: sender.metrics()['pending'] == 0)
+            assert sender.metrics()['resent'] >= 1
+        finally:
+            receiver.close()
+    finally:
+        sender.close()
+
+
+def test_receiver_drops_duplicate_batches(target):
+    receiver = bridge.Receiver(target)
+    receiver.start()
+    sock = socket.create_connection(receiver.address)
+    try:
+        message = b'\x80\x01K\x01.'
+        batch = bridge._frame(bridge._BATCH_FRAME, (
+            bridge._BATCH.pack(1, 1) +
+            bridge._MESSAGE.pack(len(message), 0) + message))
+        sock.sendall(bridge._frame(
+            bridge._HELLO_FRAME, bridge._HELLO.pack(42)))
+        sock.sendall(batch)
+        sock.sendall(batch)
+        wait_for(lambda: receiver.duplicates == 1)
+        assert target.qsize() == 1
+        assert target.get_nowait() == 1
+    finally:
+        sock.close()
+        receiver.close()
+
+
+def test_receiver_drops_rejected_message(source):
+    target = Queue('/test_bridge_small', maxsize=10, maxmsgsize=128)
+    receiver = bridge.Receiver(target)
+    receiver.start()
+    sender = bridge.Sender(source, receiver.address, batch_size=1)
+    sender.start()
+    try:
+        source.put('a' * 500)
+        source.put([1, 'test message'])
+        assert target.get(timeout=5) == [1, 'test message']
+        wait_for(lambda: sender.metrics()['pending'] == 0)
+        assert receiver.dropped == 1
+        assert sender.metrics()['resent'] == 0
+    finally:
+        sender.close()
+        receiver.close()
+        target.close()
+        target.unlink()
+
+
+def test_main_keeps_sysvmq():
+    mq = SysVQueue(0x49504253)
+    try:
+        mq.put('item')
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(
+            os.path.dirname(os.path.abspath(bridge.__file__))))
+        process = subprocess.Popen(
+            [sys.executable, '-m', 'ipcqueue.bridge', 'receive',
+             '--sysvmq', str(0x49504253), '--listen', '127.0.0.1:0'],
+            env=env)
+        time.sleep(0.5)
+        process.send_signal(signal.SIGTERM)
+        assert process.wait(5) == 0
+        # Stopped bridge must not remove the queue with its messages
+        assert mq.get_nowait() == 'item'
+    finally:
+        mq.close()
@@ -0,0 +1,99 @@
+import time
+
+import pytest
+
+from ipcqueue.coalesce import CoalescingProducer
+from ipcqueue.posixmq import Queue
+
+
+@pytest.fixture(scope='function')
+def mq():
+    mq = Queue('/test_coalesce', maxsize=2, maxmsgsize=1024)
+    yield mq
+    mq.close()
+    mq.unlink()
+
+
+def test_update_sends_when_queue_has_room(mq):
+    producer = CoalescingProducer(mq, interval=None)
+    producer.update('a', 1)
+    producer.update('b', 2)
+    assert mq.get_nowait() == 1
+    assert mq.get_nowait() == 2
+    assert producer.metrics() == {
+        'submitted': 2, 'coalesced': 0, 'sent': 2, 'dropped': 0,
+        'pending': 0}
+
+
+def test_update_coalesces_when_queue_is_full(mq):
+    producer = CoalescingProducer(mq, interval=None)
+    producer.update('x', 0)
+    producer.update('y', 0)
+    for i in range(10):
+        producer.update('a', ('a', i))
+        producer.update('b', ('b', i))
+    assert len(producer) == 2
+    assert mq.get_nowait() == 0
+    assert mq.get_nowait() == 0
+    assert producer.flush() is True
+    assert mq.get_nowait() == ('a', 9)
+    assert mq.get_nowait() == ('b', 9)
+    assert producer.metrics() == {
+        'submitted': 22, 'coalesced': 18, 'sent': 4, 'dropped': 0,
+        'pending': 0}
+
+
+def test_update_drops_rejected_item():
+    mq = Queue('/test_coalesce_small', maxsize=2, maxmsgsize=128)
+    producer = CoalescingProducer(mq, interval=None)
+    try:
+        producer.update('big', 'x' * 500)
+        producer.update('a', 1)
+        assert mq.get_nowait() == 1
+        assert producer.metrics() == {
+            'submitted': 2, 'coalesced': 0, 'sent': 1, 'dropped': 1,
+            'pending': 0}
+    finally:
+        producer.close(flush=False)
+        mq.close()
+        mq.unlink()
+
+
+def test_background_flush_survives_errors(mq):
+    producer = CoalescingProducer(mq, interval=0.01)
+    try:
+        producer.update('x', 0)
+        producer.update('y', 0)
+        producer.update('a', 1)
+        producer._queue = None
+        time.sleep(0.05)
+        assert producer._thread.is_alive()
+        producer._queue = mq
+        mq.get_nowait()
+        time.sleep(0.05)
+        assert len(producer) == 0
+    finally:
+        producer.close(flush=False)
+
+
+def test_background_flush(mq):
+    producer = CoalescingProducer(mq, interval=0.01)
+    try:
+        for i in range(5):
+            producer.update(i, i)
+        assert mq.get_nowait() == 0
+        assert mq.get_nowait() == 1
+        time.sleep(0.1)
+        assert mq.qsize() == 2
+        assert len(producer) == 1
+    finally:
+        producer.close(flush=False)
+
+
+def test_close_flushes_pending_updates(mq):
+    producer = CoalescingProducer(mq, interval=None)
+    for i in range(3):
+        producer.update(i, i)
+    mq.get_nowait()
+    producer.close()
+    assert [mq.get_nowait() for i in range(2)] == [1, 2]
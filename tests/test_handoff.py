@@ -0,0 +1,58 @@
+import os
+import threading
+import time
+
+from ipcqueue.handoff import Channel, channel
+
+
+def test_channel_is_shared_by_key():
+    assert channel(('test', 1)) is channel(('test', 1))
+    assert channel(('test', 1)) is not channel(('test', 2))
+
+
+def test_offer_fails_without_waiting_consumer():
+    ch = Channel()
+    assert not ch.offer('item')
+    assert ch.take() == (False, None)
+
+
+def test_offer_to_waiting_consumer():
+    ch = Channel()
+    received = []
+
+    def consume():
+        ch.wait([], 5)
+        received.append(ch.take())
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    deadline = time.time() + 5
+    while not ch.offer('item'):
+        assert time.time() < deadline
+        time.sleep(0.001)
+    consumer.join()
+    assert received == [(True, 'item')]
+    assert len(ch) == 0
+
+
+def test_wait_wakes_on_descriptor():
+    ch = Channel()
+    read_fd, write_fd = os.pipe()
+    try:
+        os.write(write_fd, b'x')
+        start = time.time()
+        ch.wait([read_fd], 5)
+        assert time.time() - start < 1
+    finally:
+        os.close(read_fd)
+        os.close(write_fd)
+
+
+def test_fork_resets_channel():
+    ch = Channel()
+    ch._waiting = 1
+    pid = os.fork()
+    if pid == 0:
+        os._exit(0 if not ch.offer('item') else 1)
+    _, status = os.waitpid(pid, 0)
+    assert os.WEXITSTATUS(status) == 0
@@ -0,0 +1,33 @@
+import subprocess
+import sys
+
+import pytest
+
+
+def imported_modules(statement):
+    output = subprocess.check_output([
+        sys.executable, '-c',
+        statement + '; import sys; print(" ".join(sys.modules))'],
+        universal_newlines=True)
+    return set(output.split())
+
+
+def test_package_import_is_lazy():
+    modules = imported_modules('import ipcqueue')
+    assert not [name for name in modules if name.startswith('ipcqueue.')]
+
+
+def test_submodule_attribute():
+    import ipcqueue
+    assert ipcqueue.serializers.RawSerializer
+    assert 'posixmq' in dir(ipcqueue)
+    with pytest.raises(AttributeError):
+        ipcqueue.missing
+
+
+@pytest.mark.parametrize('backend', ['posixmq', 'sysvmq', 'shmring'])
+def test_backend_import_is_lazy(backend):
+    modules = imported_modules('import ipcqueue.' + backend)
+    assert 'pickle' not in modules
+    for name in ['handoff', 'limits', 'overflow', 'scheduler', 'watermark']:
+        assert 'ipcqueue.' + name not in modules
@@ -0,0 +1,60 @@
+import pytest
+
+from ipcqueue import limits
+
+
+def test_posix_limits():
+    attrs = limits.posix_limits()
+    assert attrs['msg_max'] >= 1
+    assert attrs['msgsize_max'] >= 128
+
+
+def test_sysv_limits():
+    attrs = limits.sysv_limits()
+    assert 0 < attrs['msgmax'] <= 8192
+    assert attrs['msgmnb'] > 0
+
+
+def test_posix_queue_bytes():
+    assert limits.posix_queue_bytes(10, 1024) == 10 * 1024 + 10 * 96
+
+
+def test_plan_posix_budget():
+    plan = limits.plan_posix([100, 200, 1000], budget=10 * 1096)
+    assert plan['maxmsgsize'] == 1000
+    assert plan['maxsize'] == min(10, limits.posix_limits()['msg_max'])
+    assert plan['bytes'] <= 10 * 1096
+
+
+def test_plan_posix_fail_when_budget_too_small():
+    with pytest.raises(ValueError):
+        limits.plan_posix(1000, budget=100)
+
+
+def test_plan_posix_fail_when_message_too_big():
+    with pytest.raises(ValueError):
+        limits.plan_posix(limits.posix_limits()['msgsize_max'] + 1)
+
+
+def test_plan_sysv():
+    plan = limits.plan_sysv([100, 300], budget=1000)
+    assert plan['max_bytes'] == 1000
+    assert plan['expected_size'] == 5
+
+
+def test_plan_sysv_fail_when_message_too_big():
+    with pytest.raises(ValueError):
+        limits.plan_sysv(8193)
+
+
+def test_posix_usage():
+    from ipcqueue.posixmq import Queue
+    mq = Queue('/test_limits', maxsize=2, maxmsgsize=128)
+    try:
+        usage = limits.posix_usage(['/test_limits', '/test_limits_missing'])
+        assert len(usage) == 1
+        assert usage[0]['name'] == '/test_limits'
+        assert usage[0]['bytes'] == limits.posix_queue_bytes(2, 128)
+    finally:
+        mq.close()
+        mq.unlink()
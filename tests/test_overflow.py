@@ -0,0 +1,117 @@
+import os
+
+import pytest
+
+from ipcqueue.overflow import Overflow, SpillBuffer
+
+
+@pytest.fixture(scope='function')
+def spill_dir(tmpdir):
+    return str(tmpdir.join('spill'))
+
+
+def test_append_peek_pop(spill_dir):
+    buf = SpillBuffer(spill_dir)
+    assert buf.peek() is None
+    buf.append(b'first', 1)
+    buf.append(b'second', 2)
+    assert len(buf) == 2
+    assert buf.peek() == (b'first', 1)
+    buf.pop()
+    assert buf.peek() == (b'second', 2)
+    buf.pop()
+    assert len(buf) == 0
+    assert buf.peek() is None
+    buf.close()
+
+
+def test_segment_rotation(spill_dir):
+    buf = SpillBuffer(spill_dir, segment_size=64)
+    for i in range(10):
+        buf.append(b'message %d' % i, i)
+    assert len([n for n in os.listdir(spill_dir) if n.endswith('.seg')]) > 1
+    for i in range(10):
+        assert buf.peek() == (b'message %d' % i, i)
+        buf.pop()
+    buf.checkpoint()
+    assert len([n for n in os.listdir(spill_dir) if n.endswith('.seg')]) == 1
+    buf.close()
+
+
+def test_reopen_restores_backlog(spill_dir):
+    buf = SpillBuffer(spill_dir, segment_size=64)
+    for i in range(5):
+        buf.append(b'message %d' % i, i)
+    buf.pop()
+    buf.close()
+
+    buf = SpillBuffer(spill_dir, segment_size=64)
+    assert len(buf) == 4
+    assert buf.peek() == (b'message 1', 1)
+    buf.close()
+
+
+def test_reopen_truncates_torn_frame(spill_dir):
+    buf = SpillBuffer(spill_dir)
+    buf.append(b'complete', 0)
+    buf.close()
+    segment = [n for n in os.listdir(spill_dir) if n.endswith('.seg')][0]
+    with open(os.path.join(spill_dir, segment), 'ab') as f:
+        f.write(b'\x10\x00\x00\x00torn')
+
+    buf = SpillBuffer(spill_dir)
+    assert len(buf) == 1
+    buf.append(b'next', 0)
+    assert buf.peek() == (b'complete', 0)
+    buf.pop()
+    assert buf.peek() == (b'next', 0)
+    buf.close()
+
+
+def test_overflow_preserves_order(spill_dir):
+    sent = []
+    capacity = [2]
+
+    def send(data, tag):
+        if len(sent) >= capacity[0]:
+            return False
+        sent.append(data)
+        return True
+
+    overflow = Overflow(spill_dir, send, refill_interval=None)
+    for i in range(5):
+        overflow.put(b'%d' % i, 0)
+    assert sent == [b'0', b'1']
+    assert len(overflow) == 3
+    capacity[0] = 4
+    assert overflow.refill() is False
+    overflow.put(b'5', 0)
+    capacity[0] = 10
+    assert overflow.refill() is True
+    assert sent == [b'0', b'1', b'2', b'3', b'4', b'5']
+    overflow.close()
+
+
+def test_overflow_drops_rejected(spill_dir):
+    sent = []
+
+    def send(data, tag):
+        if data == b'too big':
+            raise ValueError(data)
+        sent.append(data)
+        return True
+
+    overflow = Overflow(
+        spill_dir, send, refill_interval=None,
+        rejected=lambda error: isinstance(error, ValueError))
+    overflow._buffer.append(b'too big', 0)
+    overflow._buffer.append(b'next', 0)
+    assert overflow.refill() is True
+    assert sent == [b'next']
+    assert overflow.dropped == 1
+    overflow.close()
+
+    # Dropped message was checkpointed
+    overflow = Overflow(spill_dir, send, refill_interval=None)
+    assert len(overflow) == 0
+    overflow.close()
@@ -3,10 +3,14 @@ try:
     from Queue import Full, Empty
 except ImportError:
     from queue import Full, Empty
+import array
+import select
+import threading
 import time
 
 import pytest
 
+from ipcqueue.serializers import RawSerializer
 from ipcqueue.posixmq import Queue, QueueError
 
 
@@ -71,6 +75,9 @@ def test_unlink_fail_when_does_not_exist():
     assert excinfo.value.errno == QueueError.DOES_NOT_EXIST
 
 
+def test_error_unknown_errno():
+    assert QueueError(-12345).msg == 'Error'
+
 def test_put_get_nowait(mq):
     mq.put_nowait([123, 'test message'])
     mq.put_nowait([456, 'test message'])
@@ -162,3 +169,274 @@ def test_qsize_empty_queue(mq):
 
 def test_qsize_full_queue(mq_full):
     assert mq_full.qsize() == 5
+
+
+def test_put_if_below(mq):
+    mq.put_if_below([1, 'test message'], 2)
+    mq.put_if_below([2, 'test message'], 2)
+    with pytest.raises(Full):
+        mq.put_if_below([3, 'test message'], 2)
+    assert mq.qsize() == 2
+
+
+def test_watermarks_callbacks(mq):
+    events = []
+    mq.set_watermarks(
+        3, low=1, on_high=lambda depth: events.append(('high', depth)),
+        on_low=lambda depth: events.append(('low', depth)))
+    for i in range(4):
+        mq.put_nowait(i)
+    assert events == [('high', 3)]
+    for i in range(3):
+        mq.get_nowait()
+    assert events == [('high', 3), ('low', 1)]
+
+
+def test_watermarks_with_consumer_on_other_handle(mq):
+    events = []
+    consumer = Queue('/test_posixmq')
+    try:
+        mq.set_watermarks(
+            3, low=1, on_high=lambda depth: events.append(('high', depth)),
+            sample_interval=0.01)
+        for i in range(20):
+            mq.put_nowait(i)
+            consumer.get_nowait()
+            time.sleep(0.01)
+        assert mq._watermarks.depth() == 0
+        assert events == []
+    finally:
+        consumer.close()
+
+
+def test_put_or_drop(mq):
+    mq.set_watermarks(4, low=2, sample_interval=0.0)
+    assert mq.put_or_drop([1, 'test message']) is True
+    assert mq.put_or_drop([2, 'test message']) is True
+    for i in range(2):
+        mq.put_nowait(i)
+    assert mq.put_or_drop([5, 'test message']) is False
+    assert mq.qsize() == 4
+
+
+def test_put_or_drop_fail_without_watermarks(mq):
+    with pytest.raises(ValueError):
+        mq.put_or_drop([1, 'test message'])
+
+
+def test_overflow_spills_when_full(mq_full, tmpdir):
+    mq_full.set_overflow(str(tmpdir), refill_interval=None)
+    mq_full.put([6, 'test message'])
+    mq_full.put([7, 'test message'])
+    assert mq_full.qattr()['spilled'] == 2
+    assert mq_full.get_nowait() == [1, 'test message']
+    mq_full.put([8, 'test message'])
+    assert mq_full.qattr()['spilled'] == 2
+    assert [mq_full.get_nowait()[0] for i in range(5)] == [2, 3, 4, 5, 6]
+    mq_full.set_overflow(None)
+
+
+def test_overflow_refiller_thread(mq_full, tmpdir):
+    mq_full.set_overflow(str(tmpdir), refill_interval=0.01)
+    mq_full.put([6, 'test message'])
+    assert mq_full.get_nowait() == [1, 'test message']
+    time.sleep(0.1)
+    assert mq_full.qattr()['spilled'] == 0
+    assert mq_full.qsize() == 5
+
+
+def test_overflow_rejects_too_big_message(mq_full, tmpdir):
+    mq_full.set_overflow(str(tmpdir), refill_interval=0.01)
+    mq_full.put([6, 'test message'])
+    with pytest.raises(QueueError) as excinfo:
+        mq_full.put('a' * 4096)
+    assert excinfo.value.errno == QueueError.TOO_BIG_MESSAGE
+    assert mq_full.qattr()['spilled'] == 1
+    assert mq_full.get_nowait() == [1, 'test message']
+    time.sleep(0.1)
+    assert mq_full.qattr()['spilled'] == 0
+
+
+def test_put_delay(mq):
+    mq.set_scheduler(tick=0.005)
+    mq.put([2, 'later'], delay=0.1)
+    mq.put_at([1, 'sooner'], time.time() + 0.02)
+    with pytest.raises(Empty):
+        mq.get_nowait()
+    assert mq.get(timeout=1) == [1, 'sooner']
+    assert mq.get(timeout=1) == [2, 'later']
+    mq.set_scheduler(False)
+
+
+def test_put_at_rejects_too_big_message(mq):
+    mq.set_scheduler(tick=0.005)
+    with pytest.raises(QueueError) as excinfo:
+        mq.put_at('a' * 4096, time.time())
+    assert excinfo.value.errno == QueueError.TOO_BIG_MESSAGE
+    with pytest.raises(QueueError):
+        mq.put('a' * 4096, delay=0.01)
+    mq.put('later', delay=0.01)
+    assert mq.get(timeout=1) == 'later'
+    mq.set_scheduler(False)
+
+
+def test_put_delay_fail_without_scheduler(mq):
+    with pytest.raises(ValueError):
+        mq.put([1, 'test message'], delay=1)
+
+
+def test_fileno_is_selectable(mq):
+    assert select.select([mq], [], [], 0)[0] == []
+    mq.put_nowait([1, 'test message'])
+    assert select.select([mq], [], [], 0)[0] == [mq]
+
+
+def test_open_auto():
+    mq = Queue.open_auto('/test_posixmq', [100, 300], budget=4 * 396)
+    try:
+        attr = mq.qattr()
+        assert attr['max_msgbytes'] == 300
+        assert attr['max_size'] == 4
+    finally:
+        mq.close()
+        mq.unlink()
+
+
+@pytest.mark.parametrize(
+    'data', [
+        bytearray(b'test message'),
+        memoryview(b'xxtest messagexx')[2:-2],
+        array.array('b', b'test message'),
+        [b'test', bytearray(b' '), memoryview(b'message')],
+        (b'test message',),
+    ],
+    ids=['bytearray', 'memoryview', 'array', 'list', 'tuple']
+)
+def test_put_raw_buffers(data):
+    mq = Queue('/test_posixmq', serializer=RawSerializer)
+    try:
+        mq.put_raw(data)
+        assert mq.get_nowait() == b'test message'
+    finally:
+        mq.close()
+        mq.unlink()
+
+
+def test_put_raw_gather_big_message():
+    mq = Queue('/test_posixmq', maxmsgsize=8192, serializer=RawSerializer)
+    try:
+        mq.put_raw([b'a' * 4000, b'b' * 4000])
+        assert mq.get_nowait() == b'a' * 4000 + b'b' * 4000
+    finally:
+        mq.close()
+        mq.unlink()
+
+
+def test_blocking_get_releases_gil(mq):
+    getter = threading.Thread(target=mq.get)
+    getter.start()
+    start = time.time()
+    time.sleep(0.05)
+    assert time.time() - start < 0.5
+    mq.put_nowait([1, 'test message'])
+    getter.join()
+
+
+def test_concurrent_put_get(mq):
+    received = []
+
+    def produce(base):
+        for i in range(200):
+            mq.put([base + i, 'test message'])
+
+    def consume():
+        for i in range(200):
+            received.append(mq.get()[0])
+
+    threads = [threading.Thread(target=produce, args=(n * 1000,))
+               for n in range(4)]
+    threads.extend(threading.Thread(target=consume) for n in range(4))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(received) == [
+        n * 1000 + i for n in range(4) for i in range(200)]
+
+
+def test_local_handoff_to_waiting_consumer():
+    producer = Queue('/test_posixmq', local=True)
+    consumer = Queue('/test_posixmq', local=True)
+    item = [1, 'test message']
+    received = []
+    try:
+        thread = threading.Thread(
+            target=lambda: received.append(consumer.get(timeout=5)))
+        thread.start()
+        while not producer._handoff._waiting:
+            time.sleep(0.001)
+        producer.put(item)
+        thread.join()
+        assert received[0] is item
+        assert producer.qsize() == 0
+    finally:
+        producer.close()
+        consumer.close()
+        producer.unlink()
+
+
+def test_local_put_without_consumer_uses_kernel():
+    local = Queue('/test_posixmq', local=True)
+    other = Queue('/test_posixmq')
+    try:
+        local.put([1, 'test message'])
+        assert local.qsize() == 1
+        assert other.get_nowait() == [1, 'test message']
+    finally:
+        local.close()
+        other.close()
+        local.unlink()
+
+
+def test_local_consumer_receives_kernel_messages():
+    local = Queue('/test_posixmq', local=True)
+    other = Queue('/test_posixmq')
+    try:
+        timer = threading.Timer(0.05, other.put, args=([1, 'test message'],))
+        timer.start()
+        assert local.get(timeout=5) == [1, 'test message']
+        timer.join()
+        with pytest.raises(Empty):
+            local.get(timeout=0.01)
+    finally:
+        local.close()
+        other.close()
+        local.unlink()
+
+
+def test_local_item_offered_after_kernel_wake_isnt_stranded(monkeypatch):
+    producer = Queue('/test_posixmq', local=True)
+    consumer = Queue('/test_posixmq', local=True)
+    other = Queue('/test_posixmq')
+    item = [2, 'local message']
+    real_select = select.select
+
+    def select_then_offer(rlist, wlist, xlist, timeout=None):
+        # Kernel message wakes the consumer, the item is offered before
+        # the consumer stops waiting
+        other.put([1, 'test message'])
+        result = real_select(rlist, wlist, xlist, timeout)
+        assert producer._handoff.offer(item)
+        return result
+
+    try:
+        monkeypatch.setattr(select, 'select', select_then_offer)
+        assert consumer.get(timeout=5) is item
+        monkeypatch.undo()
+        assert len(consumer._handoff) == 0
+        assert other.get_nowait() == [1, 'test message']
+    finally:
+        producer.close()
+        consumer.close()
+        other.close()
+        producer.unlink()
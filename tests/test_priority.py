@@ -0,0 +1,126 @@
+import threading
+import time
+
+try:
+    from Queue import Empty
+except ImportError:
+    from queue import Empty
+
+import pytest
+
+from ipcqueue.posixmq import Queue
+from ipcqueue.priority import PriorityScheduler
+
+
+@pytest.fixture(scope='function')
+def bands():
+    queues = [Queue('/test_priority_%d' % i, maxsize=10) for i in range(2)]
+    yield queues
+    for q in queues:
+        q.close()
+        q.unlink()
+
+
+def test_weighted_round_robin(bands):
+    for i in range(6):
+        bands[0].put(('urgent', i))
+        bands[1].put(('background', i))
+    scheduler = PriorityScheduler(bands, weights=[2, 1])
+    got = [scheduler.get_nowait()[0] for i in range(9)]
+    assert got == ['urgent', 'urgent', 'background'] * 3
+
+
+def test_low_band_is_not_starved(bands):
+    for i in range(10):
+        bands[0].put(('urgent', i))
+    bands[1].put(('background', 0))
+    scheduler = PriorityScheduler(bands, weights=[4, 1])
+    got = [scheduler.get_nowait()[0] for i in range(5)]
+    assert 'background' in got
+
+
+def test_max_wait_aging(bands):
+    for i in range(5):
+        bands[0].put(('urgent', i))
+    bands[1].put(('background', 0))
+    scheduler = PriorityScheduler(
+        bands, weights=[100, 1], max_wait=[None, 0.05])
+    assert scheduler.get_nowait()[0] == 'urgent'
+    time.sleep(0.06)
+    assert scheduler.get_nowait()[0] == 'background'
+    assert scheduler.stats()[1]['aged'] == 1
+
+
+def test_get_timeout(bands):
+    scheduler = PriorityScheduler(bands)
+    start = time.time()
+    with pytest.raises(Empty):
+        scheduler.get(timeout=0.1)
+    assert time.time() - start >= 0.1
+    with pytest.raises(Empty):
+        scheduler.get_nowait()
+
+
+def test_get_blocks_until_message(bands):
+    scheduler = PriorityScheduler(bands)
+    timer = threading.Timer(0.05, bands[1].put, args=(('background', 0),))
+    timer.start()
+    assert scheduler.get(timeout=5) == ('background', 0)
+    timer.join()
+
+
+def test_split_one_queue(bands):
+    q = bands[0]
+    for i in range(4):
+        q.put(('urgent', i), priority=10)
+    for i in range(2):
+        q.put(('normal', i), priority=3)
+    q.put(('background', 0), priority=0)
+    scheduler = PriorityScheduler.split(q, [10, 1, 0])
+    got = [scheduler.get_nowait()[0] for i in range(3)]
+    assert got == ['urgent', 'normal', 'background']
+
+
+def test_split_low_band_is_not_starved(bands):
+    q = bands[0]
+    for i in range(3):
+        q.put(('background', i), priority=0)
+    scheduler = PriorityScheduler.split(q, [10, 0], prefetch=3)
+    got = []
+    for i in range(50):
+        # Sustained load keeps the kernel queue full of urgent messages
+        while q.qsize() < 10:
+            q.put(('urgent', i), priority=10)
+        got.append(scheduler.get_nowait()[0])
+    assert got.count('background') == 3
+
+
+def test_split_buffering_is_bounded(bands):
+    q = bands[0]
+    scheduler = PriorityScheduler.split(q, [10, 0], prefetch=2)
+    for i in range(2000):
+        while q.qsize() < 10:
+            q.put(('urgent', i), priority=10)
+        scheduler.get_nowait()
+        pending = sum(band['pending'] for band in scheduler.stats())
+        # Prefetch of both bands and one full kernel queue
+        assert pending <= 2 * 2 + 10
+
+
+def test_stats(bands):
+    bands[0].put(('urgent', 0))
+    bands[1].put(('background', 0))
+    scheduler = PriorityScheduler(bands)
+    scheduler.get_nowait()
+    stats = scheduler.stats()
+    assert [band['served'] for band in stats] == [1, 0]
+    assert [band['pending'] for band in stats] == [0, 1]
+    assert stats[0]['latency'].count == 1
+    assert stats[0]['throughput'] > 0
+    scheduler.reset_stats()
+    assert scheduler.stats()[0]['served'] == 0
+
+
+def test_fail_when_weights_dont_match(bands):
+    with pytest.raises(ValueError):
+        PriorityScheduler(bands, weights=[1])
@@ -0,0 +1,123 @@
+import time
+
+import pytest
+
+from ipcqueue.scheduler import Scheduler, TimerWheel
+
+
+def test_wheel_expires_in_order():
+    wheel = TimerWheel(tick=1, now=0)
+    wheel.add(5, 'b')
+    wheel.add(3, 'a')
+    wheel.add(7, 'c')
+    assert len(wheel) == 3
+    assert wheel.advance(2) == []
+    assert wheel.advance(5) == ['a', 'b']
+    assert wheel.advance(10) == ['c']
+    assert len(wheel) == 0
+
+
+def test_wheel_past_timer_expires_on_next_tick():
+    wheel = TimerWheel(tick=1, now=100)
+    wheel.add(50, 'late')
+    assert wheel.advance(101) == ['late']
+
+
+@pytest.mark.parametrize('when', [255, 256, 300, 65535, 65536, 70000])
+def test_wheel_cascades_upper_levels(when):
+    wheel = TimerWheel(tick=1, bits=8, levels=2, now=0)
+    wheel.add(when, 'entry')
+    assert wheel.advance(when - 1) == []
+    assert wheel.advance(when) == ['entry']
+
+
+def test_wheel_skips_time_when_empty():
+    wheel = TimerWheel(tick=1, now=0)
+    assert wheel.advance(10 ** 9) == []
+    wheel.add(10 ** 9 + 5, 'entry')
+    assert wheel.advance(10 ** 9 + 5) == ['entry']
+
+
+def test_scheduler_sends_due_messages():
+    now = time.time()
+    sent = []
+    scheduler = Scheduler(
+        lambda data, tag: sent.append((data, tag)) or True, background=False)
+    scheduler.schedule(b'later', now + 200.0, tag=2)
+    scheduler.schedule(b'sooner', now + 100.0, tag=1)
+    assert scheduler.run_pending(now=now + 150.0) == 1
+    assert sent == [(b'sooner', 1)]
+    assert scheduler.run_pending(now=now + 250.0) == 1
+    assert sent == [(b'sooner', 1), (b'later', 2)]
+    assert len(scheduler) == 0
+    scheduler.close()
+
+
+def test_scheduler_retries_when_queue_is_full():
+    now = time.time()
+    sent = []
+    full = [True]
+
+    def send(data, tag):
+        if full[0]:
+            return False
+        sent.append(data)
+        return True
+
+    scheduler = Scheduler(send, batch_size=2, background=False)
+    for i in range(3):
+        scheduler.schedule(b'%d' % i, now + 100.0)
+    assert scheduler.run_pending(now=now + 200.0) == 0
+    assert len(scheduler) == 3
+    full[0] = False
+    assert scheduler.run_pending(now=now + 200.0) == 2
+    assert scheduler.run_pending(now=now + 200.0) == 1
+    assert sent == [b'0', b'1', b'2']
+    scheduler.close()
+
+
+def test_scheduler_journal_survives_restart(tmpdir):
+    now = time.time()
+    journal = str(tmpdir.join('journal'))
+    sent = []
+
+    def send(data, tag):
+        sent.append((data, tag))
+        return True
+
+    scheduler = Scheduler(send, journal=journal, background=False)
+    scheduler.schedule(b'first', now + 100.0, tag=1)
+    scheduler.schedule(b'second', now + 10 ** 6, tag=2)
+    assert scheduler.run_pending(now=now + 150.0) == 1
+    scheduler.close()
+
+    scheduler = Scheduler(send, journal=journal, background=False)
+    assert len(scheduler) == 1
+    assert scheduler.run_pending(now=now + 10 ** 6 + 1) == 1
+    assert sent == [(b'first', 1), (b'second', 2)]
+    scheduler.close()
+
+    scheduler = Scheduler(send, journal=journal, background=False)
+    assert len(scheduler) == 0
+    scheduler.close()
+
+
+def test_scheduler_drops_rejected():
+    now = time.time()
+    sent = []
+
+    def send(data, tag):
+        if data == b'too big':
+            raise ValueError(data)
+        sent.append(data)
+        return True
+
+    scheduler = Scheduler(
+        send, background=False,
+        rejected=lambda error: isinstance(error, ValueError))
+    scheduler.schedule(b'too big', now + 100.0)
+    scheduler.schedule(b'next', now + 101.0)
+    assert scheduler.run_pending(now=now + 200.0) == 1
+    assert sent == [b'next']
+    assert scheduler.dropped == 1
+    assert len(scheduler) == 0
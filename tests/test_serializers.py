@@ -0,0 +1,43 @@
+# -*- coding: utf-8 -*-
+import pytest
+
+from ipcqueue.posixmq import Queue
+from ipcqueue.serializers import TaggedSerializer
+
+
+@pytest.mark.parametrize(
+    'obj', [
+        None, True, False, 0, -1, 2 ** 63 - 1, -2 ** 63, 2 ** 64, 1.5,
+        b'', b'test message', u'', u'test message', u'žluťoučk\xfd',
+        (1, u'test', b'message'), [1, 2], {'key': b'value'},
+    ]
+)
+def test_tagged_roundtrip(obj):
+    data = TaggedSerializer.dumps(obj)
+    assert isinstance(data, bytes)
+    result = TaggedSerializer.loads(data)
+    assert result == obj
+    assert type(result) is type(obj)
+
+
+def test_tagged_scalars_are_not_pickled():
+    assert TaggedSerializer.dumps(b'test') == b'\x06test'
+    assert TaggedSerializer.dumps(u'test') == b'\x07test'
+    assert len(TaggedSerializer.dumps(12345)) == 9
+
+
+def test_tagged_fail_when_invalid_tag():
+    with pytest.raises(ValueError):
+        TaggedSerializer.loads(b'\xfftest')
+
+
+def test_tagged_queue():
+    mq = Queue('/test_serializers', serializer=TaggedSerializer)
+    try:
+        mq.put(b'test message')
+        mq.put((1, u'test message'))
+        assert mq.get_nowait() == b'test message'
+        assert mq.get_nowait() == (1, u'test message')
+    finally:
+        mq.close()
+        mq.unlink()
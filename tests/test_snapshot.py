@@ -0,0 +1,116 @@
+import pytest
+
+from ipcqueue import posixmq, snapshot, sysvmq
+
+
+@pytest.fixture(scope='function')
+def posix_queues():
+    queues = [
+        posixmq.Queue('/test_snapshot_src', maxsize=10, maxmsgsize=1024),
+        posixmq.Queue('/test_snapshot_dst', maxsize=10, maxmsgsize=2048),
+    ]
+    yield queues
+    for q in queues:
+        q.close()
+        q.unlink()
+
+
+@pytest.fixture(scope='function')
+def sysv_queues():
+    queues = [sysvmq.Queue(None), sysvmq.Queue(None)]
+    yield queues
+    for q in queues:
+        q.close()
+
+
+def test_posixmq_round_trip(posix_queues, tmpdir):
+    src, dst = posix_queues
+    path = str(tmpdir.join('posix.snapshot'))
+    for i in range(6):
+        src.put_raw(b'msg %d' % i, priority=i % 3)
+    src.put_raw(b'')
+
+    assert snapshot.dump(src, path) == 7
+    assert src.qsize() == 0
+    assert snapshot.load(dst, path) == 7
+    got = [dst.get_raw() for i in range(7)]
+    assert got == [
+        (b'msg 2', 2), (b'msg 5', 2), (b'msg 1', 1), (b'msg 4', 1),
+        (b'msg 0', 0), (b'msg 3', 0), (b'', 0),
+    ]
+
+
+def test_sysvmq_round_trip(sysv_queues, tmpdir):
+    src, dst = sysv_queues
+    path = str(tmpdir.join('sysv.snapshot'))
+    for i in range(5):
+        src.put(('item', i), msg_type=i + 1)
+
+    assert snapshot.dump(src, path) == 5
+    assert src.qsize() == 0
+    assert snapshot.load(dst, path) == 5
+    assert [dst.get(msg_type=-5) for i in range(5)] == [
+        ('item', i) for i in range(5)]
+
+
+def test_dump_in_chunks(posix_queues, tmpdir):
+    src, dst = posix_queues
+    path = str(tmpdir.join('posix.snapshot'))
+    for i in range(10):
+        src.put(i)
+
+    # Buffer for one message of the maximum size only
+    assert snapshot.dump(src, path, buffer_size=0) == 10
+    assert snapshot.load(dst, path) == 10
+    assert [dst.get() for i in range(10)] == list(range(10))
+
+
+def test_load_corrupted(posix_queues, tmpdir):
+    src, dst = posix_queues
+    path = tmpdir.join('posix.snapshot')
+    src.put('item')
+    snapshot.dump(src, str(path))
+    data = bytearray(path.read_binary())
+    data[-1] ^= 0xff
+    path.write_binary(bytes(data))
+
+    with pytest.raises(ValueError):
+        snapshot.load(dst, str(path))
+    assert dst.qsize() == 0
+
+
+def test_load_different_kind(posix_queues, sysv_queues, tmpdir):
+    path = str(tmpdir.join('posix.snapshot'))
+    posix_queues[0].put('item')
+    snapshot.dump(posix_queues[0], path)
+
+    with pytest.raises(ValueError):
+        snapshot.load(sysv_queues[0], path)
+
+
+def test_main(posix_queues, tmpdir, capsys):
+    src, dst = posix_queues
+    path = str(tmpdir.join('posix.snapshot'))
+    src.put('item', priority=3)
+
+    snapshot.main(['dump', '--posixmq', '/test_snapshot_src', path])
+    snapshot.main([
+        'load', '--posixmq', '/test_snapshot_dst', '--maxmsgsize', '2048',
+        path])
+    assert dst.get_raw()[1] == 3
+    assert 'Loaded 1 messages' in capsys.readouterr().out
+
+
+def test_main_keeps_sysvmq(tmpdir, capsys):
+    src, dst = sysvmq.Queue(0x49505351), sysvmq.Queue(0x49505352)
+    path = str(tmpdir.join('sysv.snapshot'))
+    try:
+        src.put('item', msg_type=3)
+        snapshot.main(['dump', '--sysvmq', str(0x49505351), path])
+        snapshot.main(['load', '--sysvmq', str(0x49505352), path])
+        # The CLI must not remove queues
+        assert src.qsize() == 0
+        assert dst.get_raw(block=False) == (src._serializer.dumps('item'), 3)
+    finally:
+        src.close()
+        dst.close()
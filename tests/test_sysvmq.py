@@ -3,11 +3,19 @@ try:
     from Queue import Full, Empty
 except ImportError:
     from queue import Full, Empty
+import array
+import threading
 import time
 
+try:
+    import asyncio
+except ImportError:
+    asyncio = None
+
 import pytest
 
-from ipcqueue.sysvmq import Queue, QueueError
+from ipcqueue.serializers import RawSerializer
+from ipcqueue.sysvmq import AsyncQueue, Queue, QueueError
 
 
 @pytest.fixture(scope='function')
@@ -41,6 +49,9 @@ def test_close_fail_when_invalid_descriptor():
     assert excinfo.value.errno == QueueError.INVALID_DESCRIPTOR
 
 
+def test_error_unknown_errno():
+    assert QueueError(-12345).msg == 'Error'
+
 def test_put_get_nowait(mq):
     mq.put_nowait([123, 'test message'])
     mq.put_nowait([456, 'test message'])
@@ -118,3 +129,324 @@ def test_qsize_empty_queue(mq):
 
 def test_qsize_full_queue(mq_full):
     assert mq_full.qsize() == 5
+
+
+def test_put_if_below(mq):
+    mq.put_if_below([1, 'test message'], 2)
+    mq.put_if_below([2, 'test message'], 2)
+    with pytest.raises(Full):
+        mq.put_if_below([3, 'test message'], 2)
+    assert mq.qsize() == 2
+
+
+def test_watermarks_callbacks(mq):
+    events = []
+    mq.set_watermarks(
+        3, low=1, on_high=lambda depth: events.append(('high', depth)),
+        on_low=lambda depth: events.append(('low', depth)))
+    for i in range(4):
+        mq.put_nowait(i)
+    assert events == [('high', 3)]
+    for i in range(3):
+        mq.get_nowait()
+    assert events == [('high', 3), ('low', 1)]
+
+
+def test_put_or_drop(mq):
+    mq.set_watermarks(4, low=2, sample_interval=0.0)
+    assert mq.put_or_drop([1, 'test message']) is True
+    assert mq.put_or_drop([2, 'test message']) is True
+    for i in range(2):
+        mq.put_nowait(i)
+    assert mq.put_or_drop([5, 'test message']) is False
+    assert mq.qsize() == 4
+
+
+def test_overflow_spills_when_full(mq_full, tmpdir):
+    mq_full.set_overflow(str(tmpdir), refill_interval=None)
+    mq_full.put([6, 'a' * 384])
+    mq_full.put([7, 'a' * 384])
+    assert mq_full.qattr()['spilled'] == 2
+    assert mq_full.get_nowait()[0] == 1
+    mq_full.put([8, 'a' * 384])
+    assert mq_full.qattr()['spilled'] == 2
+    assert [mq_full.get_nowait()[0] for i in range(5)] == [2, 3, 4, 5, 6]
+    mq_full.set_overflow(None)
+
+
+def test_put_delay(mq):
+    mq.set_scheduler(tick=0.005)
+    mq.put([2, 'later'], delay=0.1, msg_type=2)
+    mq.put_at([1, 'sooner'], time.time() + 0.02)
+    with pytest.raises(Empty):
+        mq.get_nowait()
+    assert mq.get() == [1, 'sooner']
+    assert mq.get(msg_type=2) == [2, 'later']
+    mq.set_scheduler(False)
+
+
+def test_get_raw_returns_msg_type(mq):
+    mq.put_nowait([1, 'test message'], msg_type=7)
+    data, msg_type = mq.get_raw(block=False)
+    assert msg_type == 7
+    assert mq._serializer.loads(data) == [1, 'test message']
+
+
+def test_open_auto():
+    mq = Queue.open_auto(None, [100, 300], budget=1000)
+    try:
+        assert mq.qattr()['max_bytes'] == 1000
+    finally:
+        mq.close()
+
+
+def test_get_nowait_exclude_type(mq):
+    mq.put_nowait([123, 'test message'], msg_type=1)
+    mq.put_nowait([456, 'test message'], msg_type=2)
+    mq.put_nowait([789, 'test message'], msg_type=3)
+    assert mq.get_nowait(exclude_type=1) == [456, 'test message']
+    assert mq.get_nowait(exclude_type=2) == [123, 'test message']
+    with pytest.raises(Empty):
+        mq.get_nowait(exclude_type=3)
+
+
+def test_get_fail_when_invalid_exclude_type(mq):
+    with pytest.raises(QueueError) as excinfo:
+        mq.get_nowait(msg_type=1, exclude_type=2)
+    assert excinfo.value.errno == QueueError.INVALID_VALUE
+
+
+def test_peek(mq):
+    mq.put_nowait([123, 'test message'], msg_type=1)
+    mq.put_nowait([456, 'test message'], msg_type=2)
+    try:
+        assert mq.peek() == [123, 'test message']
+    except QueueError as e:
+        if e.errno == QueueError.NOT_SUPPORTED:
+            pytest.skip('MSG_COPY is not supported')
+        raise
+    assert mq.peek(1) == [456, 'test message']
+    with pytest.raises(IndexError):
+        mq.peek(2)
+    assert mq.qsize() == 2
+
+
+def test_iter_messages(mq):
+    mq.put_nowait([123, 'test message'], msg_type=1)
+    mq.put_nowait([456, 'test message'], msg_type=2)
+    try:
+        messages = list(mq.iter_messages())
+    except QueueError as e:
+        if e.errno == QueueError.NOT_SUPPORTED:
+            pytest.skip('MSG_COPY is not supported')
+        raise
+    assert messages == [(1, [123, 'test message']), (2, [456, 'test message'])]
+    assert mq.get_nowait() == [123, 'test message']
+
+
+@pytest.mark.parametrize(
+    'data', [
+        bytearray(b'test message'),
+        memoryview(b'xxtest messagexx')[2:-2],
+        array.array('b', b'test message'),
+        [b'test', bytearray(b' '), memoryview(b'message')],
+    ],
+    ids=['bytearray', 'memoryview', 'array', 'list']
+)
+def test_put_raw_buffers(data):
+    mq = Queue(None, serializer=RawSerializer)
+    try:
+        mq.put_raw(data)
+        assert mq.get_nowait() == b'test message'
+    finally:
+        mq.close()
+
+
+def test_put_raw_fail_when_big_gathered_message(mq):
+    with pytest.raises(QueueError) as excinfo:
+        mq.put_raw([b'a' * 1024, b'b' * 1025])
+    assert excinfo.value.errno == QueueError.TOO_BIG_MESSAGE
+
+
+def test_blocking_get_releases_gil(mq):
+    getter = threading.Thread(target=mq.get)
+    getter.start()
+    start = time.time()
+    time.sleep(0.05)
+    assert time.time() - start < 0.5
+    mq.put_nowait([1, 'test message'])
+    getter.join()
+
+
+def test_concurrent_put_get(mq):
+    received = []
+
+    def produce(base):
+        for i in range(200):
+            mq.put([base + i, 'test message'])
+
+    def consume():
+        for i in range(200):
+            received.append(mq.get()[0])
+
+    threads = [threading.Thread(target=produce, args=(n * 1000,))
+               for n in range(4)]
+    threads.extend(threading.Thread(target=consume) for n in range(4))
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert sorted(received) == [
+        n * 1000 + i for n in range(4) for i in range(200)]
+
+
+def test_local_handoff_to_waiting_consumer():
+    producer = Queue(None, local=True)
+    item = [1, 'test message']
+    received = []
+    try:
+        thread = threading.Thread(
+            target=lambda: received.append(producer.get()))
+        thread.start()
+        while not producer._handoff._waiting:
+            time.sleep(0.001)
+        producer.put(item)
+        thread.join()
+        assert received[0] is item
+        assert producer.qsize() == 0
+    finally:
+        producer.close()
+
+
+def test_local_consumer_receives_kernel_messages():
+    local = Queue(None, local=True)
+    try:
+        local.put_nowait([1, 'test message'], msg_type=2)
+        assert local.qsize() == 1
+        assert local.get() == [1, 'test message']
+        with pytest.raises(Empty):
+            local.get_nowait()
+    finally:
+        local.close()
+
+
+@pytest.fixture(scope='function')
+def amq():
+    if asyncio is None:
+        pytest.skip('asyncio is not available')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    amq = AsyncQueue(None, max_bytes=2048)
+    yield loop, amq
+    amq.close()
+    asyncio.set_event_loop(None)
+    loop.close()
+
+
+def test_async_put_get(amq):
+    loop, amq = amq
+    loop.run_until_complete(amq.put([1, 'test message'], msg_type=3))
+    assert amq.qsize() == 1
+    assert loop.run_until_complete(amq.get()) == [1, 'test message']
+
+
+def test_async_getters_share_waiters(amq):
+    loop, amq = amq
+    threads = threading.active_count()
+    futures = [amq.get(msg_type=i % 4 + 1) for i in range(200)]
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert threading.active_count() - threads <= 4
+    for i in range(200):
+        amq.queue.put(i, msg_type=i % 4 + 1)
+    items = loop.run_until_complete(asyncio.gather(*futures))
+    assert items == list(range(200))
+
+
+def test_async_get_cancel_wakes_waiter(amq):
+    loop, amq = amq
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(asyncio.wait_for(amq.get(msg_type=7), 0.05))
+    loop.run_until_complete(asyncio.sleep(0.05))
+    # The sentinel was consumed by the waiter
+    amq.queue.put('message', msg_type=7)
+    assert amq.queue.get_nowait(msg_type=7) == 'message'
+    with pytest.raises(Empty):
+        amq.queue.get_nowait()
+
+
+def test_async_more_msg_types_than_max_threads(amq):
+    loop, amq = amq
+    count = amq._waiters.pool()._max_threads + 6
+    futures = [amq.get(msg_type=i + 1) for i in range(count)]
+    loop.run_until_complete(asyncio.sleep(0.05))
+    amq.queue.put('last', msg_type=count)
+    # Blocked receives don't starve sends
+    puts = [amq.put(b'a' * 384, msg_type=count + 1) for i in range(10)]
+    assert loop.run_until_complete(
+        asyncio.wait_for(futures[-1], 5)) == 'last'
+    for i in range(10):
+        amq.queue.get(msg_type=count + 1)
+    loop.run_until_complete(asyncio.wait_for(asyncio.gather(*puts), 5))
+    for fut in futures[:-1]:
+        fut.cancel()
+
+
+def test_async_get_cancel_races_message(amq):
+    loop, amq = amq
+    send_nowait = amq.queue._send_nowait
+
+    def message_then_sentinel(data, msg_type):
+        # The message arrives just before the sentinel of the cancel
+        if data == amq._WAKE:
+            amq.queue.put('message', msg_type=7)
+        return send_nowait(data, msg_type)
+
+    amq.queue._send_nowait = message_then_sentinel
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(asyncio.wait_for(amq.get(msg_type=7), 0.05))
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert 7 not in amq._getters
+    # The sentinel doesn't stay in the queue for other consumers
+    assert amq.queue.get_nowait(msg_type=7) == 'message'
+    with pytest.raises(Empty):
+        amq.queue.get_nowait()
+
+
+def test_async_put_blocks_when_full(amq):
+    loop, amq = amq
+    puts = [amq.put(b'a' * 384) for i in range(10)]
+    assert not all(put.done() for put in puts)
+    items = [loop.run_until_complete(amq.get()) for i in range(10)]
+    loop.run_until_complete(asyncio.gather(*puts))
+    assert items == [b'a' * 384] * 10
+
+
+def test_async_put_sequence_when_full():
+    if asyncio is None:
+        pytest.skip('asyncio is not available')
+    loop = asyncio.new_event_loop()
+    asyncio.set_event_loop(loop)
+    amq = AsyncQueue(None, max_bytes=2048, serializer=RawSerializer)
+    try:
+        puts = [amq.put([b'a' * 192, b'b' * 192]) for i in range(10)]
+        puts.append(amq.put(array.array('B', b'c' * 384)))
+        items = [loop.run_until_complete(amq.get()) for i in range(11)]
+        loop.run_until_complete(asyncio.gather(*puts))
+        assert items == [b'a' * 192 + b'b' * 192] * 10 + [b'c' * 384]
+    finally:
+        amq.close()
+        asyncio.set_event_loop(None)
+        loop.close()
+
+
+def test_async_get_cancel_wakes_waiter_when_full(amq):
+    loop, amq = amq
+    with pytest.raises(Full):
+        while True:
+            amq.queue.put_raw(b'a' * 384, block=False)
+    with pytest.raises(asyncio.TimeoutError):
+        loop.run_until_complete(asyncio.wait_for(amq.get(msg_type=7), 0.05))
+    # The sentinel is sent when there is free space
+    amq.queue.get_raw(block=False)
+    loop.run_until_complete(asyncio.sleep(0.05))
+    assert 7 not in amq._getters
@@ -0,0 +1,124 @@
+try:
+    from Queue import Full
+except ImportError:
+    from queue import Full
+
+import os
+
+import pytest
+
+from ipcqueue.posixmq import Queue, QueueError
+from ipcqueue.topic import Topic
+
+
+@pytest.fixture(scope='function')
+def registry(tmpdir):
+    return str(tmpdir.join('topics'))
+
+
+@pytest.fixture(scope='function')
+def subscribers():
+    queues = [
+        Queue('/test_topic_{}'.format(i), maxsize=2, maxmsgsize=1024)
+        for i in range(3)
+    ]
+    yield queues
+    for mq in queues:
+        mq.close()
+        mq.unlink()
+
+
+def test_create_fail_when_invalid_name(registry):
+    with pytest.raises(ValueError):
+        Topic('a/b', registry=registry)
+
+
+def test_subscribe_unsubscribe(registry, subscribers):
+    topic = Topic('events', registry=registry)
+    topic.subscribe(subscribers[0])
+    topic.subscribe('/test_topic_1')
+    assert topic.subscribers() == ['/test_topic_0', '/test_topic_1']
+    assert Topic('events', registry=registry).subscribers() == [
+        '/test_topic_0', '/test_topic_1']
+    topic.unsubscribe(subscribers[0])
+    assert topic.subscribers() == ['/test_topic_1']
+
+
+def test_publish(registry, subscribers):
+    topic = Topic('events', registry=registry)
+    for mq in subscribers:
+        topic.subscribe(mq)
+    assert topic.publish([1, 'test message']) == {}
+    assert topic.publish([2, 'test message'], priority=1) == {}
+    for mq in subscribers:
+        assert mq.get_nowait() == [2, 'test message']
+        assert mq.get_nowait() == [1, 'test message']
+    topic.close()
+
+
+def test_publish_skip_slow_subscriber(registry, subscribers):
+    topic = Topic('events', registry=registry)
+    for mq in subscribers:
+        topic.subscribe(mq)
+    subscribers[1].put_nowait(0)
+    subscribers[1].put_nowait(0)
+    errors = topic.publish([1, 'test message'])
+    assert list(errors) == ['/test_topic_1']
+    assert isinstance(errors['/test_topic_1'], Full)
+    assert subscribers[0].qsize() == 1
+    assert subscribers[2].qsize() == 1
+    assert len(topic.subscribers()) == 3
+    topic.close()
+
+
+def test_publish_block_slow_subscriber(registry, subscribers):
+    topic = Topic('events', policy=Topic.BLOCK, registry=registry)
+    topic.subscribe(subscribers[0])
+    subscribers[0].put_nowait(0)
+    subscribers[0].put_nowait(0)
+    errors = topic.publish([1, 'test message'], timeout=0.1)
+    assert isinstance(errors['/test_topic_0'], Full)
+    subscribers[0].get_nowait()
+    assert topic.publish([1, 'test message'], timeout=0.1) == {}
+    topic.close()
+
+
+def test_publish_evict_slow_subscriber(registry, subscribers):
+    topic = Topic('events', policy=Topic.EVICT, registry=registry)
+    for mq in subscribers:
+        topic.subscribe(mq)
+    subscribers[2].put_nowait(0)
+    subscribers[2].put_nowait(0)
+    assert list(topic.publish([1, 'test message'])) == ['/test_topic_2']
+    assert topic.subscribers() == ['/test_topic_0', '/test_topic_1']
+    assert topic.publish([2, 'test message']) == {}
+    topic.close()
+
+
+def test_publish_too_big_message(registry, subscribers):
+    topic = Topic('events', registry=registry)
+    topic.subscribe(subscribers[0])
+    errors = topic.publish('a' * 2048)
+    assert errors['/test_topic_0'].errno == QueueError.TOO_BIG_MESSAGE
+    topic.close()
+
+
+def test_removed_queue_is_unsubscribed(registry):
+    topic = Topic('events', registry=registry)
+    topic.subscribe('/test_topic_missing')
+    assert topic.publish([1, 'test message']) == {}
+    assert topic.subscribers() == []
+
+
+def test_subscriber_registered_in_same_mtime_tick(registry, subscribers):
+    topic = Topic('events', registry=registry)
+    topic.subscribe(subscribers[0])
+    topic.publish('first')
+    path = os.path.join(registry, 'events')
+    stat = os.stat(path)
+    topic.subscribe(subscribers[1])
+    # Coarse timestamps don't change within one tick
+    os.utime(path, (stat.st_atime, stat.st_mtime))
+    assert topic.publish('second') == {}
+    assert subscribers[1].get_nowait() == 'second'
+    topic.close()
@@ -0,0 +1,92 @@
+import pytest
+
+from ipcqueue.posixmq import Queue
+from ipcqueue.serializers import RawSerializer
+from ipcqueue.tracing import Histogram, TracingSerializer
+
+
+def test_histogram_exact_small_values():
+    histogram = Histogram()
+    for value in range(1, 101):
+        histogram.record(value)
+    assert histogram.count == 100
+    assert histogram.min == 1
+    assert histogram.max == 100
+    assert histogram.mean() == 50.5
+    assert histogram.percentile(50) == 50
+    assert histogram.percentile(99) == 99
+    assert histogram.percentile(100) == 100
+
+
+@pytest.mark.parametrize('value', [1000, 123456, 10 ** 9, 2 ** 40 + 7])
+def test_histogram_relative_precision(value):
+    histogram = Histogram()
+    histogram.record(1)
+    histogram.record(value)
+    histogram.record(value * 2)
+    assert abs(histogram.percentile(60) - value) <= value / 64.0
+
+
+def test_histogram_empty():
+    histogram = Histogram()
+    assert histogram.percentile(99) is None
+    assert histogram.mean() is None
+
+
+def test_histogram_merge_snapshot():
+    first = Histogram()
+    second = Histogram()
+    for value in range(10):
+        first.record(value)
+        second.record(value + 10)
+    snapshot = first.snapshot()
+    first.merge(second)
+    assert first.count == 20
+    assert first.min == 0
+    assert first.max == 19
+    assert first.percentile(50) == 9
+    assert snapshot.count == 10
+    first.reset()
+    assert first.count == 0
+
+
+def test_histogram_merge_fail_when_different_precision():
+    with pytest.raises(ValueError):
+        Histogram(7).merge(Histogram(5))
+
+
+def test_serializer_records_residence_time():
+    serializer = TracingSerializer()
+    data = serializer.dumps([1, 'test message'])
+    assert serializer.loads(data) == [1, 'test message']
+    assert serializer.histogram.count == 1
+    assert serializer.gaps == {}
+
+
+def test_serializer_detects_gaps():
+    serializer = TracingSerializer(RawSerializer)
+    messages = [serializer.dumps(b'%d' % i) for i in range(5)]
+    serializer.loads(messages[0])
+    serializer.loads(messages[3])
+    serializer.loads(messages[4])
+    assert list(serializer.gaps.values()) == [2]
+
+
+def test_serializer_without_pid():
+    serializer = TracingSerializer(RawSerializer, pid=False, sequence=False)
+    assert serializer.loads(serializer.dumps(b'test')) == b'test'
+    with pytest.raises(ValueError):
+        TracingSerializer(pid=False, sequence=True)
+
+
+def test_traced_queue():
+    mq = Queue('/test_tracing', serializer=TracingSerializer())
+    try:
+        mq.put_nowait([1, 'test message'])
+        mq.put_nowait([2, 'test message'])
+        assert mq.get_nowait() == [1, 'test message']
+        assert mq.get_nowait() == [2, 'test message']
+        assert mq._serializer.histogram.count == 2
+    finally:
+        mq.close()
+        mq.unlink()
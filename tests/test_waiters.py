@@ -0,0 +1,58 @@
+import threading
+import time
+
+from ipcqueue.waiters import WaiterPool, pool
+
+
+def test_pool_is_shared():
+    assert pool() is pool()
+
+
+def test_jobs_beyond_max_threads_wait():
+    waiters = WaiterPool(max_threads=2, idle_timeout=0.05)
+    release = threading.Event()
+    done = []
+
+    def job(i):
+        release.wait(5)
+        done.append(i)
+
+    for i in range(5):
+        waiters.submit(lambda i=i: job(i))
+    assert len(waiters) == 2
+    release.set()
+    deadline = time.time() + 5
+    while len(done) < 5:
+        assert time.time() < deadline
+        time.sleep(0.001)
+    assert sorted(done) == list(range(5))
+
+
+def test_blocking_jobs_get_thread():
+    waiters = WaiterPool(max_threads=2, idle_timeout=0.05)
+    release = threading.Event()
+    started = []
+
+    def job(i):
+        started.append(i)
+        release.wait(5)
+
+    for i in range(5):
+        waiters.submit(lambda i=i: job(i), blocking=True)
+    deadline = time.time() + 5
+    while len(started) < 5:
+        assert time.time() < deadline
+        time.sleep(0.001)
+    assert len(waiters) == 5
+    release.set()
+
+
+def test_idle_threads_exit():
+    waiters = WaiterPool(idle_timeout=0.01)
+    finished = threading.Event()
+    waiters.submit(finished.set)
+    assert finished.wait(5)
+    deadline = time.time() + 5
+    while len(waiters):
+        assert time.time() < deadline
+        time.sleep(0.005)
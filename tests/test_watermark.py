@@ -0,0 +1,71 @@
+import pytest
+
+from ipcqueue.watermark import Watermarks
+
+
+class FakeQueue(object):
+
+    def __init__(self):
+        self.size = 0
+
+    def qsize(self):
+        return self.size
+
+
+@pytest.fixture(scope='function')
+def fq():
+    return FakeQueue()
+
+
+def test_create_fail_when_invalid_watermarks(fq):
+    with pytest.raises(ValueError):
+        Watermarks(fq.qsize, 2, low=3)
+
+
+def test_depth_is_cached(fq):
+    wm = Watermarks(fq.qsize, 10, sample_interval=3600)
+    assert wm.depth() == 0
+    fq.size = 5
+    assert wm.depth() == 0
+    wm.adjust(2)
+    assert wm.depth() == 2
+
+
+def test_depth_is_sampled(fq):
+    wm = Watermarks(fq.qsize, 10, sample_interval=0.0)
+    fq.size = 5
+    assert wm.depth() == 5
+
+
+def test_hysteresis(fq):
+    events = []
+    wm = Watermarks(
+        fq.qsize, 4, low=2, on_high=events.append,
+        on_low=lambda depth: events.append(-depth), sample_interval=3600)
+    wm.update(4)
+    wm.update(3)
+    wm.update(5)
+    assert events == [4]
+    assert wm.is_above() is True
+    wm.update(2)
+    assert events == [4, -2]
+
+
+def test_drop_probability(fq):
+    wm = Watermarks(fq.qsize, 6, low=2, sample_interval=3600)
+    wm.update(1)
+    assert wm.drop_probability() == 0.0
+    wm.update(4)
+    assert wm.drop_probability() == 0.5
+    wm.update(6)
+    assert wm.drop_probability() == 1.0
+    assert wm.should_drop() is True
+
+
+def test_adjust_resamples_stale_depth(fq):
+    wm = Watermarks(fq.qsize, 10, sample_interval=0.0)
+    wm.adjust(5)
+    assert wm._depth == 0
+    fq.size = 3
+    wm.adjust(1)
+    assert wm._depth == 3